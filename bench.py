@@ -0,0 +1,234 @@
+"""Load test that drives the real handlers through an Application with a recording fake Bot API.
+
+    python bench.py --groups 1,10 --users 10,100 --concurrency 1,16 --output bench.json
+
+Every (groups, users, concurrency) combination plays the same scenario against a scratch
+database and reports per-command throughput, latency percentiles and SQL statements per call
+as JSON, so runs from different commits can be diffed.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import sqlite3
+import tempfile
+import subprocess
+from typing import Any, Callable, Dict, List
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--groups', default='1,10', help="comma-separated group counts to sweep")
+    parser.add_argument('--users', default='10,50', help="comma-separated users-per-group counts to sweep")
+    parser.add_argument('--concurrency', default='1,16', help="comma-separated in-flight update counts to sweep")
+    parser.add_argument('--requests', type=int, default=200, help="updates per read-only command and combination")
+    parser.add_argument('--challenges', type=int, default=100, help="challenges (and answers) per combination")
+    parser.add_argument('--latency', type=float, default=0.0, help="simulated Bot API latency in seconds")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--db', help="database file to use (default: a fresh temporary file)")
+    parser.add_argument('--no-trace', action='store_true', help="skip SQL statement counting")
+    parser.add_argument('--output', help="write the JSON report here instead of stdout")
+    return parser.parse_args()
+
+args = parse_args()
+
+# Configuration is read from the environment at import time, so set it up before importing the bot
+os.environ.setdefault('BOT_TOKEN', '123456:benchmark')
+os.environ['DB_FILE'] = args.db or os.path.join(tempfile.mkdtemp(prefix='kirfight-bench-'), 'bench.db')
+os.environ['DB_QUERY_TRACE'] = '0' if args.no_trace else '1'
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+from telegram import Update
+from telegram.ext import Application
+from config import config
+from database import db_manager
+from handlers import register_handlers
+from query_trace import query_tracer
+from fake_telegram import RecordingRequest, UpdateFactory, callback_data_of
+
+def percentile(samples: List[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+class Bench:
+    def __init__(self, application: Application, request: RecordingRequest, concurrency: int):
+        self.application = application
+        self.request = request
+        self.concurrency = concurrency
+        self.factory = UpdateFactory()
+    
+    async def send(self, payload: Dict[str, Any]) -> float:
+        update = Update.de_json(payload, self.application.bot)
+        start = time.perf_counter()
+        await self.application.process_update(update)
+        return time.perf_counter() - start
+    
+    async def phase(self, command: str, payloads: List[Callable[[], Any]]) -> Dict[str, Any]:
+        """Run one batch of updates with bounded concurrency and summarize it"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        latencies: List[float] = []
+        calls_before = len(self.request.calls)
+        statements_before = query_tracer.snapshot()['calls']
+        
+        async def run_one(make_payload):
+            async with semaphore:
+                latencies.append(await self.send(make_payload()))
+        
+        start = time.perf_counter()
+        await asyncio.gather(*(run_one(make_payload) for make_payload in payloads))
+        elapsed = time.perf_counter() - start
+        
+        count = len(latencies)
+        statements = query_tracer.snapshot()['calls'] - statements_before
+        return {
+            'command': command,
+            'count': count,
+            'seconds': round(elapsed, 4),
+            'throughput': round(count / elapsed, 1) if elapsed else 0.0,
+            'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+            'db_statements_per_call': None if args.no_trace else round(statements / count, 2) if count else 0.0,
+            'api_calls_per_call': round((len(self.request.calls) - calls_before) / count, 2) if count else 0.0
+        }
+    
+    async def challenge_round(self, group: int, challenger: int, opponent: int, action: str) -> Dict[str, float]:
+        """Issue /challenge, then press the opponent's accept or decline button"""
+        challenge = self.factory.message(group, challenger, "/challenge 1", reply_to_user_id=opponent)
+        latencies = {'challenge': await self.send(challenge)}
+        
+        for reply in self.request.replies_to(group, challenge['message']['message_id']):
+            button = next((data for data in callback_data_of(reply) if data.startswith(action)), None)
+            if button is not None:
+                answer = self.factory.callback(group, opponent, button, reply['message_id'])
+                latencies[action] = await self.send(answer)
+        return latencies
+    
+    async def challenges(self, groups: List[int], users: List[int]) -> List[Dict[str, Any]]:
+        """Challenge rounds between random pairs; per-step latencies plus whole-round costs"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        samples: Dict[str, List[float]] = {'challenge': [], 'accept': [], 'decline': [], 'challenge_round': []}
+        calls_before = len(self.request.calls)
+        statements_before = query_tracer.snapshot()['calls']
+        
+        async def run_one():
+            group = random.choice(groups)
+            challenger, opponent = random.sample(users, 2)
+            action = random.choice(['accept', 'accept', 'accept', 'decline'])
+            async with semaphore:
+                latencies = await self.challenge_round(group, challenger, opponent, action)
+            for name, latency in latencies.items():
+                samples[name].append(latency)
+            samples['challenge_round'].append(sum(latencies.values()))
+        
+        start = time.perf_counter()
+        await asyncio.gather(*(run_one() for _ in range(args.challenges)))
+        elapsed = time.perf_counter() - start
+        
+        rounds = len(samples['challenge_round'])
+        statements = query_tracer.snapshot()['calls'] - statements_before
+        results = []
+        for name, latencies in samples.items():
+            whole_round = name == 'challenge_round'
+            results.append({
+                'command': name,
+                'count': len(latencies),
+                'seconds': round(elapsed, 4),
+                'throughput': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+                'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+                'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+                'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+                # The steps of a round share one measurement window, so costs are reported per round
+                'db_statements_per_call': round(statements / rounds, 2) if whole_round and rounds and not args.no_trace else None,
+                'api_calls_per_call': round((len(self.request.calls) - calls_before) / rounds, 2) if whole_round and rounds else None
+            })
+        return results
+
+async def run_combination(index: int, group_count: int, user_count: int, concurrency: int) -> Dict[str, Any]:
+    request = RecordingRequest(latency=args.latency)
+    application = Application.builder().token(config.token).request(request).get_updates_request(RecordingRequest()).build()
+    register_handlers(application)
+    
+    # Distinct id ranges per combination keep runs independent inside one database
+    groups = [-(index * 1_000_000 + g) for g in range(1, group_count + 1)]
+    users = [index * 1_000_000 + u for u in range(1, user_count + 1)]
+    
+    async with application:
+        bench = Bench(application, request, concurrency)
+        factory = bench.factory
+        pick = lambda: (random.choice(groups), random.choice(users))
+        
+        results = [await bench.phase('start', [lambda g=g: factory.message(g, users[0], "/start") for g in groups])]
+        results.append(await bench.phase('grow', [
+            lambda g=g, u=u: factory.message(g, u, "/grow") for g in groups for u in users
+        ]))
+        results.append(await bench.phase('grow_again', [
+            lambda: factory.message(*pick(), "/grow") for _ in range(args.requests)
+        ]))
+        for command in ('leaderboard', 'rank', 'stats', 'quests'):
+            results.append(await bench.phase(command, [
+                lambda command=command: factory.message(*pick(), f"/{command}") for _ in range(args.requests)
+            ]))
+        if user_count >= 2:
+            results.extend(await bench.challenges(groups, users))
+    
+    return {'groups': group_count, 'users': user_count, 'concurrency': concurrency, 'results': results}
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+async def main():
+    random.seed(args.seed)
+    db_manager.initialize_database()
+    
+    combinations = [
+        (int(g), int(u), int(c))
+        for g in args.groups.split(',')
+        for u in args.users.split(',')
+        for c in args.concurrency.split(',')
+    ]
+    runs = []
+    for index, (group_count, user_count, concurrency) in enumerate(combinations, 1):
+        run = await run_combination(index, group_count, user_count, concurrency)
+        runs.append(run)
+        for result in run['results']:
+            print(
+                f"groups={group_count:<4} users={user_count:<5} conc={concurrency:<3} "
+                f"{result['command']:<12} n={result['count']:<5} {result['throughput']:>8.1f}/s "
+                f"p50={result['p50_ms']:>8.2f}ms p95={result['p95_ms']:>8.2f}ms p99={result['p99_ms']:>8.2f}ms "
+                f"sql/call={result['db_statements_per_call']}",
+                file=sys.stderr
+            )
+    
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'db_write_mode': config.db_write_mode,
+        'db_workers': config.db_workers,
+        'args': vars(args),
+        'runs': runs
+    }
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+    
+    db_manager.shutdown()
+
+if __name__ == '__main__':
+    asyncio.run(main())
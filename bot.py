@@ -1,84 +1,189 @@
+import asyncio
 import logging
-import threading
-import os
-from flask import Flask
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler
+import signal
+from typing import Optional
+from telegram import Update
+from telegram.ext import Application
 from config import config
 from database import db_manager
-from handlers import CommandHandlers, ChallengeHandlers, QuestHandlers
+from services import UserService, AsyncUserService, ChallengeService, AsyncChallengeService
+from challenge_registry import challenge_registry
+from handlers import build_handler_chain
+from server import start_web_server
+from metrics import monitor_event_loop_lag, GLOBAL_LEADERBOARD_DRIFT
+from traffic_recorder import UpdateRecorder
+from logging_setup import setup_logging
+from workers import WorkerPool
+from retention import run_retention_pass
 
-# Logging configuration
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=getattr(logging, config.log_level),
-    handlers=[
-        logging.FileHandler('bot.log'),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
 
-# Flask app for health check
-app = Flask(__name__)
+# Opt-in recorder of incoming updates, used to replay real traffic offline; created in main()
+update_recorder: Optional[UpdateRecorder] = None
 
-@app.route('/')
-def health_check():
-    return "✅ Bot is running successfully!"
+# Worker processes that run the handlers in multi-process mode; created in main()
+worker_pool: Optional[WorkerPool] = None
 
-@app.route('/health')
-def health():
-    return {"status": "healthy", "bot": "dick_competition_bot"}
-
-def run_flask():
-    """Run Flask server in a separate thread"""
-    app.run(host='0.0.0.0', port=config.port, debug=False)
+async def on_shutdown(application):
+    """Release resources once the application has stopped"""
+    db_manager.shutdown()
+    logger.info("✅ Database workers stopped")
+    if update_recorder is not None:
+        update_recorder.close()
+        logger.info("✅ Update recording closed")
 
 async def error_handler(update, context):
     """Handle bot errors"""
-    logger.error(f"Update {update} caused error {context.error}")
+    # Log the update id only; formatting the whole Update is slow and leaks user data into the log
+    update_id = update.update_id if isinstance(update, Update) else None
+    logger.error(f"Update {update_id} caused error {context.error!r}", exc_info=context.error)
+
+async def sweep_pending_challenges(interval: float):
+    """Periodically expire unanswered challenges and drop their persisted rows"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            expired = challenge_registry.sweep()
+            if expired:
+                await AsyncChallengeService.discard_pending(expired)
+                logger.debug(f"Expired {len(expired)} pending challenges")
+        except Exception as e:
+            logger.error(f"Error sweeping pending challenges: {e}")
+
+async def reconcile_global_leaderboard(interval: float):
+    """Periodically rebuild the global leaderboard from the users tables to repair drift"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            drifted = await AsyncUserService.reconcile_global_leaderboard()
+            if drifted:
+                GLOBAL_LEADERBOARD_DRIFT.inc(drifted)
+                logger.info(f"Global leaderboard reconciled, {drifted} players repaired")
+        except Exception as e:
+            logger.error(f"Error reconciling global leaderboard: {e}")
+
+async def run_retention(interval: float):
+    """Periodically archive old challenges, prune quest progress and vacuum, in throttled steps"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_retention_pass()
+        except Exception as e:
+            logger.error(f"Error running retention jobs: {e}")
+
+async def start_receiving_updates(application: Application):
+    if config.update_mode == 'webhook':
+        if config.webhook_url:
+            await application.bot.set_webhook(
+                url=config.webhook_url.rstrip('/') + config.webhook_path,
+                secret_token=config.webhook_secret,
+                allowed_updates=Update.ALL_TYPES,
+                drop_pending_updates=True
+            )
+            logger.info(f"🔗 Webhook registered at {config.webhook_url}")
+        else:
+            logger.warning(f"WEBHOOK_URL is not set; POST updates to {config.webhook_path} yourself")
+    else:
+        logger.info("🔄 Starting bot polling...")
+        await application.updater.start_polling(drop_pending_updates=True)
+
+async def run_bot(application: Application):
+    """Run the bot and its HTTP server on one event loop until SIGINT/SIGTERM"""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+    
+    try:
+        async with application:
+            # /health fails while a worker process is down, since its chats get no replies
+            health_checks = {'workers': lambda: worker_pool.healthy} if worker_pool is not None else None
+            web_runner = await start_web_server(application, health_checks)
+            lag_monitor = asyncio.create_task(monitor_event_loop_lag())
+            # Shard files are shared by every worker, so retention runs here, once
+            retention_job = None
+            if config.retention_interval_seconds > 0:
+                retention_job = asyncio.create_task(run_retention(config.retention_interval_seconds))
+            if worker_pool is not None:
+                # Workers own the game state, including pending challenges
+                await worker_pool.start()
+                challenge_sweeper = global_reconciler = None
+            else:
+                challenge_sweeper = asyncio.create_task(sweep_pending_challenges(config.challenge_sweep_seconds))
+                global_reconciler = asyncio.create_task(reconcile_global_leaderboard(config.global_reconcile_seconds))
+            try:
+                await start_receiving_updates(application)
+                await application.start()
+                logger.info(f"✅ Bot running in {config.update_mode} mode")
+                
+                await stop_event.wait()
+                
+                if application.updater.running:
+                    await application.updater.stop()
+                await application.stop()
+                if worker_pool is not None:
+                    await worker_pool.stop()
+            finally:
+                lag_monitor.cancel()
+                if retention_job is not None:
+                    retention_job.cancel()
+                if challenge_sweeper is not None:
+                    challenge_sweeper.cancel()
+                    global_reconciler.cancel()
+                await web_runner.cleanup()
+    finally:
+        await on_shutdown(application)
 
 def main():
+    global update_recorder, worker_pool
+    
+    # Logging configuration: handlers only enqueue, a background thread formats and writes
+    setup_logging()
     logger.info("🚀 Starting Dick Competition Bot...")
     
     try:
         # Initialize database
-        db_manager.migrate_database()
         db_manager.initialize_database()
         logger.info("✅ Database initialized successfully")
         
-        # Start Flask server
-        flask_thread = threading.Thread(target=run_flask, daemon=True)
-        flask_thread.start()
-        logger.info(f"✅ Flask server started on port {config.port}")
+        if config.worker_processes > 0:
+            worker_pool = WorkerPool(config.worker_processes)
+        else:
+            # Bring back challenges that were still open when the bot last stopped
+            restored, discarded = challenge_registry.restore(ChallengeService.load_pending())
+            if discarded:
+                ChallengeService.discard_pending(discarded)
+            logger.info(f"✅ Restored {restored} pending challenges")
+            UserService.reconcile_global_leaderboard()
+            logger.info("✅ Global leaderboard loaded")
         
-        # Build application
-        application = Application.builder().token(config.token).build()
+        if config.record_updates_dir:
+            update_recorder = UpdateRecorder(config.record_updates_dir)
         
-        # Register command handlers
-        application.add_handler(CommandHandler("start", CommandHandlers.start))
-        application.add_handler(CommandHandler("help", CommandHandlers.help))
-        application.add_handler(CommandHandler("echo", CommandHandlers.echo))
-        application.add_handler(CommandHandler("grow", CommandHandlers.grow))
-        application.add_handler(CommandHandler("leaderboard", CommandHandlers.leaderboard))
-        application.add_handler(CommandHandler("stats", CommandHandlers.stats))
-        application.add_handler(CommandHandler("challenge", ChallengeHandlers.challenge))
-        application.add_handler(CommandHandler("quests", QuestHandlers.quests))
+        # Build application
+        # Updates of different chats are handled concurrently; conflicting game operations take player locks.
+        # The front of a worker pool stays sequential so each chat's updates reach their worker in order.
+        concurrency = 1 if worker_pool is not None else max(1, config.concurrent_updates)
+        application = Application.builder().token(config.token).concurrent_updates(concurrency).build()
         
-        # Register callback handlers
-        application.add_handler(CallbackQueryHandler(
-            ChallengeHandlers.handle_challenge_callback, 
-            pattern="^(accept|decline)_"
-        ))
+        # Worker processes get every update the rate limiter lets through for the chats they own
+        build_handler_chain(
+            application,
+            recorder=update_recorder.record if update_recorder is not None else None,
+            dispatch=worker_pool.dispatch if worker_pool is not None else None
+        )
+        if update_recorder is not None:
+            logger.info(f"📼 Recording updates to {config.record_updates_dir}")
+        if worker_pool is not None:
+            logger.info(f"🧵 Dispatching updates to {config.worker_processes} worker processes")
         
         # Register error handler
         application.add_error_handler(error_handler)
         
         logger.info("✅ All handlers registered successfully")
         
-        # Start polling
-        logger.info("🔄 Starting bot polling...")
-        application.run_polling(drop_pending_updates=True)
-        
+        asyncio.run(run_bot(application))
+    
     except Exception as e:
         logger.error(f"❌ Fatal error in main: {e}")
         raise
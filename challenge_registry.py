@@ -0,0 +1,119 @@
+import time
+import secrets
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+from config import config
+
+logger = logging.getLogger(__name__)
+
+class PendingChallenge:
+    __slots__ = ('token', 'challenger_id', 'opponent_id', 'group_id', 'amount', 'expires_at')
+    
+    def __init__(self, token: str, challenger_id: str, opponent_id: str, group_id: str, amount: int, expires_at: float):
+        self.token = token
+        self.challenger_id = challenger_id
+        self.opponent_id = opponent_id
+        self.group_id = group_id
+        self.amount = amount
+        self.expires_at = expires_at
+    
+    @property
+    def pair_key(self) -> Tuple[str, str, str]:
+        return self.group_id, self.challenger_id, self.opponent_id
+
+class ChallengeRegistry:
+    """Open challenges keyed by the short token carried in their buttons' callback data.
+    
+    Every challenge lives for the same TTL, so insertion order is expiry order and both
+    sweeping and overflow eviction only ever touch the oldest entries.
+    """
+    
+    def __init__(self, ttl: float = None, max_pending: int = None):
+        self.ttl = ttl or config.challenge_ttl_seconds
+        self.max_pending = max_pending or config.max_pending_challenges
+        self._pending: 'OrderedDict[str, PendingChallenge]' = OrderedDict()
+        # One open challenge per (group, challenger, opponent); a new one replaces the old
+        self._by_pair: Dict[Tuple[str, str, str], str] = {}
+        self._lock = threading.Lock()
+    
+    def _new_token(self) -> str:
+        while True:
+            token = secrets.token_urlsafe(6)
+            if token not in self._pending:
+                return token
+    
+    def _remove(self, token: str) -> Optional[PendingChallenge]:
+        challenge = self._pending.pop(token, None)
+        if challenge is not None and self._by_pair.get(challenge.pair_key) == token:
+            del self._by_pair[challenge.pair_key]
+        return challenge
+    
+    def _insert(self, challenge: PendingChallenge) -> List[PendingChallenge]:
+        discarded = []
+        replaced = self._by_pair.get(challenge.pair_key)
+        if replaced is not None:
+            discarded.append(self._remove(replaced))
+        discarded.extend(self._sweep(time.time()))
+        while len(self._pending) >= self.max_pending:
+            discarded.append(self._remove(next(iter(self._pending))))
+        self._pending[challenge.token] = challenge
+        self._by_pair[challenge.pair_key] = challenge.token
+        return discarded
+    
+    def create(self, challenger_id: str, opponent_id: str, group_id: str,
+               amount: int) -> Tuple[PendingChallenge, List[PendingChallenge]]:
+        """Open a challenge; also returns the challenges it pushed out (replaced, expired or evicted)"""
+        with self._lock:
+            challenge = PendingChallenge(
+                self._new_token(), challenger_id, opponent_id, group_id, amount, time.time() + self.ttl
+            )
+            return challenge, self._insert(challenge)
+    
+    def get(self, token: str) -> Optional[PendingChallenge]:
+        """Look a challenge up without consuming it; expired challenges are not returned"""
+        challenge = self._pending.get(token)
+        if challenge is None or challenge.expires_at <= time.time():
+            return None
+        return challenge
+    
+    def take(self, token: str) -> Optional[PendingChallenge]:
+        """Remove and return a live challenge; only the first caller for a token gets it"""
+        with self._lock:
+            challenge = self._remove(token)
+        if challenge is None or challenge.expires_at <= time.time():
+            return None
+        return challenge
+    
+    def _sweep(self, now: float) -> List[PendingChallenge]:
+        expired = []
+        while self._pending:
+            token, challenge = next(iter(self._pending.items()))
+            if challenge.expires_at > now:
+                break
+            expired.append(self._remove(token))
+        return expired
+    
+    def sweep(self) -> List[PendingChallenge]:
+        """Drop and return every expired challenge"""
+        with self._lock:
+            return self._sweep(time.time())
+    
+    def restore(self, challenges: Iterable[PendingChallenge]) -> Tuple[int, List[PendingChallenge]]:
+        """Reload persisted challenges after a restart, in expiry order.
+        
+        Returns how many are open again and, like create(), the challenges that were pushed out.
+        """
+        with self._lock:
+            ordered = sorted(challenges, key=lambda c: c.expires_at)
+            discarded = []
+            for challenge in ordered:
+                discarded.extend(self._insert(challenge))
+            return sum(1 for challenge in ordered if challenge.token in self._pending), discarded
+    
+    def __len__(self) -> int:
+        return len(self._pending)
+
+# Global pending challenge registry
+challenge_registry = ChallengeRegistry()
@@ -1,18 +1,91 @@
 import os
 from dataclasses import dataclass
-from typing import Optional
+from typing import Optional, Tuple
+
+# Values allowed for the pragmas that are interpolated into SQL rather than cast to int
+JOURNAL_MODES = ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF')
+SYNCHRONOUS_MODES = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+UPDATE_MODES = ('polling', 'webhook')
+WRITE_MODES = ('sync', 'batched')
 
 @dataclass
 class BotConfig:
     token: str
     db_file: str = 'dick_competition.db'
     port: int = 10000
+    host: str = '0.0.0.0'
+    update_mode: str = 'polling'
+    worker_processes: int = 0
+    worker_metrics_seconds: int = 15
+    worker_check_seconds: int = 5
+    worker_max_restarts: int = 5
+    concurrent_updates: int = 32
+    webhook_url: Optional[str] = None
+    webhook_path: str = '/telegram'
+    webhook_secret: Optional[str] = None
     log_level: str = 'INFO'
+    log_file: Optional[str] = 'bot.log'
+    log_format: str = 'text'
+    log_max_bytes: int = 10485760
+    log_backup_count: int = 5
+    log_rotate_when: Optional[str] = None
+    log_sample: str = 'httpx=0.05'
+    log_queue_size: int = 10000
     max_daily_growth: int = 18
     min_daily_growth: int = 1
     max_challenge_amount: int = 20
     min_challenge_amount: int = 1
+    challenge_ttl_seconds: int = 300
+    max_pending_challenges: int = 10000
+    challenge_sweep_seconds: int = 30
+    rate_limit_user: str = 'grow=3/60,challenge=3/60,leaderboard=5/30,accept=5/10,decline=5/10,*=10/30'
+    rate_limit_chat: str = 'leaderboard=10/60,*=60/60'
+    rate_limit_max_buckets: int = 100000
     leaderboard_limit: int = 10
+    leaderboard_cache_groups: int = 256
+    global_reconcile_seconds: int = 300
+    quest_cache_groups: int = 1024
+    render_cache_entries: int = 4096
+    group_cache_groups: int = 4096
+    db_workers: int = 4
+    db_shards: int = 1
+    db_shard_map: Optional[str] = None
+    db_journal_mode: str = 'WAL'
+    db_synchronous: str = 'NORMAL'
+    db_cache_size: int = -16000
+    db_mmap_size: int = 134217728
+    db_busy_timeout: int = 5000
+    db_write_mode: str = 'sync'
+    db_flush_interval_ms: int = 50
+    db_flush_max_ops: int = 200
+    db_query_trace: bool = False
+    db_slow_query_ms: float = 50.0
+    db_query_top_k: int = 20
+    debug_token: Optional[str] = None
+    retention_interval_seconds: int = 3600
+    history_retention_days: int = 90
+    archive_dir: str = 'archive'
+    retention_batch_rows: int = 1000
+    retention_pause_ms: int = 200
+    vacuum_step_pages: int = 256
+    admin_ids: Tuple[str, ...] = ()
+    record_updates_dir: Optional[str] = None
+    record_max_bytes: int = 67108864
+    record_rotate_seconds: int = 3600
+    record_anonymize: bool = True
+    record_salt: Optional[str] = None
+    
+    def __post_init__(self):
+        if self.update_mode not in UPDATE_MODES:
+            raise ValueError(f"UPDATE_MODE must be one of {', '.join(UPDATE_MODES)}")
+        if self.db_write_mode not in WRITE_MODES:
+            raise ValueError(f"DB_WRITE_MODE must be one of {', '.join(WRITE_MODES)}")
+        self.db_journal_mode = self.db_journal_mode.upper()
+        if self.db_journal_mode not in JOURNAL_MODES:
+            raise ValueError(f"DB_JOURNAL_MODE must be one of {', '.join(JOURNAL_MODES)}")
+        self.db_synchronous = self.db_synchronous.upper()
+        if self.db_synchronous not in SYNCHRONOUS_MODES:
+            raise ValueError(f"DB_SYNCHRONOUS must be one of {', '.join(SYNCHRONOUS_MODES)}")
     
     @classmethod
     def from_env(cls) -> 'BotConfig':
@@ -22,13 +95,69 @@ class BotConfig:
         
         return cls(
             token=token,
+            db_file=os.getenv('DB_FILE', 'dick_competition.db'),
             port=int(os.getenv('PORT', 10000)),
+            host=os.getenv('HOST', '0.0.0.0'),
+            update_mode=os.getenv('UPDATE_MODE', 'polling'),
+            worker_processes=int(os.getenv('WORKER_PROCESSES', 0)),
+            worker_metrics_seconds=int(os.getenv('WORKER_METRICS_SECONDS', 15)),
+            worker_check_seconds=int(os.getenv('WORKER_CHECK_SECONDS', 5)),
+            worker_max_restarts=int(os.getenv('WORKER_MAX_RESTARTS', 5)),
+            concurrent_updates=int(os.getenv('CONCURRENT_UPDATES', 32)),
+            webhook_url=os.getenv('WEBHOOK_URL'),
+            webhook_path=os.getenv('WEBHOOK_PATH', '/telegram'),
+            webhook_secret=os.getenv('WEBHOOK_SECRET'),
             log_level=os.getenv('LOG_LEVEL', 'INFO'),
+            log_file=os.getenv('LOG_FILE', 'bot.log') or None,
+            log_format=os.getenv('LOG_FORMAT', 'text'),
+            log_max_bytes=int(os.getenv('LOG_MAX_BYTES', 10485760)),
+            log_backup_count=int(os.getenv('LOG_BACKUP_COUNT', 5)),
+            log_rotate_when=os.getenv('LOG_ROTATE_WHEN'),
+            log_sample=os.getenv('LOG_SAMPLE', 'httpx=0.05'),
+            log_queue_size=int(os.getenv('LOG_QUEUE_SIZE', 10000)),
             max_daily_growth=int(os.getenv('MAX_DAILY_GROWTH', 18)),
             min_daily_growth=int(os.getenv('MIN_DAILY_GROWTH', 1)),
             max_challenge_amount=int(os.getenv('MAX_CHALLENGE_AMOUNT', 20)),
             min_challenge_amount=int(os.getenv('MIN_CHALLENGE_AMOUNT', 1)),
-            leaderboard_limit=int(os.getenv('LEADERBOARD_LIMIT', 10))
+            challenge_ttl_seconds=int(os.getenv('CHALLENGE_TTL_SECONDS', 300)),
+            max_pending_challenges=int(os.getenv('MAX_PENDING_CHALLENGES', 10000)),
+            challenge_sweep_seconds=int(os.getenv('CHALLENGE_SWEEP_SECONDS', 30)),
+            rate_limit_user=os.getenv('RATE_LIMIT_USER', 'grow=3/60,challenge=3/60,leaderboard=5/30,accept=5/10,decline=5/10,*=10/30'),
+            rate_limit_chat=os.getenv('RATE_LIMIT_CHAT', 'leaderboard=10/60,*=60/60'),
+            rate_limit_max_buckets=int(os.getenv('RATE_LIMIT_MAX_BUCKETS', 100000)),
+            leaderboard_limit=int(os.getenv('LEADERBOARD_LIMIT', 10)),
+            leaderboard_cache_groups=int(os.getenv('LEADERBOARD_CACHE_GROUPS', 256)),
+            global_reconcile_seconds=int(os.getenv('GLOBAL_RECONCILE_SECONDS', 300)),
+            quest_cache_groups=int(os.getenv('QUEST_CACHE_GROUPS', 1024)),
+            render_cache_entries=int(os.getenv('RENDER_CACHE_ENTRIES', 4096)),
+            group_cache_groups=int(os.getenv('GROUP_CACHE_GROUPS', 4096)),
+            db_workers=int(os.getenv('DB_WORKERS', 4)),
+            db_shards=int(os.getenv('DB_SHARDS', 1)),
+            db_shard_map=os.getenv('DB_SHARD_MAP'),
+            db_journal_mode=os.getenv('DB_JOURNAL_MODE', 'WAL'),
+            db_synchronous=os.getenv('DB_SYNCHRONOUS', 'NORMAL'),
+            db_cache_size=int(os.getenv('DB_CACHE_SIZE', -16000)),
+            db_mmap_size=int(os.getenv('DB_MMAP_SIZE', 134217728)),
+            db_busy_timeout=int(os.getenv('DB_BUSY_TIMEOUT', 5000)),
+            db_write_mode=os.getenv('DB_WRITE_MODE', 'sync'),
+            db_flush_interval_ms=int(os.getenv('DB_FLUSH_INTERVAL_MS', 50)),
+            db_flush_max_ops=int(os.getenv('DB_FLUSH_MAX_OPS', 200)),
+            db_query_trace=os.getenv('DB_QUERY_TRACE', '0').lower() in ('1', 'true', 'yes'),
+            db_slow_query_ms=float(os.getenv('DB_SLOW_QUERY_MS', 50)),
+            db_query_top_k=int(os.getenv('DB_QUERY_TOP_K', 20)),
+            debug_token=os.getenv('DEBUG_TOKEN'),
+            retention_interval_seconds=int(os.getenv('RETENTION_INTERVAL_SECONDS', 3600)),
+            history_retention_days=int(os.getenv('HISTORY_RETENTION_DAYS', 90)),
+            archive_dir=os.getenv('ARCHIVE_DIR', 'archive'),
+            retention_batch_rows=int(os.getenv('RETENTION_BATCH_ROWS', 1000)),
+            retention_pause_ms=int(os.getenv('RETENTION_PAUSE_MS', 200)),
+            vacuum_step_pages=int(os.getenv('VACUUM_STEP_PAGES', 256)),
+            admin_ids=tuple(i.strip() for i in os.getenv('ADMIN_IDS', '').split(',') if i.strip()),
+            record_updates_dir=os.getenv('RECORD_UPDATES_DIR'),
+            record_max_bytes=int(os.getenv('RECORD_MAX_BYTES', 67108864)),
+            record_rotate_seconds=int(os.getenv('RECORD_ROTATE_SECONDS', 3600)),
+            record_anonymize=os.getenv('RECORD_ANONYMIZE', '1').lower() in ('1', 'true', 'yes'),
+            record_salt=os.getenv('RECORD_SALT')
         )
 
 config = BotConfig.from_env()
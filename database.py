@@ -1,135 +1,336 @@
 import sqlite3
 import logging
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Set
 from config import config
+from migrations import MIGRATIONS, HOT_QUERIES, unindexed_plan_steps
+from metrics import DB_CALL_LATENCY, DB_POOL_WAIT, DB_CALLS_IN_FLIGHT, DB_POOL_CONNECTIONS
+from leaderboard import leaderboard_cache
+from render_cache import render_cache
+from quest_cache import quest_cache
+from group_registry import group_registry
+from query_trace import TracingConnection
+from sharding import ShardRouter, shard_paths, load_shard_map
 
 logger = logging.getLogger(__name__)
 
 class DatabaseManager:
-    def __init__(self, db_file: str = None):
+    def __init__(self, db_file: str = None, workers: int = None, shards: int = None,
+                 shard_map: Dict[str, int] = None):
         self.db_file = db_file or config.db_file
+        # Groups are spread over one or more database files so unrelated chats write in parallel
+        self.router = ShardRouter(
+            shards or config.db_shards,
+            load_shard_map(config.db_shard_map) if shard_map is None else shard_map
+        )
+        self.db_files = shard_paths(self.db_file, self.router.shards)
+        # Bounded pool of threads that run all blocking sqlite3 work
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers or config.db_workers,
+            thread_name_prefix='db-worker'
+        )
+        # One long-lived connection per thread, reused across get_connection calls
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
         
+        # Write-behind mode: every call to a shard shares its one connection and commits are grouped.
+        # All state is per shard, so shards still batch and write in parallel.
+        self.batched = config.db_write_mode == 'batched'
+        self._batch_locks = [threading.RLock() for _ in self.shards]
+        self._batch_connections: Dict[int, sqlite3.Connection] = {}
+        self._batch_commits: List[List[bool]] = [[] for _ in self.shards]
+        self._pending_ops = [0 for _ in self.shards]
+        # Groups whose committed calls are still waiting for their shard's group commit
+        self._unflushed_groups: List[Set[str]] = [set() for _ in self.shards]
+        self._flush_stop = threading.Event()
+        self._flush_thread: Optional[threading.Thread] = None
+        if self.batched:
+            self._flush_thread = threading.Thread(target=self._flush_loop, name='db-flusher', daemon=True)
+            self._flush_thread.start()
+    
+    async def run(self, func, *args, **kwargs):
+        """Run a blocking database call on the DB worker pool and await its result"""
+        loop = asyncio.get_running_loop()
+        operation = getattr(func, '__qualname__', repr(func))
+        submitted = time.perf_counter()
+        
+        def timed_call():
+            started = time.perf_counter()
+            DB_POOL_WAIT.labels(operation).observe(started - submitted)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                DB_CALL_LATENCY.labels(operation).observe(time.perf_counter() - started)
+        
+        DB_CALLS_IN_FLIGHT.inc()
+        try:
+            return await loop.run_in_executor(self._executor, timed_call)
+        finally:
+            DB_CALLS_IN_FLIGHT.dec()
+    
+    def shutdown(self):
+        """Wait for pending database calls, flush batched writes and close pooled connections"""
+        self._executor.shutdown(wait=True)
+        if self._flush_thread:
+            self._flush_stop.set()
+            self._flush_thread.join()
+        self.flush()
+        self.close_connections()
+    
+    def close_connections(self):
+        """Close every pooled connection opened by any thread"""
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            try:
+                connection.close()
+            except sqlite3.Error as e:
+                logger.error(f"Error closing database connection: {e}")
+        self._local = threading.local()
+        self._batch_connections = {}
+    
+    @property
+    def shards(self) -> range:
+        return range(self.router.shards)
+    
+    def shard_for(self, group_id: Optional[str]) -> int:
+        """Shard holding a group's rows; data that belongs to no group lives on shard 0"""
+        return 0 if group_id is None else self.router.shard_for(str(group_id))
+    
+    def _connect(self, shard: int = 0) -> sqlite3.Connection:
+        """Open a connection and apply the per-connection pragmas once"""
+        connection = sqlite3.connect(
+            self.db_files[shard],
+            timeout=config.db_busy_timeout / 1000,
+            check_same_thread=False,
+            factory=TracingConnection if config.db_query_trace else sqlite3.Connection
+        )
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA foreign_keys = ON")
+        connection.execute(f"PRAGMA journal_mode = {config.db_journal_mode}")
+        connection.execute(f"PRAGMA synchronous = {config.db_synchronous}")
+        connection.execute(f"PRAGMA cache_size = {int(config.db_cache_size)}")
+        connection.execute(f"PRAGMA mmap_size = {int(config.db_mmap_size)}")
+        connection.execute(f"PRAGMA busy_timeout = {int(config.db_busy_timeout)}")
+        with self._connections_lock:
+            self._connections.append(connection)
+        return connection
+    
     @contextmanager
-    def get_connection(self):
-        connection = None
+    def connect_direct(self, shard: int = 0):
+        """A private, unpooled connection for migrations and maintenance work"""
+        connection = sqlite3.connect(self.db_files[shard], timeout=config.db_busy_timeout / 1000)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA foreign_keys = ON")
+        try:
+            yield connection
+        finally:
+            connection.close()
+    
+    def get_connection(self, group_id: Optional[str] = None):
+        """Context manager yielding the connection that service code should use for a group"""
+        shard = self.shard_for(group_id)
+        if self.batched:
+            return self._batched_connection(shard, group_id)
+        return self._pooled_connection(shard)
+    
+    def get_shard_connection(self, shard: int):
+        """Connection to one shard, for work that has to visit every shard"""
+        if self.batched:
+            return self._batched_connection(shard)
+        return self._pooled_connection(shard)
+    
+    def commit(self, connection: sqlite3.Connection):
+        """Commit the caller's work; in batched mode it only joins the next group commit"""
+        if not self.batched:
+            connection.commit()
+            return
+        
+        # Like a real commit this covers the work of every enclosing block too
+        shard = next(shard for shard, batch in self._batch_connections.items() if batch is connection)
+        commits = self._batch_commits[shard]
+        commits[:] = [True] * len(commits)
+        self._pending_ops[shard] += 1
+    
+    def flush(self):
+        """Commit every batched write that is still pending.
+        
+        A shard whose commit fails is rolled back, and the in-memory views of its groups,
+        which already show those writes, are dropped so they reload from disk.
+        """
+        if not self.batched:
+            return
+        for shard in self.shards:
+            self._drop_views(self._flush_shard(shard))
+    
+    def _flush_shard(self, shard: int) -> Set[str]:
+        """Group-commit one shard; returns the groups whose writes were lost to a failed commit"""
+        with self._batch_locks[shard]:
+            connection = self._batch_connections.get(shard)
+            lost_groups: Set[str] = set()
+            if connection is not None and connection.in_transaction:
+                try:
+                    connection.commit()
+                except sqlite3.Error as e:
+                    lost_groups = self._unflushed_groups[shard]
+                    logger.error(f"Discarding unflushed writes of shard {shard} ({len(lost_groups)} groups): {e}")
+                    try:
+                        connection.rollback()
+                    except sqlite3.Error as rollback_error:
+                        logger.error(f"Error rolling back shard {shard}: {rollback_error}")
+            if self._pending_ops[shard]:
+                logger.debug(f"Flushed {self._pending_ops[shard]} batched operations on shard {shard}")
+            self._pending_ops[shard] = 0
+            self._unflushed_groups[shard] = set()
+            return lost_groups
+    
+    @staticmethod
+    def _drop_views(group_ids: Set[str]):
+        # The global leaderboard is repaired by its periodic reconciliation
+        for group_id in group_ids:
+            leaderboard_cache.invalidate(group_id)
+            quest_cache.invalidate(group_id)
+            group_registry.invalidate(group_id)
+            render_cache.bump(group_id)
+    
+    def _flush_loop(self):
+        interval = config.db_flush_interval_ms / 1000
+        while not self._flush_stop.wait(interval):
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                logger.error(f"Error flushing batched writes: {e}")
+    
+    @contextmanager
+    def _pooled_connection(self, shard: int):
+        connections = getattr(self._local, 'connections', None)
+        if connections is None:
+            connections = self._local.connections = {}
+            self._local.depths = {}
+        connection = connections.get(shard)
+        if connection is None:
+            connection = connections[shard] = self._connect(shard)
+            self._local.depths[shard] = 0
+        
+        depths = self._local.depths
+        depths[shard] += 1
         try:
-            connection = sqlite3.connect(self.db_file)
-            connection.row_factory = sqlite3.Row
-            connection.execute("PRAGMA foreign_keys = ON")
             yield connection
         except sqlite3.Error as e:
-            if connection:
-                connection.rollback()
             logger.error(f"Database error: {e}")
             raise
         finally:
-            if connection:
-                connection.close()
+            depths[shard] -= 1
+            # The connection outlives this block, so never leave a transaction open on it
+            if depths[shard] == 0 and connection.in_transaction:
+                connection.rollback()
     
-    def initialize_database(self):
-        """Initialize all database tables"""
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Users table
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id TEXT,
-                    group_id TEXT,
-                    username TEXT,
-                    length INTEGER DEFAULT 0,
-                    last_growth DATE,
-                    total_challenges INTEGER DEFAULT 0,
-                    challenges_won INTEGER DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    PRIMARY KEY (user_id, group_id)
-                )
-            """)
-            
-            # Quests table
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS quests (
-                    quest_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    group_id TEXT,
-                    title TEXT NOT NULL,
-                    description TEXT NOT NULL,
-                    reward INTEGER NOT NULL,
-                    requirements TEXT,
-                    quest_type TEXT DEFAULT 'manual',
-                    target_value INTEGER DEFAULT 0,
-                    is_active BOOLEAN DEFAULT 1,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # User quests progress
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS user_quests (
-                    user_id TEXT,
-                    group_id TEXT,
-                    quest_id INTEGER,
-                    progress INTEGER DEFAULT 0,
-                    completed BOOLEAN DEFAULT 0,
-                    completed_at TIMESTAMP,
-                    PRIMARY KEY (user_id, group_id, quest_id),
-                    FOREIGN KEY (quest_id) REFERENCES quests(quest_id) ON DELETE CASCADE
-                )
-            """)
-            
-            # Challenge history
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS challenge_history (
-                    challenge_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    challenger_id TEXT,
-                    opponent_id TEXT,
-                    group_id TEXT,
-                    amount INTEGER,
-                    winner_id TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
+    @contextmanager
+    def _batched_connection(self, shard: int, group_id: Optional[str] = None):
+        lost_groups: Set[str] = set()
+        with self._batch_locks[shard]:
+            connection = self._batch_connections.get(shard)
+            if connection is None:
+                connection = self._batch_connections[shard] = self._connect(shard)
+            if not connection.in_transaction:
+                # Take the write lock up front: a batch that has only read so far could otherwise
+                # fail with SQLITE_BUSY_SNAPSHOT once another connection commits to the file
+                connection.execute("BEGIN IMMEDIATE")
             
-            # Group settings
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS group_settings (
-                    group_id TEXT PRIMARY KEY,
-                    group_name TEXT,
-                    daily_growth_enabled BOOLEAN DEFAULT 1,
-                    challenges_enabled BOOLEAN DEFAULT 1,
-                    quests_enabled BOOLEAN DEFAULT 1,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
+            # Each block runs in a savepoint so a failed or uncommitted call
+            # is undone without discarding the rest of the pending batch
+            commits = self._batch_commits[shard]
+            savepoint = f"batch_op_{len(commits)}"
+            connection.execute(f"SAVEPOINT {savepoint}")
+            commits.append(False)
+            try:
+                yield connection
+            except sqlite3.Error as e:
+                logger.error(f"Database error: {e}")
+                raise
+            finally:
+                if not commits.pop():
+                    connection.execute(f"ROLLBACK TO {savepoint}")
+                elif group_id is not None:
+                    self._unflushed_groups[shard].add(str(group_id))
+                connection.execute(f"RELEASE {savepoint}")
             
-            conn.commit()
-            logger.info("Database initialized successfully")
+            if not commits and self._pending_ops[shard] >= config.db_flush_max_ops:
+                lost_groups = self._flush_shard(shard)
+        self._drop_views(lost_groups)
+    
+    def initialize_database(self):
+        """Create or upgrade the schema to the latest version"""
+        self.migrate_database()
+        
+        problems = self.check_query_plans()
+        for name, steps in problems.items():
+            logger.warning(f"Hot query '{name}' is not fully indexed: {steps}")
+        logger.info("Database initialized successfully")
+    
+    @staticmethod
+    def _read_schema_version(cursor: sqlite3.Cursor) -> int:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+        return cursor.fetchone()[0]
     
     def migrate_database(self):
-        """Handle database migrations"""
-        with self.get_connection() as conn:
+        """Bring every shard up to the latest schema"""
+        for shard in self.shards:
+            self.migrate_shard(shard)
+    
+    def migrate_shard(self, shard: int):
+        """Apply pending schema migrations to one shard in order, each in its own transaction"""
+        with self.connect_direct(shard) as conn:
             cursor = conn.cursor()
+            # Only takes effect on a new file, and only on the connection that creates its first
+            # table; older files switch with retention_tool.py
+            cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            current_version = self._read_schema_version(cursor)
             
-            # Check and add missing columns
-            cursor.execute("PRAGMA table_info(users)")
-            columns = [column[1] for column in cursor.fetchall()]
-            
-            migrations = [
-                ("total_challenges", "ALTER TABLE users ADD COLUMN total_challenges INTEGER DEFAULT 0"),
-                ("challenges_won", "ALTER TABLE users ADD COLUMN challenges_won INTEGER DEFAULT 0"),
-                ("updated_at", "ALTER TABLE users ADD COLUMN updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP")
-            ]
-            
-            for column_name, migration_sql in migrations:
-                if column_name not in columns:
-                    try:
-                        cursor.execute(migration_sql)
-                        logger.info(f"Added {column_name} column to users table")
-                    except sqlite3.Error as e:
-                        logger.error(f"Migration error for {column_name}: {e}")
-            
-            conn.commit()
+            for version, name, migration in MIGRATIONS:
+                if version <= current_version:
+                    continue
+                
+                try:
+                    cursor.execute("BEGIN IMMEDIATE")
+                    migration(cursor)
+                    cursor.execute(
+                        "INSERT INTO schema_version (version, name) VALUES (?, ?)",
+                        (version, name)
+                    )
+                    conn.commit()
+                except sqlite3.Error as e:
+                    conn.rollback()
+                    logger.error(f"Migration {version} ({name}) failed on {self.db_files[shard]}: {e}")
+                    raise
+                
+                logger.info(f"Applied migration {version} to {self.db_files[shard]}: {name}")
+    
+    def check_query_plans(self) -> Dict[str, List[str]]:
+        """Map each hot query that is not served by an index to its offending plan steps"""
+        problems = {}
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            for name, (sql, params) in HOT_QUERIES.items():
+                steps = unindexed_plan_steps(cursor, sql, params)
+                if steps:
+                    problems[name] = steps
+        return problems
 
 # Global database manager instance
 db_manager = DatabaseManager()
+
+# Reported for the bot's own manager only; tools and benchmarks build throwaway ones
+DB_POOL_CONNECTIONS.set_function(lambda: len(db_manager._connections))
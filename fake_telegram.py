@@ -0,0 +1,121 @@
+import asyncio
+import itertools
+import json
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from telegram.request import BaseRequest, RequestData
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "KirFight", "username": "kir_fight_bot"}
+
+class RecordingRequest(BaseRequest):
+    """Bot API transport that answers locally and records every call instead of contacting Telegram"""
+    
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: List[Dict[str, Any]] = []
+        self._message_ids = itertools.count(1_000_000)
+    
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return None
+    
+    async def initialize(self):
+        pass
+    
+    async def shutdown(self):
+        pass
+    
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None,
+                         read_timeout=None, write_timeout=None, connect_timeout=None,
+                         pool_timeout=None) -> Tuple[int, bytes]:
+        endpoint = url.rsplit('/', 1)[-1]
+        params = request_data.json_parameters if request_data else {}
+        result = self._result(endpoint, params)
+        self.calls.append({'endpoint': endpoint, 'params': params, 'result': result})
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+    
+    def _result(self, endpoint: str, params: Dict[str, Any]):
+        if endpoint == 'getMe':
+            return BOT_USER
+        if endpoint in ('sendMessage', 'editMessageText'):
+            message = {
+                "message_id": int(params.get('message_id') or next(self._message_ids)),
+                "date": int(time.time()),
+                "chat": {"id": int(params.get('chat_id', 0)), "type": "supergroup"},
+                "from": BOT_USER,
+                "text": params.get('text', '')
+            }
+            if 'reply_markup' in params:
+                message["reply_markup"] = json.loads(params['reply_markup'])
+            return message
+        return True
+    
+    def replies_to(self, chat_id: int, message_id: int) -> List[Dict[str, Any]]:
+        """Messages the bot sent in answer to one incoming message"""
+        return [
+            call['result'] for call in self.calls
+            if call['endpoint'] == 'sendMessage'
+            and int(call['params'].get('chat_id', 0)) == chat_id
+            and int(call['params'].get('reply_to_message_id', 0)) == message_id
+        ]
+
+def callback_data_of(message: Dict[str, Any]) -> List[str]:
+    """Callback data of every inline button on a message the bot sent"""
+    keyboard = message.get('reply_markup', {}).get('inline_keyboard', [])
+    return [button['callback_data'] for row in keyboard for button in row if 'callback_data' in button]
+
+class UpdateFactory:
+    """Builds Bot API update payloads for commands and inline-button presses"""
+    
+    def __init__(self):
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+    
+    @staticmethod
+    def user(user_id: int) -> Dict[str, Any]:
+        return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}", "username": f"user{user_id}"}
+    
+    @staticmethod
+    def chat(chat_id: int) -> Dict[str, Any]:
+        return {"id": chat_id, "type": "supergroup", "title": f"group{chat_id}"}
+    
+    def message(self, chat_id: int, user_id: int, text: str,
+                reply_to_user_id: Optional[int] = None) -> Dict[str, Any]:
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": self.chat(chat_id),
+            "from": self.user(user_id),
+            "text": text
+        }
+        if text.startswith('/'):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        if reply_to_user_id is not None:
+            message["reply_to_message"] = {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": self.chat(chat_id),
+                "from": self.user(reply_to_user_id),
+                "text": "..."
+            }
+        return {"update_id": next(self._update_ids), "message": message}
+    
+    def callback(self, chat_id: int, user_id: int, data: str, message_id: int) -> Dict[str, Any]:
+        return {
+            "update_id": next(self._update_ids),
+            "callback_query": {
+                "id": str(next(self._update_ids)),
+                "chat_instance": str(chat_id),
+                "from": self.user(user_id),
+                "data": data,
+                "message": {
+                    "message_id": message_id,
+                    "date": int(time.time()),
+                    "chat": self.chat(chat_id),
+                    "from": BOT_USER,
+                    "text": "..."
+                }
+            }
+        }
@@ -0,0 +1,72 @@
+import threading
+from typing import Dict, List, Optional, Tuple
+from leaderboard import GroupRanking
+from models import User
+
+# Rankings need a group; the global one uses this placeholder
+GLOBAL_GROUP = '*'
+
+class GlobalLeaderboard:
+    """Players ranked by their length summed over every group they play in.
+    
+    Kept current in memory from the deltas of grow, challenge and quest reward events, so
+    reading it never touches the database. Deltas are applied once their write committed;
+    those of groups owned by another worker process, or of batched writes that fail to
+    flush, make it drift, and reconcile() replaces it with totals recomputed from the
+    users tables.
+    """
+    
+    def __init__(self):
+        self._ranking = GroupRanking()
+        self._lock = threading.Lock()
+        self.loaded = False
+    
+    def apply(self, user_id: str, delta: int, username: Optional[str] = None):
+        """Add a length change of one player in one group"""
+        with self._lock:
+            if not self.loaded:
+                # The initial load will count it
+                return
+            user = self._ranking.get(user_id)
+            if user is None:
+                user = User(user_id=user_id, group_id=GLOBAL_GROUP, username=username or user_id)
+            self._ranking.upsert(User(
+                user_id=user_id, group_id=GLOBAL_GROUP,
+                username=username or user.username, length=user.length + delta
+            ))
+    
+    def reconcile(self, totals: Dict[str, Tuple[str, int]]) -> int:
+        """Replace the ranking with recomputed {user_id: (username, total length)}; returns how many players were off"""
+        ranking = GroupRanking([
+            User(user_id=user_id, group_id=GLOBAL_GROUP, username=username, length=length)
+            for user_id, (username, length) in totals.items()
+        ])
+        with self._lock:
+            drifted = 0
+            if self.loaded:
+                present = 0
+                for user_id, (_, length) in totals.items():
+                    user = self._ranking.get(user_id)
+                    present += user is not None
+                    if user is None or user.length != length:
+                        drifted += 1
+                # Players that no longer exist at all
+                drifted += len(self._ranking) - present
+            self._ranking = ranking
+            self.loaded = True
+            return drifted
+    
+    def top(self, limit: int) -> List[User]:
+        with self._lock:
+            return self._ranking.top(limit)
+    
+    def rank(self, user_id: str) -> Tuple[Optional[int], Optional[User], int]:
+        """Return (rank, player, total players) for one user"""
+        with self._lock:
+            return self._ranking.rank(user_id), self._ranking.get(user_id), len(self._ranking)
+    
+    def __len__(self) -> int:
+        return len(self._ranking)
+
+# Global cross-group leaderboard
+global_leaderboard = GlobalLeaderboard()
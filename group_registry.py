@@ -0,0 +1,68 @@
+import threading
+import logging
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+from models import GroupSettings
+from config import config
+
+logger = logging.getLogger(__name__)
+
+class GroupRegistry:
+    """Per-group settings flags read by the handlers, evicting the least recently used group"""
+    
+    def __init__(self, max_groups: int = None):
+        self.max_groups = max_groups or config.group_cache_groups
+        self._groups: 'OrderedDict[str, GroupSettings]' = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped on every invalidation so a load that raced with one is not stored
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+    
+    def _store(self, settings: GroupSettings):
+        self._groups[settings.group_id] = settings
+        self._groups.move_to_end(settings.group_id)
+        if len(self._groups) > self.max_groups:
+            self._groups.popitem(last=False)
+    
+    def peek(self, group_id: str) -> Optional[GroupSettings]:
+        """Cached settings of a group, or None when they would have to be loaded"""
+        with self._lock:
+            settings = self._groups.get(group_id)
+            if settings is not None:
+                self.hits += 1
+                self._groups.move_to_end(group_id)
+            return settings
+    
+    def get(self, group_id: str, loader: Callable[[str], GroupSettings]) -> GroupSettings:
+        settings = self.peek(group_id)
+        if settings is not None:
+            return settings
+        with self._lock:
+            self.misses += 1
+            generation = self._generation
+        
+        settings = loader(group_id)
+        with self._lock:
+            if generation == self._generation:
+                self._store(settings)
+        return settings
+    
+    def invalidate(self, group_id: str):
+        with self._lock:
+            self._generation += 1
+            self._groups.pop(group_id, None)
+        logger.debug(f"Invalidated settings of group {group_id}")
+    
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'groups': len(self._groups),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0
+            }
+
+# Global group settings cache
+group_registry = GroupRegistry()
@@ -1,27 +1,41 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ContextTypes
-from services import UserService, ChallengeService, QuestService
+from telegram.error import BadRequest
+from telegram.ext import Application, ContextTypes, CommandHandler, CallbackQueryHandler, TypeHandler
+from services import AsyncUserService, AsyncChallengeService, AsyncQuestService, AsyncGroupService
 from config import config
+from metrics import track_handler, record_handler_error
+from query_trace import query_tracer
+from challenge_registry import challenge_registry
+from render_cache import render_cache
+from global_leaderboard import global_leaderboard
+from locks import player_locks
+from ratelimit import RateLimiter, rate_limiter
 import logging
 
 logger = logging.getLogger(__name__)
 
 class CommandHandlers:
     @staticmethod
+    @track_handler('start')
     async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = str(update.effective_user.id)
         group_id = str(update.effective_chat.id)
         username = update.effective_user.username or update.effective_user.first_name
         
-        # Create default quests for new groups
-        QuestService.create_default_quests(group_id)
+        # Register the group and create its default quests the first time it is seen
+        await AsyncGroupService.bootstrap_group(group_id, update.effective_chat.title)
         
         welcome_text = (
             "🎉 به مسابقه کیر کلفتا خوش اومدی!\n\n"
             "🎯 دستورات موجود:\n"
             "/grow - روزانه کیرت رو بزرگ کن\n"
             "/leaderboard - جدول امتیازات\n"
+            "/rank - رتبه تو در جدول\n"
+            "/global - جدول جهانی\n"
             "/challenge - چالش کن\n"
+            "/history - سابقه چالش‌ها\n"
+            "/vs - رو در رو با کسی (ریپلای)\n"
+            "/rivals - رقابت‌های گروه\n"
             "/quests - ماموریت‌ها\n"
             "/stats - آمار شخصی\n"
             "/help - راهنما"
@@ -30,12 +44,18 @@ class CommandHandlers:
         await update.message.reply_text(welcome_text)
     
     @staticmethod
+    @track_handler('help')
     async def help(update: Update, context: ContextTypes.DEFAULT_TYPE):
         help_text = (
             "📖 راهنمای کامل:\n\n"
             "🌱 /grow - هر روز یکبار استفاده کن تا کیرت بزرگ شه\n"
-            "🏆 /leaderboard - ببین تو جدول چندمی\n"
+            "🏆 /leaderboard [صفحه] - ببین تو جدول چندمی\n"
+            "🏅 /rank - رتبه دقیقت تو گروه\n"
+            "🌍 /global - برترین‌ها در همه گروه‌ها\n"
             "⚔️ /challenge [مقدار] - با ریپلای کردن کسی رو چالش کن\n"
+            "📜 /history - چالش‌های هفت روز اخیرت\n"
+            "🤺 /vs - با ریپلای، نتیجه رو در روی خودت و اون نفر\n"
+            "🔥 /rivals - بزرگ‌ترین رقابت‌های گروه\n"
             "📜 /quests - ماموریت‌هات رو ببین\n"
             "📊 /stats - آمار کاملت رو ببین\n"
             "🔊 /echo - متن ریپلای شده رو تکرار کن\n\n"
@@ -45,6 +65,7 @@ class CommandHandlers:
         await update.message.reply_text(help_text)
     
     @staticmethod
+    @track_handler('echo')
     async def echo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if update.message.reply_to_message:
             replied_text = update.message.reply_to_message.text
@@ -53,70 +74,199 @@ class CommandHandlers:
             await update.message.reply_text("⚠️ برای تکرار پیام، ابتدا به پیامی ریپلای کن")
     
     @staticmethod
+    @track_handler('grow')
     async def grow(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = str(update.effective_user.id)
         group_id = str(update.effective_chat.id)
         username = update.effective_user.username or update.effective_user.first_name
         
         try:
-            success, message, growth, new_length = UserService.grow_user(user_id, group_id, username)
+            settings = await AsyncGroupService.get_settings(group_id)
+            if not settings.daily_growth_enabled:
+                await update.message.reply_text("⚠️ رشد روزانه در این گروه غیرفعاله")
+                return
+            
+            async with player_locks.hold((group_id, user_id)):
+                success, message, growth, new_length = await AsyncUserService.grow_user(user_id, group_id, username)
             await update.message.reply_text(message)
         except Exception as e:
             logger.error(f"Error in grow command: {e}")
+            record_handler_error('grow')
             await update.message.reply_text("⚠️ خطا در انجام عملیات")
     
     @staticmethod
+    def _render_leaderboard_page(users, page: int, total_pages: int):
+        offset = (page - 1) * config.leaderboard_limit
+        leaderboard_text = "🏆 جدول کیرکلفتا 🏆\n\n"
+        medals = ["🥇", "🥈", "🥉"]
+        
+        for i, user in enumerate(users, offset + 1):
+            medal = medals[i-1] if i <= 3 else f"{i}."
+            win_rate = f" (W: {user.win_rate:.1f}%)" if user.total_challenges > 0 else ""
+            leaderboard_text += f"{medal} {user.username}: {user.length} cm{win_rate}\n"
+        
+        if total_pages == 1:
+            return leaderboard_text, None
+        
+        leaderboard_text += f"\n📄 صفحه {page} از {total_pages}"
+        buttons = []
+        if page > 1:
+            buttons.append(InlineKeyboardButton("⬅️ قبلی", callback_data=f"leaderboard_{page - 1}"))
+        if page < total_pages:
+            buttons.append(InlineKeyboardButton("بعدی ➡️", callback_data=f"leaderboard_{page + 1}"))
+        return leaderboard_text, InlineKeyboardMarkup([buttons])
+    
+    @staticmethod
+    async def _leaderboard_reply(group_id: str, page: int):
+        """(text, markup) of a leaderboard page, rendered once per group version"""
+        reply = render_cache.get('leaderboard', group_id, page)
+        if reply is not None:
+            return reply
+        
+        version = render_cache.version(group_id)
+        users, shown_page, total_pages = await AsyncUserService.get_leaderboard_page(group_id, page)
+        if users:
+            reply = CommandHandlers._render_leaderboard_page(users, shown_page, total_pages)
+        else:
+            reply = "📋 هنوز کسی در مسابقه شرکت نکرده!", None
+        render_cache.put('leaderboard', group_id, page, version, reply)
+        return reply
+    
+    @staticmethod
+    @track_handler('leaderboard')
     async def leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
         group_id = str(update.effective_chat.id)
         
         try:
-            top_users = UserService.get_leaderboard(group_id)
-            
-            if not top_users:
-                await update.message.reply_text("📋 هنوز کسی در مسابقه شرکت نکرده!")
+            page = int(context.args[0]) if context.args else 1
+        except ValueError:
+            page = 1
+        
+        try:
+            leaderboard_text, reply_markup = await CommandHandlers._leaderboard_reply(group_id, page)
+            await update.message.reply_text(leaderboard_text, reply_markup=reply_markup)
+        except Exception as e:
+            logger.error(f"Error in leaderboard command: {e}")
+            record_handler_error('leaderboard')
+            await update.message.reply_text("⚠️ خطا در دریافت جدول امتیازات")
+    
+    @staticmethod
+    @track_handler('leaderboard_callback')
+    async def handle_leaderboard_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        group_id = str(query.message.chat.id)
+        
+        try:
+            page = int(query.data.split('_')[1])
+            leaderboard_text, reply_markup = await CommandHandlers._leaderboard_reply(group_id, page)
+            try:
+                await query.edit_message_text(leaderboard_text, reply_markup=reply_markup)
+            except BadRequest as e:
+                # The page already shown, or one clamped to it, leaves the message as it is
+                if 'not modified' not in str(e).lower():
+                    raise
+        except Exception as e:
+            logger.error(f"Error in leaderboard callback: {e}")
+            record_handler_error('leaderboard_callback')
+            await query.answer("⚠️ خطا در دریافت جدول امتیازات", show_alert=True)
+            return
+        
+        await query.answer()
+    
+    @staticmethod
+    @track_handler('global')
+    async def global_ranking(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user_id = str(update.effective_user.id)
+        
+        # Served from memory; no database work however many groups and players there are
+        users = global_leaderboard.top(config.leaderboard_limit)
+        if not users:
+            await update.message.reply_text("📋 هنوز کسی در مسابقه شرکت نکرده!")
+            return
+        
+        text = "🌍 جدول جهانی کیرکلفتا 🌍\n\n"
+        medals = ["🥇", "🥈", "🥉"]
+        for i, user in enumerate(users, 1):
+            medal = medals[i-1] if i <= 3 else f"{i}."
+            text += f"{medal} {user.username}: {user.length} cm\n"
+        
+        position, user, total = global_leaderboard.rank(user_id)
+        if position is not None:
+            text += f"\n🏅 رتبه تو: {position} از {total} ({user.length} cm)"
+        
+        await update.message.reply_text(text)
+    
+    @staticmethod
+    @track_handler('rank')
+    async def rank(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user_id = str(update.effective_user.id)
+        group_id = str(update.effective_chat.id)
+        
+        try:
+            position, user, above, total = await AsyncUserService.get_user_rank(user_id, group_id)
+            if position is None:
+                await update.message.reply_text("⚠️ ابتدا با دستور /grow در مسابقه شرکت کن")
                 return
             
-            leaderboard_text = "🏆 جدول کیرکلفتا 🏆\n\n"
-            medals = ["🥇", "🥈", "🥉"]
-            
-            for i, user in enumerate(top_users, 1):
-                medal = medals[i-1] if i <= 3 else f"{i}."
-                win_rate = f" (W: {user.win_rate:.1f}%)" if user.total_challenges > 0 else ""
-                leaderboard_text += f"{medal} {user.username}: {user.length} cm{win_rate}\n"
+            rank_text = (
+                f"🏅 رتبه {user.username}: {position} از {total}\n"
+                f"📏 طول: {user.length} سانتی‌متر"
+            )
+            if above:
+                rank_text += f"\n⬆️ تا {above.username}: {above.length - user.length} سانتی‌متر"
             
-            await update.message.reply_text(leaderboard_text)
+            await update.message.reply_text(rank_text)
         except Exception as e:
-            logger.error(f"Error in leaderboard command: {e}")
-            await update.message.reply_text("⚠️ خطا در دریافت جدول امتیازات")
+            logger.error(f"Error in rank command: {e}")
+            record_handler_error('rank')
+            await update.message.reply_text("⚠️ خطا در دریافت رتبه")
     
     @staticmethod
+    @track_handler('stats')
     async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = str(update.effective_user.id)
         group_id = str(update.effective_chat.id)
         
         try:
-            user = UserService.get_user_stats(user_id, group_id)
+            stats_text = render_cache.get('stats', group_id, user_id)
+            if stats_text is not None:
+                await update.message.reply_text(stats_text)
+                return
+            
+            version = render_cache.version(group_id)
+            user = await AsyncUserService.get_user_stats(user_id, group_id)
             if not user:
                 await update.message.reply_text("⚠️ ابتدا با دستور /grow در مسابقه شرکت کن")
                 return
             
+            position, _, _, total = await AsyncUserService.get_user_rank(user_id, group_id)
+            
             stats_text = (
                 f"📊 آمار {user.username}:\n\n"
                 f"📏 طول: {user.length} سانتی‌متر\n"
+                f"🏅 رتبه: {position} از {total}\n"
                 f"⚔️ کل چالش‌ها: {user.total_challenges}\n"
                 f"🏆 برد: {user.challenges_won}\n"
                 f"📈 درصد برد: {user.win_rate:.1f}%\n"
                 f"📅 آخرین رشد: {user.last_growth or 'هنوز نداشته'}"
             )
+            render_cache.put('stats', group_id, user_id, version, stats_text)
             
             await update.message.reply_text(stats_text)
         except Exception as e:
             logger.error(f"Error in stats command: {e}")
+            record_handler_error('stats')
             await update.message.reply_text("⚠️ خطا در دریافت آمار")
 
 class ChallengeHandlers:
     @staticmethod
+    @track_handler('challenge')
     async def challenge(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        settings = await AsyncGroupService.get_settings(str(update.effective_chat.id))
+        if not settings.challenges_enabled:
+            await update.message.reply_text("⚠️ چالش در این گروه غیرفعاله")
+            return
+        
         if not update.message.reply_to_message:
             await update.message.reply_text("⚠️ برای چالش باید به پیام کسی ریپلای کنی")
             return
@@ -138,7 +288,7 @@ class ChallengeHandlers:
         group_id = str(update.effective_chat.id)
         
         try:
-            can_challenge, message = ChallengeService.can_challenge(
+            can_challenge, message = await AsyncChallengeService.can_challenge(
                 challenger_id, opponent_id, group_id, challenge_value
             )
             
@@ -146,10 +296,14 @@ class ChallengeHandlers:
                 await update.message.reply_text(message)
                 return
             
+            # The buttons carry only a short token; the challenge itself stays on the server
+            pending, discarded = challenge_registry.create(challenger_id, opponent_id, group_id, challenge_value)
+            await AsyncChallengeService.save_pending(pending, discarded)
+            
             keyboard = [
                 [
-                    InlineKeyboardButton("✅ قبول", callback_data=f"accept_{challenger_id}_{challenge_value}_{group_id}_{opponent_id}"),
-                    InlineKeyboardButton("❌ رد", callback_data=f"decline_{challenger_id}_{group_id}_{opponent_id}")
+                    InlineKeyboardButton("✅ قبول", callback_data=f"accept_{pending.token}"),
+                    InlineKeyboardButton("❌ رد", callback_data=f"decline_{pending.token}")
                 ]
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
@@ -162,52 +316,62 @@ class ChallengeHandlers:
             )
         except Exception as e:
             logger.error(f"Error in challenge command: {e}")
+            record_handler_error('challenge')
             await update.message.reply_text("⚠️ خطا در ایجاد چالش")
     
     @staticmethod
+    @track_handler('challenge_callback')
     async def handle_challenge_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
-        data_parts = query.data.split('_')
-        action = data_parts[0]
-        challenger_id = data_parts[1]
-        
-        if action == "accept":
-            challenge_value = int(data_parts[2])
-            callback_group_id = data_parts[3]
-            opponent_id_expected = data_parts[4]
-        else:
-            callback_group_id = data_parts[2]
-            opponent_id_expected = data_parts[3]
+        action, _, token = query.data.partition('_')
         
         opponent_id_actual = str(query.from_user.id)
         current_group_id = str(query.message.chat.id)
         
+        pending = challenge_registry.get(token)
+        if pending is None:
+            await query.answer("⌛ این چالش منقضی شده یا قبلاً جواب داده شده", show_alert=True)
+            return
+        
         # Validation
-        if callback_group_id != current_group_id:
+        if pending.group_id != current_group_id:
             await query.answer("این چالش برای این گروه نیست!", show_alert=True)
             return
         
-        if opponent_id_actual != opponent_id_expected:
+        if opponent_id_actual != pending.opponent_id:
             await query.answer("فقط کسی که بهش چالش دادی می‌تونه جواب بده!", show_alert=True)
             return
         
+        # Only the first press of either button gets past this point
+        if challenge_registry.take(token) is None:
+            await query.answer("⌛ این چالش منقضی شده یا قبلاً جواب داده شده", show_alert=True)
+            return
+        
+        challenge_value = pending.amount
+        
         if action == "decline":
+            await AsyncChallengeService.discard_pending([pending])
             await query.edit_message_text("❌ چالش رد شد!")
             return
         
         try:
-            winner_id, loser_id, winner_new_length, loser_new_length = ChallengeService.execute_challenge(
-                challenger_id, opponent_id_actual, current_group_id, challenge_value
-            )
+            # Challenges opened before an admin turned them off cannot be played either
+            settings = await AsyncGroupService.get_settings(current_group_id)
+            if not settings.challenges_enabled:
+                await AsyncChallengeService.discard_pending([pending])
+                await query.edit_message_text("⚠️ چالش در این گروه غیرفعاله")
+                return
+            
+            # Both players' lengths are read and rewritten, so nothing else may change them meanwhile
+            async with player_locks.hold((current_group_id, pending.challenger_id), (current_group_id, pending.opponent_id)):
+                accepted, message, result = await AsyncChallengeService.accept_challenge(pending)
+            if not accepted:
+                await query.edit_message_text(message)
+                return
+            winner_id, loser_id, winner_new_length, loser_new_length = result
             
             # Get usernames for display
-            with db_manager.get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    "SELECT user_id, username FROM users WHERE (user_id = ? OR user_id = ?) AND group_id = ?",
-                    (winner_id, loser_id, current_group_id)
-                )
-                users = {row['user_id']: row['username'] for row in cursor.fetchall()}
+            users = await AsyncUserService.get_usernames([winner_id, loser_id], current_group_id)
             
             winner_name = users[winner_id]
             loser_name = users[loser_id]
@@ -221,21 +385,126 @@ class ChallengeHandlers:
             )
         except Exception as e:
             logger.error(f"Error in challenge execution: {e}")
+            record_handler_error('challenge_callback')
             await query.answer("⚠️ خطا در انجام چالش", show_alert=True)
+    
+    @staticmethod
+    @track_handler('history')
+    async def history(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user_id = str(update.effective_user.id)
+        group_id = str(update.effective_chat.id)
+        
+        try:
+            user = await AsyncUserService.get_user_stats(user_id, group_id)
+            if not user:
+                await update.message.reply_text("⚠️ ابتدا با دستور /grow در مسابقه شرکت کن")
+                return
+            
+            days = await AsyncChallengeService.get_daily_stats(user_id, group_id, 7)
+            text = (
+                f"📜 سابقه چالش‌های {user.username}:\n\n"
+                f"⚔️ کل چالش‌ها: {user.total_challenges}\n"
+                f"🏆 برد: {user.challenges_won} ({user.win_rate:.1f}%)\n\n"
+                f"📅 هفت روز اخیر:\n"
+            )
+            for day in days:
+                text += f"{day.day}: {day.challenges} چالش، {day.wins} برد، +{day.gained}/-{day.lost} cm\n"
+            if not days:
+                text += "این هفته چالشی نداشتی"
+            
+            await update.message.reply_text(text)
+        except Exception as e:
+            logger.error(f"Error in history command: {e}")
+            record_handler_error('history')
+            await update.message.reply_text("⚠️ خطا در دریافت سابقه چالش‌ها")
+    
+    @staticmethod
+    @track_handler('vs')
+    async def vs(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if not update.message.reply_to_message:
+            await update.message.reply_text("⚠️ برای دیدن نتیجه رو در رو باید به پیام کسی ریپلای کنی")
+            return
+        
+        user_id = str(update.effective_user.id)
+        other_id = str(update.message.reply_to_message.from_user.id)
+        group_id = str(update.effective_chat.id)
+        if user_id == other_id:
+            await update.message.reply_text("⚠️ نمیتونی با خودت مقایسه کنی")
+            return
+        
+        try:
+            pair = await AsyncChallengeService.get_head_to_head(user_id, other_id, group_id)
+            if pair is None:
+                await update.message.reply_text("⚔️ شما هنوز با هم چالش نکردید")
+                return
+            
+            users = await AsyncUserService.get_usernames([user_id, other_id], group_id)
+            user_name = users.get(user_id, user_id)
+            other_name = users.get(other_id, other_id)
+            await update.message.reply_text(
+                f"🤺 {user_name} در برابر {other_name}\n\n"
+                f"⚔️ کل چالش‌ها: {pair.challenges}\n"
+                f"🏆 {user_name}: {pair.wins_of(user_id)} برد\n"
+                f"🏆 {other_name}: {pair.wins_of(other_id)} برد\n"
+                f"📏 نتیجه خالص برای {user_name}: {pair.net_of(user_id):+d} cm\n"
+                f"🕒 آخرین چالش: {pair.last_at}"
+            )
+        except Exception as e:
+            logger.error(f"Error in vs command: {e}")
+            record_handler_error('vs')
+            await update.message.reply_text("⚠️ خطا در دریافت نتیجه رو در رو")
+    
+    @staticmethod
+    @track_handler('rivals')
+    async def rivals(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        group_id = str(update.effective_chat.id)
+        
+        try:
+            pairs = await AsyncChallengeService.get_rivalries(group_id, 5)
+            if not pairs:
+                await update.message.reply_text("⚔️ هنوز چالشی در این گروه انجام نشده!")
+                return
+            
+            player_ids = list({player for pair in pairs for player in (pair.player_a, pair.player_b)})
+            users = await AsyncUserService.get_usernames(player_ids, group_id)
+            text = "🔥 بزرگ‌ترین رقابت‌های گروه:\n\n"
+            for i, pair in enumerate(pairs, 1):
+                text += (
+                    f"{i}. {users.get(pair.player_a, pair.player_a)} ⚔️ {users.get(pair.player_b, pair.player_b)}: "
+                    f"{pair.challenges} چالش ({pair.a_wins}-{pair.challenges - pair.a_wins})\n"
+                )
+            
+            await update.message.reply_text(text)
+        except Exception as e:
+            logger.error(f"Error in rivals command: {e}")
+            record_handler_error('rivals')
+            await update.message.reply_text("⚠️ خطا در دریافت رقابت‌ها")
 
 class QuestHandlers:
     @staticmethod
+    @track_handler('quests')
     async def quests(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = str(update.effective_user.id)
         group_id = str(update.effective_chat.id)
         
         try:
-            active_quests = QuestService.get_active_quests(group_id)
+            settings = await AsyncGroupService.get_settings(group_id)
+            if not settings.quests_enabled:
+                await update.message.reply_text("⚠️ ماموریت‌ها در این گروه غیرفعاله")
+                return
+            
+            message = render_cache.get('quests', group_id, user_id)
+            if message is not None:
+                await update.message.reply_text(message)
+                return
+            
+            version = render_cache.version(group_id)
+            active_quests = await AsyncQuestService.get_active_quests(group_id)
             if not active_quests:
                 await update.message.reply_text("📜 در حال حاضر هیچ ماموریتی موجود نیست!")
                 return
             
-            user_progress = QuestService.get_user_quest_progress(user_id, group_id)
+            user_progress = await AsyncQuestService.get_user_quest_progress(user_id, group_id)
             
             message = "📜 ماموریت‌های فعال:\n\n"
             for quest in active_quests:
@@ -254,8 +523,149 @@ class QuestHandlers:
                     f"💰 جایزه: {quest.reward} سانتی‌متر\n"
                     f"📊 پیشرفت: {status}\n\n"
                 )
+            render_cache.put('quests', group_id, user_id, version, message)
             
             await update.message.reply_text(message)
         except Exception as e:
             logger.error(f"Error in quests command: {e}")
+            record_handler_error('quests')
             await update.message.reply_text("⚠️ خطا در دریافت ماموریت‌ها")
+
+class AdminHandlers:
+    @staticmethod
+    @track_handler('dbstats')
+    async def dbstats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if str(update.effective_user.id) not in config.admin_ids:
+            return
+        
+        if not config.db_query_trace:
+            await update.message.reply_text("⚠️ ردیابی کوئری‌ها غیرفعاله (DB_QUERY_TRACE=1)")
+            return
+        
+        snapshot = query_tracer.snapshot()
+        text = f"🗄 {snapshot['calls']} کوئری، {snapshot['statements']} نوع، {len(snapshot['slow'])} کند\n\n"
+        for i, stats in enumerate(snapshot['top'][:10], 1):
+            callers = ", ".join(stats['callers'])
+            text += (
+                f"{i}. {stats['total_ms']:.1f} ms کل | {stats['calls']}× | "
+                f"{stats['avg_ms']:.2f} ms میانگین | {stats['rows']} ردیف\n"
+                f"   {stats['sql'][:120]}\n"
+                f"   ← {callers}\n"
+            )
+        
+        await update.message.reply_text(text[:4000])
+    
+    # /groupsettings <name> on|off
+    SETTING_NAMES = {
+        'growth': 'daily_growth_enabled',
+        'challenges': 'challenges_enabled',
+        'quests': 'quests_enabled'
+    }
+    
+    @staticmethod
+    @track_handler('groupsettings')
+    async def groupsettings(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if str(update.effective_user.id) not in config.admin_ids:
+            return
+        
+        group_id = str(update.effective_chat.id)
+        try:
+            if len(context.args) == 2 and context.args[0] in AdminHandlers.SETTING_NAMES and context.args[1] in ('on', 'off'):
+                # Settings live in the group's registry row, so make sure it exists first
+                await AsyncGroupService.bootstrap_group(group_id, update.effective_chat.title)
+                column = AdminHandlers.SETTING_NAMES[context.args[0]]
+                await AsyncGroupService.update_settings(group_id, **{column: context.args[1] == 'on'})
+            elif context.args:
+                await update.message.reply_text("⚠️ استفاده: /groupsettings [growth|challenges|quests] [on|off]")
+                return
+            
+            settings = await AsyncGroupService.get_settings(group_id)
+            text = "⚙️ تنظیمات گروه:\n\n" + "\n".join(
+                f"{'✅' if getattr(settings, column) else '❌'} {name}"
+                for name, column in AdminHandlers.SETTING_NAMES.items()
+            )
+            await update.message.reply_text(text)
+        except Exception as e:
+            logger.error(f"Error in groupsettings command: {e}")
+            record_handler_error('groupsettings')
+            await update.message.reply_text("⚠️ خطا در تغییر تنظیمات گروه")
+
+    @staticmethod
+    @track_handler('questadmin')
+    async def questadmin(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/questadmin lists the group's quests, /questadmin <id> on|off switches one"""
+        if str(update.effective_user.id) not in config.admin_ids:
+            return
+        
+        group_id = str(update.effective_chat.id)
+        try:
+            if len(context.args) == 2 and context.args[0].isdigit() and context.args[1] in ('on', 'off'):
+                updated = await AsyncQuestService.set_quest_active(int(context.args[0]), group_id, context.args[1] == 'on')
+                if not updated:
+                    await update.message.reply_text("⚠️ ماموریتی با این شماره در این گروه نیست")
+                    return
+            elif context.args:
+                await update.message.reply_text("⚠️ استفاده: /questadmin [شماره ماموریت] [on|off]")
+                return
+            
+            quests = await AsyncQuestService.get_all_quests(group_id)
+            if not quests:
+                await update.message.reply_text("📜 این گروه هیچ ماموریتی نداره")
+                return
+            text = "📜 ماموریت‌های گروه:\n\n" + "\n".join(
+                f"{'✅' if quest.is_active else '❌'} {quest.quest_id}. {quest.title}" for quest in quests
+            )
+            await update.message.reply_text(text)
+        except Exception as e:
+            logger.error(f"Error in questadmin command: {e}")
+            record_handler_error('questadmin')
+            await update.message.reply_text("⚠️ خطا در تغییر ماموریت‌ها")
+
+def register_handlers(application: Application):
+    """Attach every command and callback handler of the bot to an application"""
+    # Register command handlers
+    application.add_handler(CommandHandler("start", CommandHandlers.start))
+    application.add_handler(CommandHandler("help", CommandHandlers.help))
+    application.add_handler(CommandHandler("echo", CommandHandlers.echo))
+    application.add_handler(CommandHandler("grow", CommandHandlers.grow))
+    application.add_handler(CommandHandler("leaderboard", CommandHandlers.leaderboard))
+    application.add_handler(CommandHandler("rank", CommandHandlers.rank))
+    application.add_handler(CommandHandler("global", CommandHandlers.global_ranking))
+    application.add_handler(CommandHandler("stats", CommandHandlers.stats))
+    application.add_handler(CommandHandler("challenge", ChallengeHandlers.challenge))
+    application.add_handler(CommandHandler("history", ChallengeHandlers.history))
+    application.add_handler(CommandHandler("vs", ChallengeHandlers.vs))
+    application.add_handler(CommandHandler("rivals", ChallengeHandlers.rivals))
+    application.add_handler(CommandHandler("quests", QuestHandlers.quests))
+    application.add_handler(CommandHandler("dbstats", AdminHandlers.dbstats))
+    application.add_handler(CommandHandler("groupsettings", AdminHandlers.groupsettings))
+    application.add_handler(CommandHandler("questadmin", AdminHandlers.questadmin))
+    
+    # Register callback handlers
+    application.add_handler(CallbackQueryHandler(
+        ChallengeHandlers.handle_challenge_callback,
+        pattern="^(accept|decline)_"
+    ))
+    application.add_handler(CallbackQueryHandler(
+        CommandHandlers.handle_leaderboard_callback,
+        pattern="^leaderboard_"
+    ))
+
+def build_handler_chain(application: Application, limiter: RateLimiter = None, recorder=None, dispatch=None):
+    """Install the whole path an update takes in the bot: recorder, rate limiter, then the handlers.
+    
+    bot.py and replay.py both build it here, so a replay drops and handles exactly what
+    production did. `recorder` and `dispatch` are handler callbacks; `dispatch` replaces
+    the game handlers when worker processes run them.
+    """
+    # Record every update before any handler sees it, including the ones the rate limiter drops
+    if recorder is not None:
+        application.add_handler(TypeHandler(Update, recorder), group=-2)
+    
+    # Shed command spam before it reaches the workers, the database or the send API
+    application.add_handler(TypeHandler(Update, (limiter or rate_limiter).guard), group=-1)
+    
+    if dispatch is not None:
+        application.add_handler(TypeHandler(Update, dispatch))
+    else:
+        register_handlers(application)
@@ -0,0 +1,159 @@
+import threading
+import logging
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from dataclasses import replace
+from typing import Callable, Dict, List, Optional, Tuple
+from models import User
+from config import config
+
+logger = logging.getLogger(__name__)
+
+class GroupRanking:
+    """Users of one group kept sorted by length, longest first"""
+
+    def __init__(self, users: List[User] = None):
+        self._users: Dict[str, User] = {}
+        # Sort keys are (-length, user_id) so ascending order is the leaderboard order
+        self._keys: List[Tuple[int, str]] = []
+        for user in users or []:
+            self._users[user.user_id] = user
+            self._keys.append((-user.length, user.user_id))
+        self._keys.sort()
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def get(self, user_id: str) -> Optional[User]:
+        return self._users.get(user_id)
+
+    def upsert(self, user: User):
+        old = self._users.get(user.user_id)
+        if old is not None:
+            del self._keys[bisect_left(self._keys, (-old.length, old.user_id))]
+        insort(self._keys, (-user.length, user.user_id))
+        self._users[user.user_id] = user
+
+    def top(self, limit: int) -> List[User]:
+        return self.page(0, limit)
+
+    def page(self, offset: int, limit: int) -> List[User]:
+        return [self._users[user_id] for _, user_id in self._keys[offset:offset + limit]]
+
+    def rank(self, user_id: str) -> Optional[int]:
+        """1-based position of a user, found by binary search over the sort keys"""
+        user = self._users.get(user_id)
+        if user is None:
+            return None
+        return bisect_left(self._keys, (-user.length, user.user_id)) + 1
+
+class LeaderboardCache:
+    """Per-group rankings warmed from SQLite on first use, evicting the least recently used group"""
+
+    def __init__(self, max_groups: int = None):
+        self.max_groups = max_groups or config.leaderboard_cache_groups
+        self._groups: 'OrderedDict[str, GroupRanking]' = OrderedDict()
+        self._lock = threading.Lock()
+        # Loads run outside the lock; these count the loads in flight per group and the
+        # writes that reached such a group meanwhile, so a load that missed one is not stored
+        self._loading: Dict[str, int] = {}
+        self._missed_writes: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get_ranking(self, group_id: str, loader: Callable[[str], List[User]]) -> GroupRanking:
+        with self._lock:
+            ranking = self._groups.get(group_id)
+            if ranking is not None:
+                self.hits += 1
+                self._groups.move_to_end(group_id)
+                return ranking
+            self.misses += 1
+            self._loading[group_id] = self._loading.get(group_id, 0) + 1
+            missed_writes = self._missed_writes.get(group_id, 0)
+
+        try:
+            ranking = GroupRanking(loader(group_id))
+        finally:
+            with self._lock:
+                stale = self._missed_writes.get(group_id, 0) != missed_writes
+                self._loading[group_id] -= 1
+                if not self._loading[group_id]:
+                    del self._loading[group_id]
+                    self._missed_writes.pop(group_id, None)
+
+        with self._lock:
+            if stale:
+                # The ranking is still a committed snapshot, good enough for this one read
+                return ranking
+            if group_id in self._groups:
+                # Another load got there first and may have taken updates since
+                return self._groups[group_id]
+            self._groups[group_id] = ranking
+            if len(self._groups) > self.max_groups:
+                evicted, _ = self._groups.popitem(last=False)
+                logger.debug(f"Evicted leaderboard of group {evicted}")
+            return ranking
+
+    def page(self, group_id: str, offset: int, limit: int, loader: Callable[[str], List[User]]) -> List[User]:
+        ranking = self.get_ranking(group_id, loader)
+        with self._lock:
+            return ranking.page(offset, limit)
+
+    def size(self, group_id: str, loader: Callable[[str], List[User]]) -> int:
+        ranking = self.get_ranking(group_id, loader)
+        with self._lock:
+            return len(ranking)
+
+    def rank(self, group_id: str, user_id: str,
+             loader: Callable[[str], List[User]]) -> Tuple[Optional[int], Optional[User], Optional[User], int]:
+        """Return (rank, user, user ranked just above, total users) for one user"""
+        ranking = self.get_ranking(group_id, loader)
+        with self._lock:
+            position = ranking.rank(user_id)
+            if position is None:
+                return None, None, None, len(ranking)
+            above = ranking.page(position - 2, 1)[0] if position > 1 else None
+            return position, ranking.get(user_id), above, len(ranking)
+
+    def update_user(self, group_id: str, user_id: str, **changes):
+        """Apply committed column values for a user; groups that are not cached are left cold.
+
+        Must run after the write's commit: a load that started earlier read the old row,
+        so it is discarded instead of being cached.
+        """
+        with self._lock:
+            ranking = self._groups.get(group_id)
+            if ranking is None:
+                if group_id in self._loading:
+                    self._missed_writes[group_id] = self._missed_writes.get(group_id, 0) + 1
+                return
+            user = ranking.get(user_id)
+            if user is None:
+                if 'username' not in changes:
+                    # Too little to build the newcomer's row from, so the group reloads on its next read
+                    del self._groups[group_id]
+                    return
+                user = User(user_id=user_id, group_id=group_id, **changes)
+            else:
+                user = replace(user, **changes)
+            ranking.upsert(user)
+
+    def invalidate(self, group_id: str):
+        with self._lock:
+            self._groups.pop(group_id, None)
+            if group_id in self._loading:
+                self._missed_writes[group_id] = self._missed_writes.get(group_id, 0) + 1
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'groups': len(self._groups),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0
+            }
+
+# Global leaderboard cache instance
+leaderboard_cache = LeaderboardCache()
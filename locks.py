@@ -0,0 +1,61 @@
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict, Hashable, List
+from metrics import LOCK_WAIT
+
+class _KeyLock:
+    __slots__ = ('lock', 'users')
+    
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0
+
+class KeyedLocks:
+    """Async locks created on demand per key and dropped as soon as nobody holds or waits for them"""
+    
+    def __init__(self, name: str):
+        self.name = name
+        self._locks: Dict[Hashable, _KeyLock] = {}
+    
+    async def _acquire(self, key: Hashable):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = _KeyLock()
+        entry.users += 1
+        try:
+            await entry.lock.acquire()
+        except BaseException:
+            self._forget(key, entry)
+            raise
+    
+    def _release(self, key: Hashable):
+        entry = self._locks[key]
+        entry.lock.release()
+        self._forget(key, entry)
+    
+    def _forget(self, key: Hashable, entry: _KeyLock):
+        entry.users -= 1
+        if entry.users == 0:
+            del self._locks[key]
+    
+    @asynccontextmanager
+    async def hold(self, *keys: Hashable):
+        """Hold the locks of every key; keys are taken in sorted order so overlapping holders cannot deadlock"""
+        started = time.perf_counter()
+        acquired: List[Hashable] = []
+        try:
+            for key in sorted(set(keys)):
+                await self._acquire(key)
+                acquired.append(key)
+            LOCK_WAIT.labels(self.name).observe(time.perf_counter() - started)
+            yield
+        finally:
+            for key in reversed(acquired):
+                self._release(key)
+    
+    def __len__(self) -> int:
+        return len(self._locks)
+
+# Serializes game operations that touch the same player in the same group
+player_locks = KeyedLocks('player')
@@ -0,0 +1,174 @@
+import copy
+import json
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+from collections import Counter
+from typing import Dict, List, Optional
+from config import config
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Attributes every LogRecord has; anything else was passed through extra= and belongs in the JSON
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with extra= fields as top-level keys"""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': self.formatTime(record, '%Y-%m-%dT%H:%M:%S') + f".{int(record.msecs):03d}",
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class SamplingFilter(logging.Filter):
+    """Keeps only a share of the records below WARNING from chatty loggers"""
+    
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        # Longest prefix first so 'telegram.ext' can override 'telegram'
+        self.rates = sorted(rates.items(), key=lambda item: len(item[0]), reverse=True)
+        self.dropped: Counter = Counter()
+    
+    def rate_for(self, name: str) -> float:
+        for prefix, rate in self.rates:
+            if name == prefix or name.startswith(prefix + '.'):
+                return rate
+        return 1.0
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rate_for(record.name)
+        if rate >= 1.0 or random.random() < rate:
+            return True
+        self.dropped[record.name] += 1
+        return False
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records when the listener falls behind instead of blocking"""
+    
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Merge args and render the traceback here, but leave the rest to the listener's formatter
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        return record
+    
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+def parse_sample_rates(spec: str) -> Dict[str, float]:
+    """Parse 'httpx=0.05,telegram.ext=0.5' into {logger: rate}"""
+    rates = {}
+    for item in spec.split(','):
+        if '=' in item:
+            name, rate = item.split('=', 1)
+            rates[name.strip()] = min(1.0, max(0.0, float(rate)))
+    return rates
+
+def _output_handlers(formatter: logging.Formatter) -> List[logging.Handler]:
+    handlers: List[logging.Handler] = [logging.StreamHandler()]
+    if config.log_file:
+        if config.log_rotate_when:
+            handlers.append(logging.handlers.TimedRotatingFileHandler(
+                config.log_file, when=config.log_rotate_when,
+                backupCount=config.log_backup_count, encoding='utf-8'
+            ))
+        else:
+            handlers.append(logging.handlers.RotatingFileHandler(
+                config.log_file, maxBytes=config.log_max_bytes,
+                backupCount=config.log_backup_count, encoding='utf-8'
+            ))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    return handlers
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[DroppingQueueHandler] = None
+_sampling_filter: Optional[SamplingFilter] = None
+
+def setup_logging():
+    """Route all logging through a queue to a background thread that formats and writes it"""
+    global _listener, _queue_handler, _sampling_filter
+    if _listener is not None:
+        return
+    
+    formatter = JsonFormatter() if config.log_format == 'json' else logging.Formatter(TEXT_FORMAT)
+    log_queue: queue.Queue = queue.Queue(maxsize=config.log_queue_size)
+    _queue_handler = DroppingQueueHandler(log_queue)
+    _sampling_filter = SamplingFilter(parse_sample_rates(config.log_sample))
+    _queue_handler.addFilter(_sampling_filter)
+    
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    root.setLevel(getattr(logging, config.log_level))
+    
+    _listener = logging.handlers.QueueListener(log_queue, *_output_handlers(formatter), respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+class _ForwardingHandler(logging.Handler):
+    """Re-emits records that arrived from a worker process through this process's loggers"""
+    
+    def emit(self, record: logging.LogRecord):
+        logging.getLogger(record.name).handle(record)
+
+def setup_worker_logging(log_queue):
+    """Send a worker process's records to the front process, which samples and writes them"""
+    global _queue_handler
+    _queue_handler = DroppingQueueHandler(log_queue)
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    root.setLevel(getattr(logging, config.log_level))
+
+def forward_worker_logs(log_queue) -> logging.handlers.QueueListener:
+    """Start a thread that feeds worker records into this process's logging pipeline"""
+    listener = logging.handlers.QueueListener(log_queue, _ForwardingHandler())
+    listener.start()
+    return listener
+
+def stop_logging():
+    """Flush queued records to the outputs and stop the listener thread"""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = None
+
+def dropped_records() -> Dict[str, int]:
+    """Records skipped by sampling, per logger, plus those lost to a full queue"""
+    if _queue_handler is None:
+        return {}
+    counts = dict(_sampling_filter.dropped) if _sampling_filter is not None else {}
+    counts['<queue full>'] = _queue_handler.dropped
+    return counts
@@ -0,0 +1,178 @@
+import asyncio
+import functools
+import time
+import logging
+import threading
+from typing import Dict, List
+from prometheus_client import Counter, Histogram, Gauge, REGISTRY, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily, Metric
+from leaderboard import leaderboard_cache
+from quest_cache import quest_cache
+from render_cache import render_cache
+from group_registry import group_registry
+from logging_setup import dropped_records
+
+logger = logging.getLogger(__name__)
+
+HANDLER_REQUESTS = Counter(
+    'bot_handler_requests_total', 'Updates handled, by handler', ['handler']
+)
+HANDLER_ERRORS = Counter(
+    'bot_handler_errors_total', 'Handler failures, caught or raised, by handler', ['handler']
+)
+HANDLER_LATENCY = Histogram(
+    'bot_handler_duration_seconds', 'Time spent in a handler, including its replies', ['handler'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+
+DB_CALL_LATENCY = Histogram(
+    'bot_db_call_duration_seconds', 'Time a database call spends running on a DB worker', ['operation'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+)
+DB_POOL_WAIT = Histogram(
+    'bot_db_pool_wait_seconds', 'Time a database call waits for a free DB worker', ['operation'],
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1)
+)
+DB_CALLS_IN_FLIGHT = Gauge(
+    'bot_db_calls_in_flight', 'Database calls queued or running on the DB worker pool'
+)
+DB_POOL_CONNECTIONS = Gauge(
+    'bot_db_pool_connections', 'Long-lived SQLite connections held by the connection pool'
+)
+
+LOCK_WAIT = Histogram(
+    'bot_lock_wait_seconds', 'Time spent waiting for keyed game locks', ['lock'],
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+)
+
+RATE_LIMITED = Counter(
+    'bot_rate_limited_total', 'Updates dropped by the rate limiter, by command and by the scope that refused them',
+    ['command', 'scope']
+)
+
+GLOBAL_LEADERBOARD_DRIFT = Counter(
+    'bot_global_leaderboard_drift_total', 'Players whose global total was repaired by reconciliation'
+)
+
+RETENTION_WORK = Counter(
+    'bot_retention_work_total', 'Challenges archived, quest progress rows pruned and pages vacuumed by retention',
+    ['action']
+)
+
+WORKER_RESTARTS = Counter(
+    'bot_worker_restarts_total', 'Worker processes restarted after they exited unexpectedly', ['worker']
+)
+
+EVENT_LOOP_LAG = Histogram(
+    'bot_event_loop_lag_seconds', 'How late the event loop woke up from a scheduled sleep',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+)
+
+class CacheCollector:
+    """Exposes the in-process caches' counters at scrape time"""
+    
+    def collect(self):
+        caches = {
+            'leaderboard': leaderboard_cache.stats(),
+            'quests': quest_cache.stats(),
+            'render': render_cache.stats(),
+            'groups': group_registry.stats()
+        }
+        
+        groups = GaugeMetricFamily('bot_cache_groups', 'Groups held in a cache', labels=['cache'])
+        hits = CounterMetricFamily('bot_cache_hits', 'Cache lookups served from memory', labels=['cache'])
+        misses = CounterMetricFamily('bot_cache_misses', 'Cache lookups that loaded from the database', labels=['cache'])
+        ratio = GaugeMetricFamily('bot_cache_hit_ratio', 'Share of cache lookups served from memory', labels=['cache'])
+        for name, stats in caches.items():
+            groups.add_metric([name], stats['groups'])
+            hits.add_metric([name], stats['hits'])
+            misses.add_metric([name], stats['misses'])
+            ratio.add_metric([name], stats['hit_ratio'])
+        
+        yield groups
+        yield hits
+        yield misses
+        yield ratio
+
+REGISTRY.register(CacheCollector())
+
+class LogCollector:
+    """Exposes log records dropped by sampling or by a full logging queue"""
+    
+    def collect(self):
+        dropped = CounterMetricFamily('bot_log_records_dropped', 'Log records not written, by logger', labels=['logger'])
+        for name, count in dropped_records().items():
+            dropped.add_metric([name], count)
+        yield dropped
+
+REGISTRY.register(LogCollector())
+
+def track_handler(name: str):
+    """Count, time and record failures of an async handler under the given label"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(update, context):
+            HANDLER_REQUESTS.labels(name).inc()
+            start = time.perf_counter()
+            try:
+                return await func(update, context)
+            except Exception:
+                HANDLER_ERRORS.labels(name).inc()
+                raise
+            finally:
+                HANDLER_LATENCY.labels(name).observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+def record_handler_error(name: str):
+    """Count a failure that the handler caught and answered itself"""
+    HANDLER_ERRORS.labels(name).inc()
+
+async def monitor_event_loop_lag(interval: float = 0.5):
+    """Sleep repeatedly and record how far past each deadline the loop resumed"""
+    loop = asyncio.get_running_loop()
+    while True:
+        scheduled = loop.time() + interval
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(0.0, loop.time() - scheduled))
+
+class WorkerMetrics:
+    """This process's registry plus the latest families pushed by worker processes, labelled by worker"""
+    
+    def __init__(self):
+        self._families: Dict[int, List[Metric]] = {}
+        self._lock = threading.Lock()
+    
+    def update(self, worker: int, families: List[Metric]):
+        with self._lock:
+            self._families[worker] = families
+    
+    def collect(self):
+        merged = {family.name: family for family in REGISTRY.collect()}
+        with self._lock:
+            pushed = list(self._families.items())
+        for worker, families in pushed:
+            for family in families:
+                target = merged.get(family.name)
+                if target is None:
+                    target = merged[family.name] = Metric(family.name, family.documentation, family.type, family.unit)
+                for sample in family.samples:
+                    target.samples.append(sample._replace(labels={**sample.labels, 'worker': str(worker)}))
+        yield from merged.values()
+
+worker_metrics = WorkerMetrics()
+
+def snapshot_metrics() -> List[Metric]:
+    """This process's metric families, in a form that can be sent over a multiprocessing queue"""
+    return list(REGISTRY.collect())
+
+async def push_metrics(worker: int, queue, interval: float):
+    """Worker side: send this process's metrics to the front process every interval"""
+    while True:
+        await asyncio.sleep(interval)
+        queue.put((worker, snapshot_metrics()))
+
+def render_metrics():
+    """Return (body, content type) for the Prometheus text exposition format"""
+    # Handlers run in the workers in multi-process mode, so their metrics only exist in what they pushed
+    return generate_latest(worker_metrics), CONTENT_TYPE_LATEST
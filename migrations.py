@@ -0,0 +1,314 @@
+import sqlite3
+import logging
+from typing import Callable, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+def _initial_schema(cursor: sqlite3.Cursor):
+    # Users table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id TEXT,
+            group_id TEXT,
+            username TEXT,
+            length INTEGER DEFAULT 0,
+            last_growth DATE,
+            total_challenges INTEGER DEFAULT 0,
+            challenges_won INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, group_id)
+        )
+    """)
+
+    # Quests table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS quests (
+            quest_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            group_id TEXT,
+            title TEXT NOT NULL,
+            description TEXT NOT NULL,
+            reward INTEGER NOT NULL,
+            requirements TEXT,
+            quest_type TEXT DEFAULT 'manual',
+            target_value INTEGER DEFAULT 0,
+            is_active BOOLEAN DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # User quests progress
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_quests (
+            user_id TEXT,
+            group_id TEXT,
+            quest_id INTEGER,
+            progress INTEGER DEFAULT 0,
+            completed BOOLEAN DEFAULT 0,
+            completed_at TIMESTAMP,
+            PRIMARY KEY (user_id, group_id, quest_id),
+            FOREIGN KEY (quest_id) REFERENCES quests(quest_id) ON DELETE CASCADE
+        )
+    """)
+
+    # Challenge history
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS challenge_history (
+            challenge_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            challenger_id TEXT,
+            opponent_id TEXT,
+            group_id TEXT,
+            amount INTEGER,
+            winner_id TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # Group settings
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS group_settings (
+            group_id TEXT PRIMARY KEY,
+            group_name TEXT,
+            daily_growth_enabled BOOLEAN DEFAULT 1,
+            challenges_enabled BOOLEAN DEFAULT 1,
+            quests_enabled BOOLEAN DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+def _user_stat_columns(cursor: sqlite3.Cursor):
+    # Databases created before challenge stats existed lack these columns
+    cursor.execute("PRAGMA table_info(users)")
+    columns = [column[1] for column in cursor.fetchall()]
+
+    additions = [
+        ("total_challenges", "ALTER TABLE users ADD COLUMN total_challenges INTEGER DEFAULT 0"),
+        ("challenges_won", "ALTER TABLE users ADD COLUMN challenges_won INTEGER DEFAULT 0"),
+        # ALTER TABLE cannot add a column with a non-constant default
+        ("updated_at", "ALTER TABLE users ADD COLUMN updated_at TIMESTAMP")
+    ]
+
+    for column_name, migration_sql in additions:
+        if column_name not in columns:
+            cursor.execute(migration_sql)
+            logger.info(f"Added {column_name} column to users table")
+
+def _hot_path_indexes(cursor: sqlite3.Cursor):
+    # Leaderboard: covers WHERE group_id = ? ORDER BY length DESC without touching the table
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_users_group_length
+        ON users (group_id, length DESC, user_id, username, total_challenges, challenges_won)
+    """)
+
+    # Active quests per group, narrowed further by quest_type on progress updates
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_quests_group_active
+        ON quests (group_id, is_active, quest_type)
+    """)
+
+    # user_quests (user_id, group_id) lookups use the primary key prefix;
+    # this one serves the ON DELETE CASCADE from quests
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_user_quests_quest
+        ON user_quests (quest_id)
+    """)
+
+    # Challenge history per group and per participant, newest first
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_challenge_history_group
+        ON challenge_history (group_id, created_at)
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_challenge_history_challenger
+        ON challenge_history (challenger_id, group_id, created_at)
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_challenge_history_opponent
+        ON challenge_history (opponent_id, group_id, created_at)
+    """)
+
+def _pending_challenges(cursor: sqlite3.Cursor):
+    # Challenges waiting for an answer, so their buttons keep working across restarts
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS pending_challenges (
+            token TEXT PRIMARY KEY,
+            challenger_id TEXT NOT NULL,
+            opponent_id TEXT NOT NULL,
+            group_id TEXT NOT NULL,
+            amount INTEGER NOT NULL,
+            expires_at REAL NOT NULL
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_pending_challenges_expiry
+        ON pending_challenges (expires_at)
+    """)
+
+def _unique_group_quests(cursor: sqlite3.Cursor):
+    # /start used to insert the default quests again on every call; keep the oldest copy of each title
+    cursor.execute("""
+        CREATE TEMP TABLE quest_duplicates AS
+        SELECT q.quest_id AS duplicate_id, keeper.quest_id AS keeper_id
+        FROM quests q
+        JOIN (SELECT group_id, title, MIN(quest_id) AS quest_id FROM quests GROUP BY group_id, title) keeper
+          ON keeper.group_id IS q.group_id AND keeper.title = q.title
+        WHERE q.quest_id != keeper.quest_id
+    """)
+
+    # Progress made on a duplicate moves to the kept quest, keeping the furthest of the copies
+    cursor.execute("""
+        INSERT INTO user_quests (user_id, group_id, quest_id, progress, completed, completed_at)
+        SELECT uq.user_id, uq.group_id, d.keeper_id, MAX(uq.progress), MAX(uq.completed), MAX(uq.completed_at)
+        FROM user_quests uq JOIN quest_duplicates d ON d.duplicate_id = uq.quest_id
+        GROUP BY uq.user_id, uq.group_id, d.keeper_id
+        ON CONFLICT (user_id, group_id, quest_id) DO UPDATE SET
+            progress = MAX(progress, excluded.progress),
+            completed = MAX(completed, excluded.completed),
+            completed_at = COALESCE(completed_at, excluded.completed_at)
+    """)
+    cursor.execute("DELETE FROM user_quests WHERE quest_id IN (SELECT duplicate_id FROM quest_duplicates)")
+    cursor.execute("DELETE FROM quests WHERE quest_id IN (SELECT duplicate_id FROM quest_duplicates)")
+    removed = cursor.rowcount
+    cursor.execute("DROP TABLE quest_duplicates")
+    if removed:
+        logger.info(f"Removed {removed} duplicate quests")
+
+    cursor.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_quests_group_title
+        ON quests (group_id, title)
+    """)
+
+    # Groups that already have quests were bootstrapped before the registry existed
+    cursor.execute("""
+        INSERT OR IGNORE INTO group_settings (group_id)
+        SELECT DISTINCT group_id FROM quests WHERE group_id IS NOT NULL
+    """)
+
+def _challenge_rollups(cursor: sqlite3.Cursor):
+    # Head-to-head counters per pair; player_a < player_b so each pair has exactly one row
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS challenge_pairs (
+            group_id TEXT NOT NULL,
+            player_a TEXT NOT NULL,
+            player_b TEXT NOT NULL,
+            challenges INTEGER NOT NULL DEFAULT 0,
+            a_wins INTEGER NOT NULL DEFAULT 0,
+            a_net INTEGER NOT NULL DEFAULT 0,
+            last_at TIMESTAMP,
+            PRIMARY KEY (group_id, player_a, player_b)
+        ) WITHOUT ROWID
+    """)
+    # Biggest rivalries of a group
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_challenge_pairs_group_challenges
+        ON challenge_pairs (group_id, challenges DESC)
+    """)
+
+    # Per-user challenge totals per day
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_daily_stats (
+            group_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            day DATE NOT NULL,
+            challenges INTEGER NOT NULL DEFAULT 0,
+            wins INTEGER NOT NULL DEFAULT 0,
+            gained INTEGER NOT NULL DEFAULT 0,
+            lost INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (group_id, user_id, day)
+        ) WITHOUT ROWID
+    """)
+
+    # Backfill both from the history recorded so far; the loser of a challenge always lost the full amount
+    cursor.execute("""
+        INSERT OR REPLACE INTO challenge_pairs (group_id, player_a, player_b, challenges, a_wins, a_net, last_at)
+        SELECT group_id, MIN(challenger_id, opponent_id), MAX(challenger_id, opponent_id), COUNT(*),
+               SUM(winner_id = MIN(challenger_id, opponent_id)),
+               SUM(CASE WHEN winner_id = MIN(challenger_id, opponent_id) THEN amount ELSE -amount END),
+               MAX(created_at)
+        FROM challenge_history
+        WHERE group_id IS NOT NULL AND challenger_id IS NOT NULL AND opponent_id IS NOT NULL
+        GROUP BY group_id, MIN(challenger_id, opponent_id), MAX(challenger_id, opponent_id)
+    """)
+    cursor.execute("""
+        INSERT OR REPLACE INTO user_daily_stats (group_id, user_id, day, challenges, wins, gained, lost)
+        SELECT group_id, user_id, day, COUNT(*), SUM(won), SUM(CASE WHEN won THEN amount ELSE 0 END),
+               SUM(CASE WHEN won THEN 0 ELSE amount END)
+        FROM (
+            SELECT group_id, challenger_id AS user_id, date(created_at, 'localtime') AS day,
+                   winner_id = challenger_id AS won, amount
+            FROM challenge_history
+            UNION ALL
+            SELECT group_id, opponent_id, date(created_at, 'localtime'), winner_id = opponent_id, amount
+            FROM challenge_history
+        )
+        WHERE group_id IS NOT NULL AND user_id IS NOT NULL
+        GROUP BY group_id, user_id, day
+    """)
+
+# Ordered schema steps; a step never changes once released, new steps are appended
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Cursor], None]]] = [
+    (1, "initial schema", _initial_schema),
+    (2, "users challenge stat columns", _user_stat_columns),
+    (3, "hot path indexes", _hot_path_indexes),
+    (4, "pending challenges", _pending_challenges),
+    (5, "unique group quests", _unique_group_quests),
+    (6, "challenge rollups", _challenge_rollups),
+]
+
+# Queries on the bot's hot paths; every one of them must be answered from an index
+HOT_QUERIES: Dict[str, Tuple[str, tuple]] = {
+    'leaderboard': (
+        "SELECT user_id, group_id, username, length, total_challenges, challenges_won "
+        "FROM users WHERE group_id = ? ORDER BY length DESC LIMIT ?",
+        ('g', 10)
+    ),
+    'user_stats': (
+        "SELECT * FROM users WHERE user_id = ? AND group_id = ?",
+        ('u', 'g')
+    ),
+    'active_quests': (
+        "SELECT * FROM quests WHERE group_id = ? AND is_active = 1",
+        ('g',)
+    ),
+    'active_quests_by_type': (
+        "SELECT * FROM quests WHERE group_id = ? AND is_active = 1 AND quest_type = ?",
+        ('g', 'daily_growth')
+    ),
+    'group_settings': (
+        "SELECT * FROM group_settings WHERE group_id = ?",
+        ('g',)
+    ),
+    'user_quest_progress': (
+        "SELECT * FROM user_quests WHERE user_id = ? AND group_id = ?",
+        ('u', 'g')
+    ),
+    'group_challenge_history': (
+        "SELECT * FROM challenge_history WHERE group_id = ? ORDER BY created_at DESC LIMIT ?",
+        ('g', 10)
+    ),
+    'user_challenge_history': (
+        "SELECT * FROM challenge_history WHERE (challenger_id = ? OR opponent_id = ?) AND group_id = ?",
+        ('u', 'u', 'g')
+    ),
+    'user_daily_stats': (
+        "SELECT * FROM user_daily_stats WHERE group_id = ? AND user_id = ? AND day >= ? ORDER BY day DESC",
+        ('g', 'u', '2024-01-01')
+    ),
+    'head_to_head': (
+        "SELECT * FROM challenge_pairs WHERE group_id = ? AND player_a = ? AND player_b = ?",
+        ('g', 'a', 'b')
+    ),
+    'group_rivalries': (
+        "SELECT * FROM challenge_pairs WHERE group_id = ? ORDER BY challenges DESC LIMIT ?",
+        ('g', 5)
+    ),
+}
+
+def unindexed_plan_steps(cursor: sqlite3.Cursor, sql: str, params: tuple) -> List[str]:
+    """Return the EXPLAIN QUERY PLAN steps that scan a table or sort without an index"""
+    cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+    steps = [row[3] for row in cursor.fetchall()]
+    return [
+        step for step in steps
+        if (step.startswith('SCAN') and 'INDEX' not in step) or 'TEMP B-TREE' in step
+    ]
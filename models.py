@@ -1,5 +1,6 @@
 from dataclasses import dataclass
 from datetime import datetime
+from functools import cached_property
 from typing import Optional, Dict, Any
 import json
 
@@ -34,7 +35,7 @@ class Quest:
     is_active: bool = True
     created_at: Optional[datetime] = None
     
-    @property
+    @cached_property
     def requirements_dict(self) -> Dict[str, Any]:
         try:
             return json.loads(self.requirements) if self.requirements else {}
@@ -63,3 +64,40 @@ class Challenge:
     amount: int
     winner_id: Optional[str] = None
     created_at: Optional[datetime] = None
+
+@dataclass
+class GroupSettings:
+    group_id: str
+    group_name: Optional[str] = None
+    daily_growth_enabled: bool = True
+    challenges_enabled: bool = True
+    quests_enabled: bool = True
+    created_at: Optional[datetime] = None
+
+@dataclass
+class ChallengePair:
+    """Head-to-head record of two players; player_a sorts before player_b"""
+    group_id: str
+    player_a: str
+    player_b: str
+    challenges: int = 0
+    a_wins: int = 0
+    a_net: int = 0
+    last_at: Optional[datetime] = None
+    
+    def wins_of(self, user_id: str) -> int:
+        return self.a_wins if user_id == self.player_a else self.challenges - self.a_wins
+    
+    def net_of(self, user_id: str) -> int:
+        """Centimeters this player won from the other, overall"""
+        return self.a_net if user_id == self.player_a else -self.a_net
+
+@dataclass
+class DailyChallengeStats:
+    group_id: str
+    user_id: str
+    day: str
+    challenges: int = 0
+    wins: int = 0
+    gained: int = 0
+    lost: int = 0
@@ -0,0 +1,174 @@
+import re
+import sys
+import time
+import heapq
+import sqlite3
+import logging
+import threading
+from collections import Counter, deque
+from functools import lru_cache
+from typing import Any, Dict, List
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Frames from these modules are plumbing, not the service method that issued the statement
+_PLUMBING_MODULES = {__name__, 'database', 'contextlib', 'sqlite3'}
+
+@lru_cache(maxsize=1024)
+def normalize_sql(sql: str) -> str:
+    """Collapse whitespace and literals so equivalent statements aggregate together"""
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    sql = re.sub(r"\b\d+(?:\.\d+)?\b", "?", sql)
+    sql = re.sub(r"\(\s*\?(?:\s*,\s*\?)+\s*\)", "(?, ...)", sql)
+    sql = re.sub(r"VALUES\s+\(\?, \.\.\.\)(?:\s*,\s*\(\?, \.\.\.\))+", "VALUES (?, ...), ...", sql)
+    return " ".join(sql.split())
+
+def _calling_function() -> str:
+    frame = sys._getframe(2)
+    while frame is not None and frame.f_globals.get('__name__') in _PLUMBING_MODULES:
+        frame = frame.f_back
+    if frame is None:
+        return 'unknown'
+    # co_qualname only exists from Python 3.11 on
+    code = frame.f_code
+    return f"{frame.f_globals.get('__name__')}.{getattr(code, 'co_qualname', code.co_name)}"
+
+class QueryStats:
+    __slots__ = ('sql', 'calls', 'total_ms', 'max_ms', 'rows', 'callers')
+    
+    def __init__(self, sql: str):
+        self.sql = sql
+        self.calls = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.rows = 0
+        self.callers: Counter = Counter()
+    
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'sql': self.sql,
+            'calls': self.calls,
+            'total_ms': round(self.total_ms, 3),
+            'avg_ms': round(self.total_ms / self.calls, 3) if self.calls else 0.0,
+            'max_ms': round(self.max_ms, 3),
+            'rows': self.rows,
+            'callers': dict(self.callers.most_common(5))
+        }
+
+class QueryTracer:
+    """Aggregates statement timings by normalized SQL and keeps a log of slow statements"""
+    
+    def __init__(self, slow_query_ms: float = None, top_k: int = None, slow_log_size: int = 100):
+        self.slow_query_ms = config.db_slow_query_ms if slow_query_ms is None else slow_query_ms
+        self.top_k = top_k or config.db_query_top_k
+        self._stats: Dict[str, QueryStats] = {}
+        self._slow_log: deque = deque(maxlen=slow_log_size)
+        self._lock = threading.Lock()
+    
+    def record(self, sql: str, duration_ms: float, rows: int = 0, caller: str = None):
+        key = normalize_sql(sql)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = QueryStats(key)
+            if caller is not None:
+                stats.calls += 1
+                stats.callers[caller] += 1
+            stats.total_ms += duration_ms
+            stats.max_ms = max(stats.max_ms, duration_ms)
+            stats.rows += rows
+        
+        if caller is not None and duration_ms >= self.slow_query_ms:
+            self._slow_log.append({
+                'sql': key,
+                'duration_ms': round(duration_ms, 3),
+                'caller': caller,
+                'at': time.time()
+            })
+            logger.warning(f"Slow query ({duration_ms:.1f} ms) from {caller}: {key}")
+    
+    def top(self, k: int = None) -> List[Dict[str, Any]]:
+        """The k statements with the highest total time"""
+        with self._lock:
+            expensive = heapq.nlargest(k or self.top_k, self._stats.values(), key=lambda s: s.total_ms)
+            return [stats.as_dict() for stats in expensive]
+    
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            statements = len(self._stats)
+            calls = sum(stats.calls for stats in self._stats.values())
+        return {
+            'enabled': config.db_query_trace,
+            'slow_query_ms': self.slow_query_ms,
+            'statements': statements,
+            'calls': calls,
+            'top': self.top(),
+            'slow': list(self._slow_log)
+        }
+    
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._slow_log.clear()
+
+# Global query tracer instance
+query_tracer = QueryTracer()
+
+class TracingCursor(sqlite3.Cursor):
+    """Cursor that reports each statement, its rows and its fetch time to the query tracer"""
+    
+    def execute(self, sql, parameters=()):
+        self._traced_sql = sql
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            query_tracer.record(sql, (time.perf_counter() - start) * 1000, caller=_calling_function())
+    
+    def executemany(self, sql, seq_of_parameters):
+        self._traced_sql = sql
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            query_tracer.record(sql, (time.perf_counter() - start) * 1000, caller=_calling_function())
+    
+    def _record_fetch(self, start: float, rows: int):
+        sql = getattr(self, '_traced_sql', None)
+        if sql is not None:
+            query_tracer.record(sql, (time.perf_counter() - start) * 1000, rows=rows)
+    
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._record_fetch(start, 0 if row is None else 1)
+        return row
+    
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._record_fetch(start, len(rows))
+        return rows
+    
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._record_fetch(start, len(rows))
+        return rows
+
+class TracingConnection(sqlite3.Connection):
+    """Connection whose cursors are traced"""
+    
+    def cursor(self, factory=TracingCursor):
+        return super().cursor(factory)
+    
+    # sqlite3.Connection's shortcuts build plain cursors without calling cursor(), so route them through it
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+    
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+    
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
@@ -0,0 +1,74 @@
+import threading
+import logging
+from collections import OrderedDict
+from typing import Callable, Dict, List
+from models import Quest
+from config import config
+
+logger = logging.getLogger(__name__)
+
+class GroupQuests:
+    """Active quests of one group, indexed by quest_type with requirements parsed up front"""
+
+    def __init__(self, quests: List[Quest]):
+        self.quests = quests
+        self.by_id: Dict[int, Quest] = {}
+        self.by_type: Dict[str, List[Quest]] = {}
+        for quest in quests:
+            # Parse once here rather than on every event dispatch
+            _ = quest.requirements_dict
+            self.by_id[quest.quest_id] = quest
+            self.by_type.setdefault(quest.quest_type, []).append(quest)
+
+class QuestCache:
+    """Per-group active quest definitions, evicting the least recently used group.
+    
+    Entries never expire: QuestService invalidates a group whenever it adds or (de)activates
+    quests (/questadmin), so a quest edited directly in the database shows up after a restart.
+    """
+
+    def __init__(self, max_groups: int = None):
+        self.max_groups = max_groups or config.quest_cache_groups
+        self._groups: 'OrderedDict[str, GroupQuests]' = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped on every invalidation so a load that raced with one is not stored
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, group_id: str, loader: Callable[[str], List[Quest]]) -> GroupQuests:
+        with self._lock:
+            group_quests = self._groups.get(group_id)
+            if group_quests is not None:
+                self.hits += 1
+                self._groups.move_to_end(group_id)
+                return group_quests
+            self.misses += 1
+            generation = self._generation
+
+        group_quests = GroupQuests(loader(group_id))
+        with self._lock:
+            if generation == self._generation:
+                self._groups[group_id] = group_quests
+                if len(self._groups) > self.max_groups:
+                    self._groups.popitem(last=False)
+        return group_quests
+
+    def invalidate(self, group_id: str):
+        with self._lock:
+            self._generation += 1
+            self._groups.pop(group_id, None)
+        logger.debug(f"Invalidated quest cache of group {group_id}")
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'groups': len(self._groups),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0
+            }
+
+# Global quest cache instance
+quest_cache = QuestCache()
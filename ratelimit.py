@@ -0,0 +1,129 @@
+import time
+import logging
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+from telegram import Update
+from telegram.error import TelegramError
+from telegram.ext import ApplicationHandlerStop, ContextTypes
+from config import config
+from metrics import RATE_LIMITED
+
+logger = logging.getLogger(__name__)
+
+# (burst, seconds to refill a whole burst)
+Rule = Tuple[float, float]
+
+def parse_rate_limits(spec: str) -> Dict[str, Rule]:
+    """Parse 'grow=3/60,*=10/30' into {command: (burst, seconds)}; '*' covers every other command"""
+    rules = {}
+    for item in spec.split(','):
+        if '=' not in item or '/' not in item:
+            continue
+        command, rate = item.split('=', 1)
+        burst, seconds = rate.split('/', 1)
+        if float(burst) > 0 and float(seconds) > 0:
+            rules[command.strip().lower()] = (float(burst), float(seconds))
+    return rules
+
+def command_of(update: Update) -> Optional[str]:
+    """Command an update invokes: '/grow@bot 3' -> 'grow', a 'leaderboard_2' button -> 'leaderboard'"""
+    if update.callback_query is not None:
+        return (update.callback_query.data or '').split('_', 1)[0].lower() or None
+    message = update.effective_message
+    if message is None or not message.text or not message.text.startswith('/'):
+        return None
+    return (message.text[1:].split() or [''])[0].split('@', 1)[0].lower() or None
+
+class TokenBucket:
+    __slots__ = ('tokens', 'updated')
+    
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+    
+    def refill(self, rule: Rule, now: float):
+        burst, seconds = rule
+        self.tokens = min(burst, self.tokens + (now - self.updated) * burst / seconds)
+        self.updated = now
+
+class RateLimiter:
+    """Token buckets per (user, command) and per (chat, command), checked before any handler runs.
+    
+    Buckets live in a bounded LRU; an evicted bucket simply starts full again, which only
+    matters for users idle long enough to have refilled anyway.
+    """
+    
+    def __init__(self, user_rules: Dict[str, Rule] = None, chat_rules: Dict[str, Rule] = None,
+                 max_buckets: int = None, clock: Callable[[], float] = time.monotonic):
+        self.user_rules = parse_rate_limits(config.rate_limit_user) if user_rules is None else user_rules
+        self.chat_rules = parse_rate_limits(config.rate_limit_chat) if chat_rules is None else chat_rules
+        self.max_buckets = max_buckets or config.rate_limit_max_buckets
+        # Replays pass the recorded time so buckets refill as they did in production
+        self.clock = clock
+        self._buckets: 'OrderedDict[Tuple[str, str, str], TokenBucket]' = OrderedDict()
+    
+    @staticmethod
+    def _rule(rules: Dict[str, Rule], command: str) -> Tuple[str, Optional[Rule]]:
+        # Commands without a rule of their own share the '*' bucket, so made-up commands cannot dodge it
+        if command in rules:
+            return command, rules[command]
+        return '*', rules.get('*')
+    
+    def _bucket(self, key: Tuple[str, str, str], rule: Rule, now: float) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(rule[0], now)
+            if len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket.refill(rule, now)
+        return bucket
+    
+    def check(self, command: str, user_id: Optional[str], chat_id: Optional[str],
+              now: float = None) -> Optional[str]:
+        """Spend a token from every bucket the request falls under; returns the scope that refused it"""
+        now = self.clock() if now is None else now
+        buckets = []
+        for scope, rules, key in (('user', self.user_rules, user_id), ('chat', self.chat_rules, chat_id)):
+            name, rule = self._rule(rules, command)
+            if rule is None or key is None:
+                continue
+            bucket = self._bucket((scope, name, key), rule, now)
+            if bucket.tokens < 1:
+                return scope
+            buckets.append(bucket)
+        # Only charge once every scope agreed, so a refused request costs nothing
+        for bucket in buckets:
+            bucket.tokens -= 1
+        return None
+    
+    def _label(self, command: str) -> str:
+        # Commands are user input; keep the metric's label set to the configured ones
+        return command if command in self.user_rules or command in self.chat_rules else 'other'
+    
+    async def guard(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handler callback: drop the update before it reaches the database or the send API"""
+        command = command_of(update)
+        if command is None:
+            return
+        user_id = str(update.effective_user.id) if update.effective_user else None
+        chat_id = str(update.effective_chat.id) if update.effective_chat else None
+        scope = self.check(command, user_id, chat_id)
+        if scope is None:
+            return
+        RATE_LIMITED.labels(self._label(command), scope).inc()
+        logger.debug(f"Rate limited /{command} from user {user_id} in chat {chat_id} ({scope})")
+        if update.callback_query is not None:
+            # Unanswered, the pressed button keeps spinning until Telegram gives up on it
+            try:
+                await update.callback_query.answer("⏳ یکم آروم‌تر!", show_alert=False)
+            except TelegramError as e:
+                logger.debug(f"Could not answer rate limited callback: {e}")
+        raise ApplicationHandlerStop
+    
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+# Global rate limiter
+rate_limiter = RateLimiter()
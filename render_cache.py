@@ -0,0 +1,77 @@
+import itertools
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+from config import config
+
+class RenderCache:
+    """Rendered reply texts, reused until something in their group changes.
+    
+    Every group has a state version that services bump after each write. An entry remembers
+    the version it was rendered at and is only served while that is still the group's version.
+    Versions come from one global counter, so a group whose version was evicted gets a brand
+    new one and can never match text rendered before.
+    """
+    
+    def __init__(self, max_entries: int = None):
+        self.max_entries = max_entries or config.render_cache_entries
+        self._entries: 'OrderedDict[Tuple[str, str, Hashable], Tuple[int, Any]]' = OrderedDict()
+        self._versions: 'OrderedDict[str, int]' = OrderedDict()
+        self._counter = itertools.count(1)
+        # Bumps come from DB worker threads, lookups from the event loop
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def _set_version(self, group_id: str) -> int:
+        version = self._versions[group_id] = next(self._counter)
+        self._versions.move_to_end(group_id)
+        if len(self._versions) > self.max_entries:
+            self._versions.popitem(last=False)
+        return version
+    
+    def version(self, group_id: str) -> int:
+        """Current version of a group; read it before loading the data a reply is rendered from"""
+        with self._lock:
+            version = self._versions.get(group_id)
+            return version if version is not None else self._set_version(group_id)
+    
+    def bump(self, group_id: str):
+        """Mark everything rendered for a group so far as stale"""
+        with self._lock:
+            self._set_version(group_id)
+    
+    def get(self, kind: str, group_id: str, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get((kind, group_id, key))
+            if entry is None or entry[0] != self._versions.get(group_id):
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end((kind, group_id, key))
+            return entry[1]
+    
+    def put(self, kind: str, group_id: str, key: Hashable, version: int, value: Any):
+        """Store a rendering made from data read at the given version"""
+        with self._lock:
+            current = self._entries.get((kind, group_id, key))
+            if current is not None and current[0] > version:
+                # A slower request rendered older data; keep the newer text
+                return
+            self._entries[(kind, group_id, key)] = (version, value)
+            self._entries.move_to_end((kind, group_id, key))
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'groups': len(self._versions),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0
+            }
+
+# Global rendered reply cache
+render_cache = RenderCache()
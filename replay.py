@@ -0,0 +1,224 @@
+"""Replay a recorded update stream through the bot's handlers against a scratch database.
+
+    python replay.py recordings/updates-*.jsonl.gz --speed 10
+
+Updates keep their recorded spacing divided by --speed (use --speed max to send them as fast
+as --concurrency allows). Updates go through the bot's own handler chain (build_handler_chain),
+rate limiter included, with buckets refilling on recorded time. Bot API calls are answered
+locally, so nothing reaches Telegram.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='+', help="recorded .jsonl or .jsonl.gz files")
+    parser.add_argument('--speed', default='1', help="time compression factor, e.g. 1, 10 or max")
+    parser.add_argument('--concurrency', type=int, default=64, help="maximum updates in flight")
+    parser.add_argument('--latency', type=float, default=0.0, help="simulated Bot API latency in seconds")
+    parser.add_argument('--limit', type=int, help="stop after this many updates")
+    parser.add_argument('--db', help="database file to use (default: a fresh temporary file)")
+    parser.add_argument('--output', help="write the JSON report here instead of stdout")
+    return parser.parse_args()
+
+args = parse_args()
+
+# Configuration is read from the environment at import time, so set it up before importing the bot
+os.environ.setdefault('BOT_TOKEN', '123456:replay')
+os.environ['DB_FILE'] = args.db or os.path.join(tempfile.mkdtemp(prefix='kirfight-replay-'), 'replay.db')
+os.environ.pop('RECORD_UPDATES_DIR', None)
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+from telegram import Update
+from telegram.ext import Application
+from config import config
+from database import db_manager
+from handlers import build_handler_chain
+from ratelimit import RateLimiter
+from fake_telegram import RecordingRequest
+from traffic_recorder import read_recording
+
+def percentile(samples: List[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def update_kind(payload: Dict[str, Any]) -> str:
+    """Command name, callback prefix or update type, used to group latencies"""
+    message = payload.get('message') or payload.get('edited_message')
+    if message and message.get('text', '').startswith('/'):
+        return message['text'].split()[0].split('@')[0]
+    if 'callback_query' in payload:
+        return 'callback:' + payload['callback_query'].get('data', '').split('_')[0]
+    return next((key for key in payload if key != 'update_id'), 'unknown')
+
+def challenge_source(payload: Dict[str, Any]) -> Optional[Tuple[int, int]]:
+    """(chat id, message id) of the /challenge command a recorded accept/decline press answers"""
+    query = payload.get('callback_query') or {}
+    if not query.get('data', '').startswith(('accept_', 'decline_')):
+        return None
+    # The buttons sit on the bot's reply, which quotes the command it answered
+    message = query.get('message') or {}
+    command = message.get('reply_to_message')
+    if not command or 'chat' not in message:
+        return None
+    return message['chat']['id'], command['message_id']
+
+class ChallengeTokens:
+    """Maps the random challenge tokens of a recording to the ones the replayed /challenge commands got.
+    
+    A press is matched through the command its challenge message answered: the replayed
+    bot sends its own challenge message as a reply to that same command.
+    """
+    
+    def __init__(self, request: RecordingRequest):
+        self.request = request
+        self._scanned = 0
+        self._created: Dict[Tuple[int, int], str] = {}
+        self._tokens: Dict[str, str] = {}
+    
+    def _scan(self):
+        calls = self.request.calls
+        for call in calls[self._scanned:]:
+            params = call['params']
+            if call['endpoint'] != 'sendMessage' or not params.get('reply_to_message_id') or 'reply_markup' not in params:
+                continue
+            for row in json.loads(params['reply_markup']).get('inline_keyboard', []):
+                for button in row:
+                    action, _, token = button.get('callback_data', '').partition('_')
+                    if action == 'accept':
+                        self._created[(int(params['chat_id']), int(params['reply_to_message_id']))] = token
+        self._scanned = len(calls)
+    
+    def translate(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        source = challenge_source(payload)
+        if source is None:
+            return payload
+        action, _, token = payload['callback_query']['data'].partition('_')
+        if token not in self._tokens:
+            self._scan()
+            if source not in self._created:
+                # The challenge was never created in this replay; the press stays unmatched
+                return payload
+            self._tokens[token] = self._created[source]
+        query = dict(payload['callback_query'], data=f"{action}_{self._tokens[token]}")
+        return dict(payload, callback_query=query)
+
+class RecordedClock:
+    """Recorded time of the latest update sent in, so the rate limiter refills at the recorded pace
+    whatever --speed replays at"""
+    
+    def __init__(self):
+        self.now = 0.0
+    
+    def __call__(self) -> float:
+        return self.now
+
+async def replay(application: Application, request: RecordingRequest, clock: RecordedClock) -> Dict[str, Any]:
+    speed = None if args.speed == 'max' else float(args.speed)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    lateness: List[float] = []
+    errors = 0
+    tokens = ChallengeTokens(request)
+    # Message updates still in flight, so a button press waits for the command that showed it
+    in_flight: Dict[Tuple[int, int], asyncio.Task] = {}
+    
+    async def process(payload: Dict[str, Any]):
+        nonlocal errors
+        source = challenge_source(payload)
+        if source in in_flight:
+            await asyncio.wait([in_flight[source]])
+        payload = tokens.translate(payload)
+        update = Update.de_json(payload, application.bot)
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await application.process_update(update)
+            except Exception:
+                errors += 1
+            latencies[update_kind(payload)].append(time.perf_counter() - start)
+    
+    loop = asyncio.get_running_loop()
+    tasks = []
+    first_recorded = None
+    started = loop.time()
+    for count, entry in enumerate(read_recording(args.files)):
+        if args.limit is not None and count >= args.limit:
+            break
+        if speed is not None:
+            if first_recorded is None:
+                first_recorded = entry['t']
+            due = started + (entry['t'] - first_recorded) / speed
+            delay = due - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                lateness.append(-delay)
+        clock.now = max(clock.now, entry['t'])
+        task = asyncio.create_task(process(entry['update']))
+        tasks.append(task)
+        message = entry['update'].get('message')
+        if message and 'chat' in message:
+            key = (message['chat']['id'], message['message_id'])
+            in_flight[key] = task
+            task.add_done_callback(lambda _, key=key: in_flight.pop(key, None))
+    await asyncio.gather(*tasks)
+    elapsed = loop.time() - started
+    
+    total = sum(len(samples) for samples in latencies.values())
+    return {
+        'updates': total,
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'throughput': round(total / elapsed, 1) if elapsed else 0.0,
+        'api_calls': len(request.calls),
+        'max_dispatch_lag_ms': round(max(lateness, default=0.0) * 1000, 3),
+        'kinds': {
+            kind: {
+                'count': len(samples),
+                'p50_ms': round(percentile(samples, 50) * 1000, 3),
+                'p95_ms': round(percentile(samples, 95) * 1000, 3),
+                'p99_ms': round(percentile(samples, 99) * 1000, 3)
+            }
+            for kind, samples in sorted(latencies.items())
+        }
+    }
+
+async def main():
+    db_manager.initialize_database()
+    request = RecordingRequest(latency=args.latency)
+    application = Application.builder().token(config.token).request(request).get_updates_request(RecordingRequest()).build()
+    clock = RecordedClock()
+    build_handler_chain(application, limiter=RateLimiter(clock=clock))
+    
+    async with application:
+        report = await replay(application, request, clock)
+    report['speed'] = args.speed
+    report['files'] = args.files
+    
+    print(
+        f"replayed {report['updates']} updates in {report['seconds']}s "
+        f"({report['throughput']}/s, {report['errors']} errors)",
+        file=sys.stderr
+    )
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+    
+    db_manager.shutdown()
+
+if __name__ == '__main__':
+    asyncio.run(main())
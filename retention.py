@@ -0,0 +1,178 @@
+import os
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from itertools import takewhile
+from typing import Tuple
+from config import config
+from database import db_manager
+from metrics import RETENTION_WORK
+
+logger = logging.getLogger(__name__)
+
+# PRAGMA auto_vacuum value of a database that can hand free pages back in small steps
+AUTO_VACUUM_INCREMENTAL = 2
+
+# Shards already warned about, so the warning is not repeated every pass
+_warned_shards = set()
+
+# Month a challenge is archived under; rows without a timestamp get their own archive
+MONTH_SQL = "COALESCE(strftime('%Y-%m', created_at), 'undated')"
+
+def archive_path(db_file: str, month: str) -> str:
+    """Archive database holding one month of a shard's challenge history"""
+    stem, ext = os.path.splitext(os.path.basename(db_file))
+    return os.path.join(config.archive_dir, f"{stem}-history-{month}{ext or '.db'}")
+
+class RetentionService:
+    @staticmethod
+    def archive_challenge_history(shard: int, cutoff: str, limit: int) -> int:
+        """Move up to `limit` of the oldest challenges created before `cutoff` into monthly archives.
+        
+        Like a shard move this copies and commits first, then deletes, so a run interrupted in
+        between leaves rows that the next run copies again (ignored) and then deletes.
+        """
+        with db_manager.connect_direct(shard) as conn:
+            # challenge_id grows with time, so the oldest rows are a prefix of the rowid order
+            rows = conn.execute(f"""
+                SELECT challenge_id, COALESCE(created_at, '') AS created_at, {MONTH_SQL} AS month
+                FROM challenge_history ORDER BY challenge_id LIMIT ?
+            """, (limit,)).fetchall()
+            expired = list(takewhile(lambda row: row['created_at'] < cutoff, rows))
+            if not expired:
+                return 0
+            first_id, last_id = expired[0]['challenge_id'], expired[-1]['challenge_id']
+            
+            for month in sorted({row['month'] for row in expired}):
+                path = archive_path(db_manager.db_files[shard], month)
+                os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+                conn.execute("ATTACH DATABASE ? AS archive", (path,))
+                try:
+                    conn.execute("""
+                        CREATE TABLE IF NOT EXISTS archive.challenge_history (
+                            challenge_id INTEGER PRIMARY KEY,
+                            challenger_id TEXT,
+                            opponent_id TEXT,
+                            group_id TEXT,
+                            amount INTEGER,
+                            winner_id TEXT,
+                            created_at TIMESTAMP
+                        )
+                    """)
+                    conn.execute("""
+                        CREATE INDEX IF NOT EXISTS archive.idx_challenge_history_group
+                        ON challenge_history (group_id, created_at)
+                    """)
+                    conn.execute(f"""
+                        INSERT OR IGNORE INTO archive.challenge_history
+                        SELECT challenge_id, challenger_id, opponent_id, group_id, amount, winner_id, created_at
+                        FROM main.challenge_history
+                        WHERE challenge_id BETWEEN ? AND ? AND {MONTH_SQL} = ?
+                    """, (first_id, last_id, month))
+                    conn.commit()
+                finally:
+                    # DETACH fails on a database the open transaction still uses, hiding the real error
+                    if conn.in_transaction:
+                        conn.rollback()
+                    conn.execute("DETACH DATABASE archive")
+            
+            # The copies are durable, so the hot rows can go; the rollups keep their totals
+            cursor = conn.execute(
+                "DELETE FROM challenge_history WHERE challenge_id BETWEEN ? AND ?", (first_id, last_id)
+            )
+            conn.commit()
+            return cursor.rowcount
+    
+    @staticmethod
+    def prune_quest_progress(shard: int, limit: int) -> int:
+        """Delete up to `limit` progress rows of quests that are gone, or unfinished ones of inactive quests.
+        
+        Completed rows always stay while their quest exists: they are what stops a quest that
+        is switched back on from paying out twice.
+        """
+        with db_manager.connect_direct(shard) as conn:
+            cursor = conn.execute("""
+                DELETE FROM user_quests WHERE rowid IN (
+                    SELECT uq.rowid FROM user_quests uq
+                    LEFT JOIN quests q ON q.quest_id = uq.quest_id
+                    WHERE q.quest_id IS NULL OR (q.is_active = 0 AND uq.completed = 0)
+                    LIMIT ?
+                )
+            """, (limit,))
+            conn.commit()
+            return cursor.rowcount
+    
+    @staticmethod
+    def incremental_vacuum_step(shard: int, pages: int) -> Tuple[int, int]:
+        """Return up to `pages` free pages to the file system; returns (pages freed, pages still free)"""
+        with db_manager.connect_direct(shard) as conn:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+                return 0, 0
+            before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            # The pragma only does its work as its result rows are stepped through
+            conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+            after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            return before - after, after
+    
+    @staticmethod
+    def auto_vacuum_mode(shard: int) -> int:
+        with db_manager.connect_direct(shard) as conn:
+            return conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    
+    @staticmethod
+    def enable_incremental_vacuum(shard: int):
+        """Switch an existing database to incremental auto-vacuum; rewrites the whole file, so only offline"""
+        with db_manager.connect_direct(shard) as conn:
+            conn.execute(f"PRAGMA auto_vacuum = {AUTO_VACUUM_INCREMENTAL}")
+            conn.execute("VACUUM")
+
+async def run_retention_pass():
+    """Archive old challenges, prune dead quest progress and shrink every shard, in throttled steps"""
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=config.history_retention_days)).strftime('%Y-%m-%d %H:%M:%S')
+    batch = config.retention_batch_rows
+    # Each step holds the shard's write lock briefly; the pause lets the bot's own writes through
+    pause = config.retention_pause_ms / 1000
+    
+    for shard in db_manager.shards:
+        archived = 0
+        while True:
+            moved = await db_manager.run(RetentionService.archive_challenge_history, shard, cutoff, batch)
+            archived += moved
+            if moved < batch:
+                break
+            await asyncio.sleep(pause)
+        
+        pruned = 0
+        while True:
+            deleted = await db_manager.run(RetentionService.prune_quest_progress, shard, batch)
+            pruned += deleted
+            if deleted < batch:
+                break
+            await asyncio.sleep(pause)
+        
+        vacuumed = 0
+        if await db_manager.run(RetentionService.auto_vacuum_mode, shard) != AUTO_VACUUM_INCREMENTAL:
+            if shard not in _warned_shards:
+                _warned_shards.add(shard)
+                logger.warning(
+                    f"{db_manager.db_files[shard]} does not use incremental auto-vacuum; stop the bot and run "
+                    f"'python retention_tool.py enable-vacuum' once to let it shrink"
+                )
+        else:
+            while True:
+                freed, remaining = await db_manager.run(
+                    RetentionService.incremental_vacuum_step, shard, config.vacuum_step_pages
+                )
+                vacuumed += freed
+                if not freed or not remaining:
+                    break
+                await asyncio.sleep(pause)
+        
+        RETENTION_WORK.labels('archived').inc(archived)
+        RETENTION_WORK.labels('pruned').inc(pruned)
+        RETENTION_WORK.labels('vacuumed_pages').inc(vacuumed)
+        if archived or pruned or vacuumed:
+            logger.info(
+                f"Retention on shard {shard}: archived {archived} challenges, "
+                f"pruned {pruned} quest progress rows, freed {vacuumed} pages"
+            )
@@ -0,0 +1,59 @@
+"""Run the retention jobs by hand, or prepare old databases for them.
+
+    python retention_tool.py run              # archive, prune and vacuum every shard now
+    python retention_tool.py status           # history rows, free pages and vacuum mode per shard
+    python retention_tool.py enable-vacuum    # switch to incremental auto-vacuum; stop the bot first
+
+enable-vacuum rewrites each file with a full VACUUM, which needs as much free disk
+space as the database itself and blocks writers while it runs.
+"""
+import os
+import asyncio
+import argparse
+
+# The bot's configuration requires a token even though nothing here talks to Telegram
+os.environ.setdefault('BOT_TOKEN', '0:retention-tool')
+
+from database import db_manager
+from retention import RetentionService, AUTO_VACUUM_INCREMENTAL, run_retention_pass
+
+def status():
+    for shard in db_manager.shards:
+        with db_manager.connect_direct(shard) as conn:
+            history = conn.execute("SELECT COUNT(*) FROM challenge_history").fetchone()[0]
+            free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        mode = 'incremental' if RetentionService.auto_vacuum_mode(shard) == AUTO_VACUUM_INCREMENTAL else 'off'
+        print(f"shard {shard}: {db_manager.db_files[shard]} history={history} "
+              f"pages={page_count} free={free_pages} auto_vacuum={mode}")
+
+async def run_once():
+    try:
+        await run_retention_pass()
+    finally:
+        db_manager.shutdown()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('run', help="run one retention pass now")
+    subparsers.add_parser('status', help="history size, free pages and vacuum mode per shard")
+    subparsers.add_parser('enable-vacuum', help="switch every shard to incremental auto-vacuum (offline)")
+    args = parser.parse_args()
+    
+    db_manager.migrate_database()
+    if args.command == 'run':
+        asyncio.run(run_once())
+        status()
+    elif args.command == 'status':
+        status()
+    elif args.command == 'enable-vacuum':
+        for shard in db_manager.shards:
+            if RetentionService.auto_vacuum_mode(shard) == AUTO_VACUUM_INCREMENTAL:
+                print(f"shard {shard}: already incremental")
+                continue
+            RetentionService.enable_incremental_vacuum(shard)
+            print(f"shard {shard}: {db_manager.db_files[shard]} switched to incremental auto-vacuum")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+import hmac
+import json
+import logging
+from typing import Callable, Dict
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+from config import config
+from metrics import render_metrics
+from query_trace import query_tracer
+
+logger = logging.getLogger(__name__)
+
+APPLICATION_KEY = web.AppKey('application', Application)
+HEALTH_CHECKS_KEY = web.AppKey('health_checks', Dict[str, Callable[[], bool]])
+
+LOOPBACK_HOSTS = {'127.0.0.1', '::1', 'localhost'}
+
+async def health_check(request: web.Request) -> web.Response:
+    return web.Response(text="✅ Bot is running successfully!")
+
+async def health(request: web.Request) -> web.Response:
+    failing = [name for name, check in request.app[HEALTH_CHECKS_KEY].items() if not check()]
+    if failing:
+        return web.json_response({"status": "unhealthy", "bot": "dick_competition_bot", "failing": failing}, status=503)
+    return web.json_response({"status": "healthy", "bot": "dick_competition_bot"})
+
+async def metrics(request: web.Request) -> web.Response:
+    body, content_type = render_metrics()
+    return web.Response(body=body, headers={'Content-Type': content_type})
+
+async def query_stats(request: web.Request) -> web.Response:
+    """Top statements by total time plus the recent slow-query log"""
+    if config.debug_token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {config.debug_token}'):
+        return web.Response(status=403)
+    if not config.db_query_trace:
+        return web.json_response({"error": "query tracing is disabled (DB_QUERY_TRACE=1)"}, status=404)
+    if request.query.get('reset') == '1':
+        snapshot = query_tracer.snapshot()
+        query_tracer.reset()
+        return web.json_response(snapshot)
+    return web.json_response(query_tracer.snapshot())
+
+async def telegram_webhook(request: web.Request) -> web.Response:
+    """Accept one Telegram update and hand it to the application's update queue"""
+    if config.webhook_secret and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != config.webhook_secret:
+        return web.Response(status=403)
+    
+    try:
+        data = await request.json()
+    except json.JSONDecodeError:
+        return web.Response(status=400, text="Invalid JSON")
+    
+    application = request.app[APPLICATION_KEY]
+    update = Update.de_json(data, application.bot)
+    await application.update_queue.put(update)
+    return web.Response()
+
+def create_web_app(application: Application, health_checks: Dict[str, Callable[[], bool]] = None) -> web.Application:
+    """HTTP app sharing the bot's event loop: health and metrics endpoints, plus the webhook in webhook mode"""
+    app = web.Application()
+    app[APPLICATION_KEY] = application
+    app[HEALTH_CHECKS_KEY] = health_checks or {}
+    app.router.add_get('/', health_check)
+    app.router.add_get('/health', health)
+    app.router.add_get('/metrics', metrics)
+    # Statements and caller names are internal, so only expose them behind a token or on loopback
+    if config.debug_token or config.host in LOOPBACK_HOSTS:
+        app.router.add_get('/debug/queries', query_stats)
+    if config.update_mode == 'webhook':
+        app.router.add_post(config.webhook_path, telegram_webhook)
+    return app
+
+async def start_web_server(application: Application, health_checks: Dict[str, Callable[[], bool]] = None) -> web.AppRunner:
+    runner = web.AppRunner(create_web_app(application, health_checks), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, config.host, config.port)
+    await site.start()
+    logger.info(f"✅ HTTP server listening on {config.host}:{config.port}")
+    return runner
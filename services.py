@@ -1,91 +1,140 @@
 import random
 import json
+import time
 from datetime import datetime, date
 from typing import Optional, List, Tuple, Dict, Any
 from database import db_manager
-from models import User, Quest, UserQuest, Challenge
+from leaderboard import leaderboard_cache
+from global_leaderboard import global_leaderboard
+from quest_cache import quest_cache
+from render_cache import render_cache
+from group_registry import group_registry
+from challenge_registry import PendingChallenge
+from models import User, Quest, UserQuest, Challenge, GroupSettings, ChallengePair, DailyChallengeStats
 from config import config
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Quest types whose progress tracks a current level (kept at its maximum) instead of a running count
+LEVEL_QUEST_TYPES = {'total_length'}
+
+def publish_user_changes(group_id: str, changes: List[Tuple[str, Dict[str, Any], int]]):
+    """Push committed user changes, as (user_id, new column values, length delta), to the in-memory views.
+    
+    Runs after the commit, so a ranking warmed from the database meanwhile is never left
+    without them; the player locks held by the handlers keep one player's changes in order.
+    """
+    for user_id, columns, delta in changes:
+        leaderboard_cache.update_user(group_id, user_id, **columns)
+        global_leaderboard.apply(user_id, delta, columns.get('username'))
+    render_cache.bump(group_id)
+
 class UserService:
     @staticmethod
-    def get_or_create_user(user_id: str, group_id: str, username: str) -> User:
-        with db_manager.get_connection() as conn:
+    def grow_user(user_id: str, group_id: str, username: str) -> Tuple[bool, str, int, int]:
+        growth = random.randint(config.min_daily_growth, config.max_daily_growth)
+        today = str(date.today())
+        
+        with db_manager.get_connection(group_id) as conn:
             cursor = conn.cursor()
+            # Create-or-grow in one statement; the WHERE makes a second growth on the same day a no-op
+            cursor.execute("""
+                INSERT INTO users (user_id, group_id, username, length, last_growth)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (user_id, group_id) DO UPDATE SET
+                    username = excluded.username,
+                    length = length + excluded.length,
+                    last_growth = excluded.last_growth,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE last_growth IS NOT excluded.last_growth
+                RETURNING length
+            """, (user_id, group_id, username, growth, today))
+            grown = cursor.fetchone()
             
-            cursor.execute(
-                "SELECT * FROM users WHERE user_id = ? AND group_id = ?",
-                (user_id, group_id)
-            )
-            user_data = cursor.fetchone()
-            
-            if not user_data:
+            if grown is None:
+                # Still pick up a changed display name, as every /grow did; an unchanged one costs no write
                 cursor.execute("""
-                    INSERT INTO users (user_id, group_id, username, length, last_growth)
-                    VALUES (?, ?, ?, 0, NULL)
-                """, (user_id, group_id, username))
-                conn.commit()
-                
-                return User(user_id=user_id, group_id=group_id, username=username)
-            else:
-                # Update username if changed
-                if user_data['username'] != username:
+                    UPDATE users SET username = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE user_id = ? AND group_id = ? AND username IS NOT ?
+                    RETURNING length
+                """, (username, user_id, group_id, username))
+                renamed = cursor.fetchone()
+                if renamed is None:
                     cursor.execute(
-                        "UPDATE users SET username = ?, updated_at = CURRENT_TIMESTAMP WHERE user_id = ? AND group_id = ?",
-                        (username, user_id, group_id)
+                        "SELECT length FROM users WHERE user_id = ? AND group_id = ?",
+                        (user_id, group_id)
                     )
-                    conn.commit()
-                
-                return User(**dict(user_data))
+                    return False, "⚠️ تو امروز کیرتو بزرگ کردی! فردا دوباره بیا", 0, cursor.fetchone()['length']
+                db_manager.commit(conn)
+                publish_user_changes(group_id, [(user_id, {'username': username, 'length': renamed['length']}, 0)])
+                return False, "⚠️ تو امروز کیرتو بزرگ کردی! فردا دوباره بیا", 0, renamed['length']
+            
+            new_length = grown['length']
+            changes = [(user_id, {'username': username, 'length': new_length}, growth)]
+            
+            # Check for quest progress
+            QuestService.apply_event(cursor, user_id, group_id, {'daily_growth': 1, 'total_length': new_length}, changes)
+            db_manager.commit(conn)
+            publish_user_changes(group_id, changes)
+        
+        return True, f"🌱 کیرت {growth} سانتی‌متر بزرگ شد!\n📏 طول جدید: {new_length} سانتی‌متر", growth, new_length
     
     @staticmethod
-    def can_grow_today(user: User) -> bool:
-        today = str(date.today())
-        return user.last_growth != today
+    def get_leaderboard_page(group_id: str, page: int, page_size: int = None) -> Tuple[List[User], int, int]:
+        """Return (users, page, total_pages); out-of-range pages are clamped"""
+        page_size = page_size or config.leaderboard_limit
+        total = leaderboard_cache.size(group_id, UserService.load_group_ranking)
+        total_pages = max(1, -(-total // page_size))
+        page = min(max(1, page), total_pages)
+        users = leaderboard_cache.page(group_id, (page - 1) * page_size, page_size, UserService.load_group_ranking)
+        return users, page, total_pages
     
     @staticmethod
-    def grow_user(user_id: str, group_id: str, username: str) -> Tuple[bool, str, int, int]:
-        user = UserService.get_or_create_user(user_id, group_id, username)
-        
-        if not UserService.can_grow_today(user):
-            return False, "⚠️ تو امروز کیرتو بزرگ کردی! فردا دوباره بیا", 0, user.length
-        
-        growth = random.randint(config.min_daily_growth, config.max_daily_growth)
-        new_length = user.length + growth
-        today = str(date.today())
-        
-        with db_manager.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                UPDATE users SET length = ?, last_growth = ?, updated_at = CURRENT_TIMESTAMP
-                WHERE user_id = ? AND group_id = ?
-            """, (new_length, today, user_id, group_id))
-            conn.commit()
-        
-        # Check for quest progress
-        QuestService.update_quest_progress(user_id, group_id, 'daily_growth', 1)
-        QuestService.update_quest_progress(user_id, group_id, 'total_length', new_length)
-        
-        return True, f"🌱 کیرت {growth} سانتی‌متر بزرگ شد!\n📏 طول جدید: {new_length} سانتی‌متر", growth, new_length
+    def get_user_rank(user_id: str, group_id: str) -> Tuple[Optional[int], Optional[User], Optional[User], int]:
+        return leaderboard_cache.rank(group_id, user_id, UserService.load_group_ranking)
     
     @staticmethod
-    def get_leaderboard(group_id: str, limit: int = None) -> List[User]:
-        limit = limit or config.leaderboard_limit
-        
-        with db_manager.get_connection() as conn:
+    def load_group_ranking(group_id: str) -> List[User]:
+        """Load every user of a group in leaderboard order, used to warm the leaderboard cache"""
+        with db_manager.get_connection(group_id) as conn:
             cursor = conn.cursor()
             cursor.execute("""
-                SELECT * FROM users WHERE group_id = ? 
-                ORDER BY length DESC LIMIT ?
-            """, (group_id, limit))
+                SELECT user_id, group_id, username, length, total_challenges, challenges_won
+                FROM users WHERE group_id = ?
+                ORDER BY length DESC
+            """, (group_id,))
             
             return [User(**dict(row)) for row in cursor.fetchall()]
     
+    @staticmethod
+    def load_global_totals() -> Dict[str, Tuple[str, int]]:
+        """{user_id: (username, length summed over every group)}, merged across shards"""
+        # user_id -> (updated_at of the newest row seen, its username, total length)
+        merged: Dict[str, Tuple[str, str, int]] = {}
+        for shard in db_manager.shards:
+            with db_manager.get_shard_connection(shard) as conn:
+                cursor = conn.cursor()
+                # The bare username comes from the row holding MAX(updated_at), i.e. the shard's latest one
+                cursor.execute("""
+                    SELECT user_id, username, SUM(length) AS length, MAX(COALESCE(updated_at, '')) AS updated_at
+                    FROM users GROUP BY user_id
+                """)
+                for row in cursor.fetchall():
+                    updated_at, username, length = merged.get(row['user_id'], ('', row['username'], 0))
+                    if row['updated_at'] >= updated_at:
+                        updated_at, username = row['updated_at'], row['username']
+                    merged[row['user_id']] = (updated_at, username, length + row['length'])
+        return {user_id: (username, length) for user_id, (_, username, length) in merged.items()}
+    
+    @staticmethod
+    def reconcile_global_leaderboard() -> int:
+        """Rebuild the global leaderboard from the users tables; returns how many players had drifted"""
+        return global_leaderboard.reconcile(UserService.load_global_totals())
+    
     @staticmethod
     def get_user_stats(user_id: str, group_id: str) -> Optional[User]:
-        with db_manager.get_connection() as conn:
+        with db_manager.get_connection(group_id) as conn:
             cursor = conn.cursor()
             cursor.execute(
                 "SELECT * FROM users WHERE user_id = ? AND group_id = ?",
@@ -93,21 +142,21 @@ class UserService:
             )
             row = cursor.fetchone()
             return User(**dict(row)) if row else None
-
-class ChallengeService:
+    
     @staticmethod
-    def can_challenge(challenger_id: str, opponent_id: str, group_id: str, amount: int) -> Tuple[bool, str]:
-        if challenger_id == opponent_id:
-            return False, "⚠️ نمیتونی با خودت چالش کنی"
-        
-        with db_manager.get_connection() as conn:
+    def get_usernames(user_ids: List[str], group_id: str) -> Dict[str, str]:
+        placeholders = ", ".join("?" for _ in user_ids)
+        with db_manager.get_connection(group_id) as conn:
             cursor = conn.cursor()
             cursor.execute(
-                "SELECT * FROM users WHERE (user_id = ? OR user_id = ?) AND group_id = ?",
-                (challenger_id, opponent_id, group_id)
+                f"SELECT user_id, username FROM users WHERE user_id IN ({placeholders}) AND group_id = ?",
+                (*user_ids, group_id)
             )
-            users = {row['user_id']: dict(row) for row in cursor.fetchall()}
-        
+            return {row['user_id']: row['username'] for row in cursor.fetchall()}
+
+class ChallengeService:
+    @staticmethod
+    def _check_users(users: Dict[str, Dict[str, Any]], challenger_id: str, opponent_id: str, amount: int) -> Tuple[bool, str]:
         if len(users) != 2:
             return False, "⚠️ هر دو کاربر باید در مسابقه شرکت کرده باشند"
         
@@ -123,60 +172,223 @@ class ChallengeService:
         return True, "OK"
     
     @staticmethod
-    def execute_challenge(challenger_id: str, opponent_id: str, group_id: str, amount: int) -> Tuple[str, str, int, int]:
-        winner_id = random.choice([challenger_id, opponent_id])
-        loser_id = opponent_id if winner_id == challenger_id else challenger_id
+    def _load_pair(cursor, challenger_id: str, opponent_id: str, group_id: str) -> Dict[str, Dict[str, Any]]:
+        cursor.execute(
+            "SELECT * FROM users WHERE (user_id = ? OR user_id = ?) AND group_id = ?",
+            (challenger_id, opponent_id, group_id)
+        )
+        return {row['user_id']: dict(row) for row in cursor.fetchall()}
+    
+    @staticmethod
+    def can_challenge(challenger_id: str, opponent_id: str, group_id: str, amount: int) -> Tuple[bool, str]:
+        if challenger_id == opponent_id:
+            return False, "⚠️ نمیتونی با خودت چالش کنی"
+        
+        with db_manager.get_connection(group_id) as conn:
+            users = ChallengeService._load_pair(conn.cursor(), challenger_id, opponent_id, group_id)
         
-        with db_manager.get_connection() as conn:
+        return ChallengeService._check_users(users, challenger_id, opponent_id, amount)
+    
+    @staticmethod
+    def accept_challenge(challenge: PendingChallenge) -> Tuple[bool, str, Optional[Tuple[str, str, int, int]]]:
+        """Run an accepted challenge exactly once, re-checking both players' lengths first"""
+        with db_manager.get_connection(challenge.group_id) as conn:
             cursor = conn.cursor()
             
-            # Get current user data
-            cursor.execute(
-                "SELECT * FROM users WHERE (user_id = ? OR user_id = ?) AND group_id = ?",
-                (challenger_id, opponent_id, group_id)
-            )
-            users = {row['user_id']: dict(row) for row in cursor.fetchall()}
+            # Whoever deletes the persisted row owns the challenge, even across processes
+            cursor.execute("DELETE FROM pending_challenges WHERE token = ?", (challenge.token,))
+            if cursor.rowcount == 0:
+                return False, "⌛ این چالش قبلاً جواب داده شده یا منقضی شده", None
             
-            winner_new_length = users[winner_id]['length'] + amount
-            loser_new_length = max(0, users[loser_id]['length'] - amount)
+            users = ChallengeService._load_pair(cursor, challenge.challenger_id, challenge.opponent_id, challenge.group_id)
+            ok, message = ChallengeService._check_users(users, challenge.challenger_id, challenge.opponent_id, challenge.amount)
+            if not ok:
+                db_manager.commit(conn)
+                return False, message, None
             
-            # Update lengths and stats
-            cursor.execute("""
-                UPDATE users SET 
-                    length = ?, 
-                    total_challenges = total_challenges + 1,
-                    challenges_won = challenges_won + ?,
-                    updated_at = CURRENT_TIMESTAMP
-                WHERE user_id = ? AND group_id = ?
-            """, (winner_new_length, 1, winner_id, group_id))
-            
-            cursor.execute("""
-                UPDATE users SET 
-                    length = ?, 
-                    total_challenges = total_challenges + 1,
-                    updated_at = CURRENT_TIMESTAMP
-                WHERE user_id = ? AND group_id = ?
-            """, (loser_new_length, loser_id, group_id))
-            
-            # Record challenge history
+            changes = []
+            result = ChallengeService._apply_challenge(
+                cursor, users, challenge.challenger_id, challenge.opponent_id, challenge.group_id, challenge.amount,
+                changes
+            )
+            db_manager.commit(conn)
+            publish_user_changes(challenge.group_id, changes)
+            return True, "OK", result
+    
+    @staticmethod
+    def _apply_challenge(cursor, users: Dict[str, Dict[str, Any]], challenger_id: str, opponent_id: str,
+                         group_id: str, amount: int,
+                         changes: List[Tuple[str, Dict[str, Any], int]]) -> Tuple[str, str, int, int]:
+        winner_id = random.choice([challenger_id, opponent_id])
+        loser_id = opponent_id if winner_id == challenger_id else challenger_id
+        
+        winner_new_length = users[winner_id]['length'] + amount
+        loser_new_length = max(0, users[loser_id]['length'] - amount)
+        
+        # Update lengths and stats
+        cursor.execute("""
+            UPDATE users SET 
+                length = ?, 
+                total_challenges = total_challenges + 1,
+                challenges_won = challenges_won + ?,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE user_id = ? AND group_id = ?
+            RETURNING total_challenges, challenges_won
+        """, (winner_new_length, 1, winner_id, group_id))
+        winner_stats = cursor.fetchone()
+        
+        cursor.execute("""
+            UPDATE users SET 
+                length = ?, 
+                total_challenges = total_challenges + 1,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE user_id = ? AND group_id = ?
+            RETURNING total_challenges, challenges_won
+        """, (loser_new_length, loser_id, group_id))
+        loser_stats = cursor.fetchone()
+        
+        changes += [
+            (winner_id, {
+                'username': users[winner_id]['username'], 'length': winner_new_length,
+                'total_challenges': winner_stats['total_challenges'], 'challenges_won': winner_stats['challenges_won']
+            }, winner_new_length - users[winner_id]['length']),
+            (loser_id, {
+                'username': users[loser_id]['username'], 'length': loser_new_length,
+                'total_challenges': loser_stats['total_challenges'], 'challenges_won': loser_stats['challenges_won']
+            }, loser_new_length - users[loser_id]['length'])
+        ]
+        
+        # Record challenge history
+        cursor.execute("""
+            INSERT INTO challenge_history (challenger_id, opponent_id, group_id, amount, winner_id)
+            VALUES (?, ?, ?, ?, ?)
+        """, (challenger_id, opponent_id, group_id, amount, winner_id))
+        ChallengeService._update_rollups(
+            cursor, group_id, winner_id, loser_id,
+            winner_new_length - users[winner_id]['length'], users[loser_id]['length'] - loser_new_length
+        )
+        
+        # Update quest progress
+        QuestService.apply_event(cursor, winner_id, group_id, {
+            'challenges_won': 1,
+            'challenges_participated': 1,
+            'total_length': winner_new_length
+        }, changes)
+        QuestService.apply_event(cursor, loser_id, group_id, {'challenges_participated': 1}, changes)
+        
+        return winner_id, loser_id, winner_new_length, loser_new_length
+    
+    @staticmethod
+    def _update_rollups(cursor, group_id: str, winner_id: str, loser_id: str, gained: int, lost: int):
+        """Keep the head-to-head and daily counters in step with challenge_history, in the same transaction"""
+        player_a, player_b = sorted((winner_id, loser_id))
+        a_won = winner_id == player_a
+        cursor.execute("""
+            INSERT INTO challenge_pairs (group_id, player_a, player_b, challenges, a_wins, a_net, last_at)
+            VALUES (?, ?, ?, 1, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT (group_id, player_a, player_b) DO UPDATE SET
+                challenges = challenges + 1,
+                a_wins = a_wins + excluded.a_wins,
+                a_net = a_net + excluded.a_net,
+                last_at = excluded.last_at
+        """, (group_id, player_a, player_b, int(a_won), gained if a_won else -lost))
+        
+        today = str(date.today())
+        cursor.executemany("""
+            INSERT INTO user_daily_stats (group_id, user_id, day, challenges, wins, gained, lost)
+            VALUES (?, ?, ?, 1, ?, ?, ?)
+            ON CONFLICT (group_id, user_id, day) DO UPDATE SET
+                challenges = challenges + 1,
+                wins = wins + excluded.wins,
+                gained = gained + excluded.gained,
+                lost = lost + excluded.lost
+        """, [
+            (group_id, winner_id, today, 1, gained, 0),
+            (group_id, loser_id, today, 0, 0, lost)
+        ])
+    
+    @staticmethod
+    def get_daily_stats(user_id: str, group_id: str, days: int = 7) -> List[DailyChallengeStats]:
+        """The user's per-day challenge totals of the last few days, newest first"""
+        since = str(date.fromordinal(date.today().toordinal() - days + 1))
+        with db_manager.get_connection(group_id) as conn:
+            cursor = conn.cursor()
             cursor.execute("""
-                INSERT INTO challenge_history (challenger_id, opponent_id, group_id, amount, winner_id)
-                VALUES (?, ?, ?, ?, ?)
-            """, (challenger_id, opponent_id, group_id, amount, winner_id))
-            
-            conn.commit()
-            
-            # Update quest progress
-            QuestService.update_quest_progress(winner_id, group_id, 'challenges_won', 1)
-            QuestService.update_quest_progress(loser_id, group_id, 'challenges_participated', 1)
-            QuestService.update_quest_progress(winner_id, group_id, 'challenges_participated', 1)
-            
-            return winner_id, loser_id, winner_new_length, loser_new_length
+                SELECT * FROM user_daily_stats
+                WHERE group_id = ? AND user_id = ? AND day >= ?
+                ORDER BY day DESC
+            """, (group_id, user_id, since))
+            return [DailyChallengeStats(**dict(row)) for row in cursor.fetchall()]
+    
+    @staticmethod
+    def get_head_to_head(user_id: str, other_id: str, group_id: str) -> Optional[ChallengePair]:
+        player_a, player_b = sorted((user_id, other_id))
+        with db_manager.get_connection(group_id) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT * FROM challenge_pairs WHERE group_id = ? AND player_a = ? AND player_b = ?",
+                (group_id, player_a, player_b)
+            )
+            row = cursor.fetchone()
+            return ChallengePair(**dict(row)) if row else None
+    
+    @staticmethod
+    def get_rivalries(group_id: str, limit: int = 5) -> List[ChallengePair]:
+        """Pairs of the group that challenged each other the most"""
+        with db_manager.get_connection(group_id) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT * FROM challenge_pairs WHERE group_id = ? ORDER BY challenges DESC LIMIT ?",
+                (group_id, limit)
+            )
+            return [ChallengePair(**dict(row)) for row in cursor.fetchall()]
+    
+    @staticmethod
+    def save_pending(challenge: PendingChallenge, discarded: List[PendingChallenge]):
+        """Persist a newly opened challenge and forget the ones it pushed out of the registry"""
+        if discarded:
+            ChallengeService.discard_pending(discarded)
+        with db_manager.get_connection(challenge.group_id) as conn:
+            conn.execute("""
+                INSERT INTO pending_challenges (token, challenger_id, opponent_id, group_id, amount, expires_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (challenge.token, challenge.challenger_id, challenge.opponent_id,
+                  challenge.group_id, challenge.amount, challenge.expires_at))
+            db_manager.commit(conn)
+    
+    @staticmethod
+    def discard_pending(challenges: List[PendingChallenge]):
+        tokens_by_shard: Dict[int, List[Tuple[str]]] = {}
+        for challenge in challenges:
+            tokens_by_shard.setdefault(db_manager.shard_for(challenge.group_id), []).append((challenge.token,))
+        
+        for shard, tokens in tokens_by_shard.items():
+            with db_manager.get_shard_connection(shard) as conn:
+                conn.executemany("DELETE FROM pending_challenges WHERE token = ?", tokens)
+                db_manager.commit(conn)
+    
+    @staticmethod
+    def load_pending() -> List[PendingChallenge]:
+        """Drop expired persisted challenges and return the rest, used to refill the registry"""
+        challenges = []
+        for shard in db_manager.shards:
+            with db_manager.get_shard_connection(shard) as conn:
+                cursor = conn.cursor()
+                cursor.execute("DELETE FROM pending_challenges WHERE expires_at <= ?", (time.time(),))
+                cursor.execute("SELECT * FROM pending_challenges")
+                challenges.extend(PendingChallenge(**dict(row)) for row in cursor.fetchall())
+                db_manager.commit(conn)
+        return challenges
 
 class QuestService:
     @staticmethod
     def get_active_quests(group_id: str) -> List[Quest]:
-        with db_manager.get_connection() as conn:
+        return quest_cache.get(group_id, QuestService.load_active_quests).quests
+    
+    @staticmethod
+    def load_active_quests(group_id: str) -> List[Quest]:
+        """Read a group's active quests from the database, used to fill the quest cache"""
+        with db_manager.get_connection(group_id) as conn:
             cursor = conn.cursor()
             cursor.execute(
                 "SELECT * FROM quests WHERE group_id = ? AND is_active = 1",
@@ -186,7 +398,7 @@ class QuestService:
     
     @staticmethod
     def get_user_quest_progress(user_id: str, group_id: str) -> Dict[int, UserQuest]:
-        with db_manager.get_connection() as conn:
+        with db_manager.get_connection(group_id) as conn:
             cursor = conn.cursor()
             cursor.execute(
                 "SELECT * FROM user_quests WHERE user_id = ? AND group_id = ?",
@@ -195,49 +407,94 @@ class QuestService:
             return {row['quest_id']: UserQuest(**dict(row)) for row in cursor.fetchall()}
     
     @staticmethod
-    def update_quest_progress(user_id: str, group_id: str, quest_type: str, value: int):
-        active_quests = QuestService.get_active_quests(group_id)
+    def apply_event(cursor, user_id: str, group_id: str, event: Dict[str, int],
+                    changes: List[Tuple[str, Dict[str, Any], int]]) -> int:
+        """Apply one game event ({quest_type: value}) to every matching active quest of a user.
         
-        for quest in active_quests:
-            if quest.quest_type == quest_type:
-                with db_manager.get_connection() as conn:
-                    cursor = conn.cursor()
-                    
-                    # Get or create user quest progress
-                    cursor.execute(
-                        "SELECT * FROM user_quests WHERE user_id = ? AND group_id = ? AND quest_id = ?",
-                        (user_id, group_id, quest.quest_id)
-                    )
-                    user_quest = cursor.fetchone()
-                    
-                    if not user_quest:
-                        cursor.execute("""
-                            INSERT INTO user_quests (user_id, group_id, quest_id, progress)
-                            VALUES (?, ?, ?, ?)
-                        """, (user_id, group_id, quest.quest_id, value))
-                    else:
-                        new_progress = user_quest['progress'] + value
-                        completed = new_progress >= quest.target_value
-                        
-                        cursor.execute("""
-                            UPDATE user_quests SET 
-                                progress = ?, 
-                                completed = ?,
-                                completed_at = CASE WHEN ? THEN CURRENT_TIMESTAMP ELSE completed_at END
-                            WHERE user_id = ? AND group_id = ? AND quest_id = ?
-                        """, (new_progress, completed, completed, user_id, group_id, quest.quest_id))
-                        
-                        # Award quest reward if completed
-                        if completed and not user_quest['completed']:
-                            cursor.execute("""
-                                UPDATE users SET length = length + ?, updated_at = CURRENT_TIMESTAMP
-                                WHERE user_id = ? AND group_id = ?
-                            """, (quest.reward, user_id, group_id))
-                    
-                    conn.commit()
-    
-    @staticmethod
-    def create_default_quests(group_id: str):
+        Runs inside the caller's transaction with a fixed number of statements regardless of
+        how many quests match, and returns the total reward paid out. A reward is added to
+        `changes` for the caller to publish once it has committed.
+        """
+        if not GroupService.get_settings(group_id).quests_enabled:
+            return 0
+        
+        group_quests = quest_cache.get(group_id, QuestService.load_active_quests)
+        event = {quest_type: value for quest_type, value in event.items() if quest_type in group_quests.by_type}
+        if not event:
+            return 0
+        
+        completed_ids = []
+        for mode in ('counter', 'level'):
+            values = [
+                (quest_type, value) for quest_type, value in event.items()
+                if (quest_type in LEVEL_QUEST_TYPES) == (mode == 'level')
+            ]
+            if not values:
+                continue
+            
+            progress_sql = "MAX(progress, excluded.progress)" if mode == 'level' else "progress + excluded.progress"
+            cursor.execute(f"""
+                WITH event(quest_type, amount) AS (VALUES {", ".join("(?, ?)" for _ in values)})
+                INSERT INTO user_quests (user_id, group_id, quest_id, progress, completed, completed_at)
+                SELECT ?, ?, q.quest_id, e.amount, e.amount >= q.target_value,
+                       CASE WHEN e.amount >= q.target_value THEN CURRENT_TIMESTAMP END
+                FROM quests q JOIN event e ON e.quest_type = q.quest_type
+                WHERE q.group_id = ? AND q.is_active = 1
+                ON CONFLICT (user_id, group_id, quest_id) DO UPDATE SET
+                    progress = {progress_sql},
+                    completed = {progress_sql} >= (SELECT target_value FROM quests WHERE quest_id = excluded.quest_id),
+                    completed_at = CASE
+                        WHEN {progress_sql} >= (SELECT target_value FROM quests WHERE quest_id = excluded.quest_id)
+                        THEN CURRENT_TIMESTAMP
+                    END
+                WHERE completed = 0
+                RETURNING quest_id, completed
+            """, (*[item for pair in values for item in pair], user_id, group_id, group_id))
+            completed_ids += [row['quest_id'] for row in cursor.fetchall() if row['completed']]
+        
+        if not completed_ids:
+            return 0
+        
+        # Award the rewards of every quest this event completed in one update
+        reward = sum(group_quests.by_id[quest_id].reward for quest_id in completed_ids if quest_id in group_quests.by_id)
+        cursor.execute("""
+            UPDATE users SET length = length + ?, updated_at = CURRENT_TIMESTAMP
+            WHERE user_id = ? AND group_id = ?
+            RETURNING length
+        """, (reward, user_id, group_id))
+        rewarded = cursor.fetchone()
+        if not rewarded:
+            return 0
+        
+        changes.append((user_id, {'length': rewarded['length']}, reward))
+        return reward
+    
+    @staticmethod
+    def get_all_quests(group_id: str) -> List[Quest]:
+        """Every quest of a group, active or not, for the admin command"""
+        with db_manager.get_connection(group_id) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM quests WHERE group_id = ? ORDER BY quest_id", (group_id,))
+            return [Quest(**dict(row)) for row in cursor.fetchall()]
+    
+    @staticmethod
+    def set_quest_active(quest_id: int, group_id: str, is_active: bool) -> bool:
+        with db_manager.get_connection(group_id) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE quests SET is_active = ? WHERE quest_id = ? AND group_id = ?",
+                (is_active, quest_id, group_id)
+            )
+            db_manager.commit(conn)
+            updated = cursor.rowcount > 0
+        
+        quest_cache.invalidate(group_id)
+        render_cache.bump(group_id)
+        return updated
+    
+    @staticmethod
+    def insert_default_quests(cursor, group_id: str):
+        """Add the default quests a group is missing; (group_id, title) is unique, so existing ones are kept"""
         default_quests = [
             {
                 'title': 'رشد روزانه',
@@ -265,16 +522,179 @@ class QuestService:
             }
         ]
         
-        with db_manager.get_connection() as conn:
+        cursor.executemany("""
+            INSERT OR IGNORE INTO quests 
+            (group_id, title, description, reward, quest_type, target_value, requirements)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, [
+            (
+                group_id, quest_data['title'], quest_data['description'],
+                quest_data['reward'], quest_data['quest_type'],
+                quest_data['target_value'], quest_data['requirements']
+            )
+            for quest_data in default_quests
+        ])
+
+class GroupService:
+    SETTING_COLUMNS = ('daily_growth_enabled', 'challenges_enabled', 'quests_enabled')
+    
+    @staticmethod
+    def bootstrap_group(group_id: str, group_name: Optional[str] = None) -> bool:
+        """Register a group and give it the default quests; only the first call for a group does anything"""
+        # Settings loaded from a row carry its created_at; defaults for an unknown group do not
+        cached = group_registry.peek(group_id)
+        if cached is not None and cached.created_at is not None:
+            return False
+        
+        with db_manager.get_connection(group_id) as conn:
             cursor = conn.cursor()
-            for quest_data in default_quests:
-                cursor.execute("""
-                    INSERT OR IGNORE INTO quests 
-                    (group_id, title, description, reward, quest_type, target_value, requirements)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    group_id, quest_data['title'], quest_data['description'],
-                    quest_data['reward'], quest_data['quest_type'],
-                    quest_data['target_value'], quest_data['requirements']
-                ))
-            conn.commit()
+            # The primary key makes this the one-time gate, even with several processes racing
+            cursor.execute(
+                "INSERT OR IGNORE INTO group_settings (group_id, group_name) VALUES (?, ?)",
+                (group_id, group_name)
+            )
+            created = cursor.rowcount == 1
+            if created:
+                QuestService.insert_default_quests(cursor, group_id)
+            db_manager.commit(conn)
+        
+        if created:
+            logger.info(f"Bootstrapped group {group_id}")
+            quest_cache.invalidate(group_id)
+            render_cache.bump(group_id)
+        group_registry.invalidate(group_id)
+        return created
+    
+    @staticmethod
+    def get_settings(group_id: str) -> GroupSettings:
+        return group_registry.get(group_id, GroupService.load_settings)
+    
+    @staticmethod
+    def load_settings(group_id: str) -> GroupSettings:
+        """Settings row of a group; groups that were never bootstrapped have everything enabled"""
+        with db_manager.get_connection(group_id) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM group_settings WHERE group_id = ?", (group_id,))
+            row = cursor.fetchone()
+        if row is None:
+            return GroupSettings(group_id=group_id)
+        settings = dict(row)
+        for column in GroupService.SETTING_COLUMNS:
+            settings[column] = bool(settings[column])
+        return GroupSettings(**settings)
+    
+    @staticmethod
+    def update_settings(group_id: str, **flags: bool) -> bool:
+        unknown = set(flags) - set(GroupService.SETTING_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown group settings: {', '.join(sorted(unknown))}")
+        if not flags:
+            return False
+        
+        assignments = ", ".join(f"{column} = ?" for column in flags)
+        with db_manager.get_connection(group_id) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"UPDATE group_settings SET {assignments} WHERE group_id = ?",
+                (*flags.values(), group_id)
+            )
+            db_manager.commit(conn)
+            updated = cursor.rowcount > 0
+        
+        group_registry.invalidate(group_id)
+        return updated
+
+class AsyncUserService:
+    """Awaitable UserService; every call runs on the database worker pool"""
+    
+    @staticmethod
+    async def grow_user(user_id: str, group_id: str, username: str) -> Tuple[bool, str, int, int]:
+        return await db_manager.run(UserService.grow_user, user_id, group_id, username)
+    
+    @staticmethod
+    async def get_leaderboard_page(group_id: str, page: int, page_size: int = None) -> Tuple[List[User], int, int]:
+        return await db_manager.run(UserService.get_leaderboard_page, group_id, page, page_size)
+    
+    @staticmethod
+    async def get_user_rank(user_id: str, group_id: str) -> Tuple[Optional[int], Optional[User], Optional[User], int]:
+        return await db_manager.run(UserService.get_user_rank, user_id, group_id)
+    
+    @staticmethod
+    async def get_user_stats(user_id: str, group_id: str) -> Optional[User]:
+        return await db_manager.run(UserService.get_user_stats, user_id, group_id)
+    
+    @staticmethod
+    async def reconcile_global_leaderboard() -> int:
+        return await db_manager.run(UserService.reconcile_global_leaderboard)
+    
+    @staticmethod
+    async def get_usernames(user_ids: List[str], group_id: str) -> Dict[str, str]:
+        return await db_manager.run(UserService.get_usernames, user_ids, group_id)
+
+class AsyncChallengeService:
+    """Awaitable ChallengeService; every call runs on the database worker pool"""
+    
+    @staticmethod
+    async def can_challenge(challenger_id: str, opponent_id: str, group_id: str, amount: int) -> Tuple[bool, str]:
+        return await db_manager.run(ChallengeService.can_challenge, challenger_id, opponent_id, group_id, amount)
+    
+    @staticmethod
+    async def accept_challenge(challenge: PendingChallenge) -> Tuple[bool, str, Optional[Tuple[str, str, int, int]]]:
+        return await db_manager.run(ChallengeService.accept_challenge, challenge)
+    
+    @staticmethod
+    async def save_pending(challenge: PendingChallenge, discarded: List[PendingChallenge]):
+        return await db_manager.run(ChallengeService.save_pending, challenge, discarded)
+    
+    @staticmethod
+    async def discard_pending(challenges: List[PendingChallenge]):
+        return await db_manager.run(ChallengeService.discard_pending, challenges)
+    
+    @staticmethod
+    async def get_daily_stats(user_id: str, group_id: str, days: int = 7) -> List[DailyChallengeStats]:
+        return await db_manager.run(ChallengeService.get_daily_stats, user_id, group_id, days)
+    
+    @staticmethod
+    async def get_head_to_head(user_id: str, other_id: str, group_id: str) -> Optional[ChallengePair]:
+        return await db_manager.run(ChallengeService.get_head_to_head, user_id, other_id, group_id)
+    
+    @staticmethod
+    async def get_rivalries(group_id: str, limit: int = 5) -> List[ChallengePair]:
+        return await db_manager.run(ChallengeService.get_rivalries, group_id, limit)
+
+class AsyncQuestService:
+    """Awaitable QuestService; every call runs on the database worker pool"""
+    
+    @staticmethod
+    async def get_active_quests(group_id: str) -> List[Quest]:
+        return await db_manager.run(QuestService.get_active_quests, group_id)
+    
+    @staticmethod
+    async def get_user_quest_progress(user_id: str, group_id: str) -> Dict[int, UserQuest]:
+        return await db_manager.run(QuestService.get_user_quest_progress, user_id, group_id)
+    
+    @staticmethod
+    async def get_all_quests(group_id: str) -> List[Quest]:
+        return await db_manager.run(QuestService.get_all_quests, group_id)
+    
+    @staticmethod
+    async def set_quest_active(quest_id: int, group_id: str, is_active: bool) -> bool:
+        return await db_manager.run(QuestService.set_quest_active, quest_id, group_id, is_active)
+
+class AsyncGroupService:
+    """Awaitable GroupService; cached settings are returned without a trip to the database workers"""
+    
+    @staticmethod
+    async def bootstrap_group(group_id: str, group_name: Optional[str] = None) -> bool:
+        return await db_manager.run(GroupService.bootstrap_group, group_id, group_name)
+    
+    @staticmethod
+    async def get_settings(group_id: str) -> GroupSettings:
+        settings = group_registry.peek(group_id)
+        if settings is not None:
+            return settings
+        return await db_manager.run(GroupService.get_settings, group_id)
+    
+    @staticmethod
+    async def update_settings(group_id: str, **flags: bool) -> bool:
+        return await db_manager.run(GroupService.update_settings, group_id, **flags)
@@ -0,0 +1,184 @@
+"""Offline maintenance of the per-group database shards. Stop the bot before running it.
+
+    python shard_tool.py status
+    python shard_tool.py rebalance --shards 8           # split into 8 shards by group hash
+    python shard_tool.py --map shards.json move -- -1001234567890 3
+
+Moving a group first copies its rows into the target shard and commits, then deletes them
+from the source shard. A run interrupted between the two steps is safe to repeat.
+"""
+import os
+import sys
+import sqlite3
+import argparse
+from contextlib import closing
+from typing import Dict, List, Set
+
+# The bot's configuration requires a token even though nothing here talks to Telegram
+os.environ.setdefault('BOT_TOKEN', '0:shard-tool')
+
+from config import config
+from database import DatabaseManager
+from sharding import ShardRouter, shard_paths, load_shard_map, save_shard_map
+
+# quest_id is remapped when quests move, so quests must be copied before the rows that reference them
+TABLE_ORDER = ['quests', 'user_quests']
+
+def group_tables(conn: sqlite3.Connection) -> List[str]:
+    """Every table with a group_id column, parents first"""
+    tables = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+    )]
+    tables = [t for t in tables if 'group_id' in (column[1] for column in conn.execute(f"PRAGMA table_info({t})"))]
+    return sorted(tables, key=lambda t: (TABLE_ORDER.index(t) if t in TABLE_ORDER else len(TABLE_ORDER), t))
+
+def copy_columns(conn: sqlite3.Connection, table: str) -> List[str]:
+    """Columns to copy; a lone INTEGER PRIMARY KEY is a rowid and gets a fresh value in the target"""
+    columns = list(conn.execute(f"PRAGMA table_info({table})"))
+    key_columns = [column for column in columns if column[5]]
+    skipped = key_columns[0][1] if len(key_columns) == 1 and key_columns[0][2].upper() == 'INTEGER' else None
+    return [column[1] for column in columns if column[1] != skipped]
+
+def groups_in(path: str) -> Set[str]:
+    with closing(sqlite3.connect(path)) as conn:
+        groups = set()
+        for table in group_tables(conn):
+            groups.update(row[0] for row in conn.execute(f"SELECT DISTINCT group_id FROM {table}") if row[0] is not None)
+        return groups
+
+def move_group(group_id: str, source: str, target: str) -> Dict[str, int]:
+    """Move every row of a group from one shard file to another"""
+    moved = {}
+    conn = sqlite3.connect(target, isolation_level=None)
+    try:
+        conn.execute("ATTACH DATABASE ? AS src", (source,))
+        
+        # Step 1: replace whatever an interrupted earlier run left in the target with a fresh copy
+        conn.execute("BEGIN IMMEDIATE")
+        quest_ids: Dict[int, int] = {}
+        for table in reversed(group_tables(conn)):
+            conn.execute(f"DELETE FROM main.{table} WHERE group_id = ?", (group_id,))
+        for table in group_tables(conn):
+            columns = copy_columns(conn, table)
+            column_list = ", ".join(columns)
+            if table == 'quests':
+                rows = conn.execute(
+                    f"SELECT quest_id, {column_list} FROM src.quests WHERE group_id = ?", (group_id,)
+                ).fetchall()
+                for old_id, *values in rows:
+                    cursor = conn.execute(
+                        f"INSERT INTO main.quests ({column_list}) VALUES ({', '.join('?' for _ in columns)})",
+                        values
+                    )
+                    quest_ids[old_id] = cursor.lastrowid
+                moved[table] = len(rows)
+            elif table == 'user_quests':
+                rows = conn.execute(
+                    f"SELECT {column_list} FROM src.user_quests WHERE group_id = ?", (group_id,)
+                ).fetchall()
+                quest_index = columns.index('quest_id')
+                remapped = []
+                for row in rows:
+                    row = list(row)
+                    if row[quest_index] in quest_ids:
+                        row[quest_index] = quest_ids[row[quest_index]]
+                        remapped.append(row)
+                conn.executemany(
+                    f"INSERT INTO main.user_quests ({column_list}) VALUES ({', '.join('?' for _ in columns)})",
+                    remapped
+                )
+                moved[table] = len(remapped)
+            else:
+                cursor = conn.execute(
+                    f"INSERT INTO main.{table} ({column_list}) SELECT {column_list} FROM src.{table} WHERE group_id = ?",
+                    (group_id,)
+                )
+                moved[table] = cursor.rowcount
+        conn.execute("COMMIT")
+        
+        # Step 2: the copy is durable, so the source rows can go
+        conn.execute("BEGIN IMMEDIATE")
+        for table in reversed(group_tables(conn)):
+            conn.execute(f"DELETE FROM src.{table} WHERE group_id = ?", (group_id,))
+        conn.execute("COMMIT")
+    except sqlite3.Error:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    return moved
+
+def rebalance(db_file: str, from_shards: int, to_shards: int, mapping: Dict[str, int]) -> int:
+    """Move every group that does not live on the shard the new layout routes it to"""
+    manager = DatabaseManager(db_file, workers=1, shards=to_shards, shard_map=mapping)
+    manager.migrate_database()
+    router = ShardRouter(to_shards, mapping)
+    
+    moves = 0
+    for source_index, source in enumerate(shard_paths(db_file, max(from_shards, to_shards))):
+        if not os.path.exists(source):
+            continue
+        for group_id in sorted(groups_in(source)):
+            target_index = router.shard_for(group_id)
+            if target_index == source_index:
+                continue
+            moved = move_group(group_id, source, manager.db_files[target_index])
+            moves += 1
+            print(f"group {group_id}: shard {source_index} -> {target_index} {moved}")
+    
+    for path in shard_paths(db_file, max(from_shards, to_shards))[to_shards:]:
+        if os.path.exists(path):
+            print(f"{path} is no longer used and can be removed once you have checked it is empty")
+    manager.shutdown()
+    return moves
+
+def status(db_file: str, shards: int):
+    for index, path in enumerate(shard_paths(db_file, shards)):
+        if not os.path.exists(path):
+            print(f"shard {index}: {path} (missing)")
+            continue
+        with closing(sqlite3.connect(path)) as conn:
+            users = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+            groups = conn.execute("SELECT COUNT(DISTINCT group_id) FROM users").fetchone()[0]
+        size = os.path.getsize(path)
+        print(f"shard {index}: {path} groups={groups} users={users} size={size / 1024 / 1024:.1f} MiB")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=config.db_file, help="base database file (shard 0)")
+    parser.add_argument('--map', default=config.db_shard_map, help="JSON file pinning groups to shards")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    status_parser = subparsers.add_parser('status', help="groups, users and size per shard")
+    status_parser.add_argument('--shards', type=int, default=config.db_shards)
+    
+    rebalance_parser = subparsers.add_parser('rebalance', help="change the shard count or apply the map")
+    rebalance_parser.add_argument('--from-shards', type=int, default=config.db_shards,
+                                  help="shard count the data currently uses")
+    rebalance_parser.add_argument('--shards', type=int, required=True, help="shard count to move to")
+    
+    move_parser = subparsers.add_parser('move', help="pin one group to a shard and move its rows")
+    move_parser.add_argument('group_id')
+    move_parser.add_argument('shard', type=int)
+    move_parser.add_argument('--shards', type=int, default=config.db_shards)
+    
+    args = parser.parse_args()
+    mapping = load_shard_map(args.map)
+    
+    if args.command == 'status':
+        status(args.db, args.shards)
+    elif args.command == 'rebalance':
+        moves = rebalance(args.db, args.from_shards, args.shards, mapping)
+        print(f"moved {moves} groups; start the bot with DB_SHARDS={args.shards}")
+    elif args.command == 'move':
+        if not args.map:
+            sys.exit("move needs --map (or DB_SHARD_MAP) to record where the group now lives")
+        if not 0 <= args.shard < args.shards:
+            sys.exit(f"shard must be between 0 and {args.shards - 1}")
+        mapping[args.group_id] = args.shard
+        save_shard_map(args.map, mapping)
+        rebalance(args.db, args.shards, args.shards, mapping)
+
+if __name__ == '__main__':
+    main()
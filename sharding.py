@@ -0,0 +1,46 @@
+import os
+import json
+import zlib
+import logging
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+def shard_paths(db_file: str, shards: int) -> List[str]:
+    """Database file of every shard; shard 0 is the unsharded file itself"""
+    stem, ext = os.path.splitext(db_file)
+    return [db_file] + [f"{stem}.shard{index}{ext or '.db'}" for index in range(1, shards)]
+
+def load_shard_map(path: Optional[str]) -> Dict[str, int]:
+    """Read a {group_id: shard} JSON mapping; a missing file is an empty mapping"""
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return {str(group_id): int(shard) for group_id, shard in json.load(f).items()}
+
+def save_shard_map(path: str, mapping: Dict[str, int]):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(mapping, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+class ShardRouter:
+    """Maps a group to its shard: explicit mapping first, then a stable hash of the group id"""
+    
+    def __init__(self, shards: int, mapping: Optional[Dict[str, int]] = None):
+        self.shards = max(1, shards)
+        self.mapping = {
+            group_id: shard for group_id, shard in (mapping or {}).items()
+            if 0 <= shard < self.shards
+        }
+        if mapping and len(self.mapping) != len(mapping):
+            logger.warning(f"Ignoring {len(mapping) - len(self.mapping)} shard map entries outside 0..{self.shards - 1}")
+    
+    def shard_for(self, group_id: str) -> int:
+        if self.shards == 1:
+            return 0
+        shard = self.mapping.get(group_id)
+        if shard is not None:
+            return shard
+        # crc32 rather than hash(): the result must not change between processes or restarts
+        return zlib.crc32(str(group_id).encode()) % self.shards
@@ -0,0 +1,25 @@
+import os
+import sys
+import uuid
+import pytest
+
+# The modules under test live at the repository root and read their configuration on import
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('BOT_TOKEN', '0:tests')
+os.environ.setdefault('LOG_FILE', '')
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """A migrated database on a temporary file, used by the services in place of the bot's own"""
+    import services
+    from database import DatabaseManager
+    manager = DatabaseManager(db_file=str(tmp_path / 'bot.db'), shards=1, shard_map={})
+    manager.migrate_database()
+    monkeypatch.setattr(services, 'db_manager', manager)
+    yield manager
+    manager.shutdown()
+
+@pytest.fixture
+def group_id():
+    # The caches are process-wide, so every test plays in a group of its own
+    return f'-100{uuid.uuid4().int % 10**9}'
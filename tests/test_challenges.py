@@ -0,0 +1,151 @@
+import threading
+import pytest
+import challenge_registry as registry_module
+from challenge_registry import ChallengeRegistry, PendingChallenge
+from services import ChallengeService
+
+class Clock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+    
+    def time(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(registry_module, 'time', clock)
+    return clock
+
+def _add_users(db, group_id, **lengths):
+    with db.get_connection(group_id) as conn:
+        conn.executemany(
+            "INSERT INTO users (user_id, group_id, username, length) VALUES (?, ?, ?, ?)",
+            [(user_id, group_id, f'user{user_id}', length) for user_id, length in lengths.items()]
+        )
+        db.commit(conn)
+
+def _open(group_id, amount=10):
+    registry = ChallengeRegistry(ttl=60, max_pending=100)
+    pending, discarded = registry.create('1', '2', group_id, amount)
+    ChallengeService.save_pending(pending, discarded)
+    return registry, pending
+
+def _outcome(db, group_id):
+    with db.get_connection(group_id) as conn:
+        lengths = dict(conn.execute("SELECT user_id, length FROM users WHERE group_id = ?", (group_id,)).fetchall())
+        played = conn.execute("SELECT COUNT(*) FROM challenge_history WHERE group_id = ?", (group_id,)).fetchone()[0]
+        pending = conn.execute("SELECT COUNT(*) FROM pending_challenges WHERE group_id = ?", (group_id,)).fetchone()[0]
+    return lengths, played, pending
+
+def test_accept_twice_plays_once(db, group_id):
+    _add_users(db, group_id, **{'1': 50, '2': 50})
+    _, pending = _open(group_id)
+    
+    accepted, _, result = ChallengeService.accept_challenge(pending)
+    assert accepted
+    assert not ChallengeService.accept_challenge(pending)[0]
+    
+    winner_id, loser_id, winner_length, loser_length = result
+    lengths, played, left = _outcome(db, group_id)
+    assert lengths == {winner_id: 60, loser_id: 40}
+    assert (winner_length, loser_length) == (60, 40)
+    assert (played, left) == (1, 0)
+
+def test_concurrent_accepts_play_once(db, group_id):
+    _add_users(db, group_id, **{'1': 50, '2': 50})
+    _, pending = _open(group_id)
+    threads = 8
+    barrier = threading.Barrier(threads)
+    results = []
+    
+    def accept():
+        barrier.wait()
+        results.append(ChallengeService.accept_challenge(pending)[0])
+    
+    workers = [threading.Thread(target=accept) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    
+    lengths, played, _ = _outcome(db, group_id)
+    assert results.count(True) == 1
+    assert sorted(lengths.values()) == [40, 60]
+    assert played == 1
+
+def test_accept_rechecks_lengths(db, group_id):
+    _add_users(db, group_id, **{'1': 50, '2': 50})
+    _, pending = _open(group_id, amount=30)
+    # The challenger lost length between opening the challenge and its acceptance
+    with db.get_connection(group_id) as conn:
+        conn.execute("UPDATE users SET length = 20 WHERE user_id = '1' AND group_id = ?", (group_id,))
+        db.commit(conn)
+    
+    assert not ChallengeService.accept_challenge(pending)[0]
+    assert _outcome(db, group_id) == ({'1': 20, '2': 50}, 0, 0)
+
+def test_take_is_first_caller_only(clock):
+    registry = ChallengeRegistry(ttl=60, max_pending=10)
+    pending, _ = registry.create('1', '2', 'g', 10)
+    
+    assert registry.take(pending.token) is pending
+    assert registry.take(pending.token) is None
+    assert registry.get(pending.token) is None
+
+def test_expired_token_is_refused(clock):
+    registry = ChallengeRegistry(ttl=60, max_pending=10)
+    pending, _ = registry.create('1', '2', 'g', 10)
+    
+    clock.now += 61
+    assert registry.get(pending.token) is None
+    assert registry.take(pending.token) is None
+    assert len(registry) == 0
+
+def test_sweep_drops_only_expired(clock):
+    registry = ChallengeRegistry(ttl=60, max_pending=10)
+    old, _ = registry.create('1', '2', 'g', 10)
+    clock.now += 30
+    new, _ = registry.create('3', '4', 'g', 10)
+    
+    clock.now += 31
+    assert registry.sweep() == [old]
+    assert registry.get(new.token) is new
+
+def test_new_challenge_replaces_same_pair(clock):
+    registry = ChallengeRegistry(ttl=60, max_pending=10)
+    first, _ = registry.create('1', '2', 'g', 10)
+    second, discarded = registry.create('1', '2', 'g', 15)
+    
+    assert discarded == [first]
+    assert registry.get(first.token) is None
+    assert registry.get(second.token) is second
+    # The same players in another group, or the other way round, are separate challenges
+    assert registry.create('2', '1', 'g', 10)[1] == []
+    assert registry.create('1', '2', 'h', 10)[1] == []
+
+def test_max_pending_evicts_oldest(clock):
+    registry = ChallengeRegistry(ttl=60, max_pending=2)
+    first, _ = registry.create('1', '2', 'g', 10)
+    second, _ = registry.create('3', '4', 'g', 10)
+    third, discarded = registry.create('5', '6', 'g', 10)
+    
+    assert discarded == [first]
+    assert len(registry) == 2
+    assert registry.get(second.token) is second and registry.get(third.token) is third
+
+def test_restore_orders_by_expiry_and_drops_overflow(clock):
+    registry = ChallengeRegistry(ttl=60, max_pending=2)
+    challenges = [
+        PendingChallenge('c', '5', '6', 'g', 10, clock.now + 30),
+        PendingChallenge('a', '1', '2', 'g', 10, clock.now + 10),
+        PendingChallenge('b', '3', '4', 'g', 10, clock.now + 20),
+        PendingChallenge('x', '7', '8', 'g', 10, clock.now - 1)
+    ]
+    
+    restored, discarded = registry.restore(challenges)
+    
+    # The expired one is swept and the earliest-expiring live one makes room for the rest
+    assert restored == 2
+    assert sorted(challenge.token for challenge in discarded) == ['a', 'x']
+    assert registry.get('b') is not None and registry.get('c') is not None
@@ -0,0 +1,16 @@
+import pytest
+from config import BotConfig
+
+def test_defaults_are_valid():
+    config = BotConfig(token='0:tests', db_journal_mode='wal')
+    assert (config.update_mode, config.db_journal_mode, config.db_synchronous) == ('polling', 'WAL', 'NORMAL')
+
+@pytest.mark.parametrize('field, value', [
+    ('update_mode', 'webhooks'),
+    ('db_write_mode', 'batch'),
+    ('db_journal_mode', 'WAL; DROP TABLE users'),
+    ('db_synchronous', 'SOMETIMES')
+])
+def test_unknown_values_are_rejected(field, value):
+    with pytest.raises(ValueError):
+        BotConfig(token='0:tests', **{field: value})
@@ -0,0 +1,41 @@
+import threading
+from services import UserService
+
+def test_concurrent_grows_apply_once(db, group_id):
+    threads = 8
+    barrier = threading.Barrier(threads)
+    results = []
+    
+    def grow():
+        barrier.wait()
+        results.append(UserService.grow_user('1', group_id, 'name'))
+    
+    workers = [threading.Thread(target=grow) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    
+    grown = [result for result in results if result[0]]
+    assert len(results) == threads
+    assert len(grown) == 1
+    growth = grown[0][2]
+    assert UserService.get_user_stats('1', group_id).length == growth
+    assert all(result[3] == growth for result in results)
+
+def test_second_grow_same_day_is_refused(db, group_id):
+    assert UserService.grow_user('1', group_id, 'name')[0]
+    length = UserService.get_user_stats('1', group_id).length
+    
+    grown, _, growth, new_length = UserService.grow_user('1', group_id, 'name')
+    assert (grown, growth, new_length) == (False, 0, length)
+    assert UserService.get_user_stats('1', group_id).length == length
+
+def test_refused_grow_still_updates_username(db, group_id):
+    UserService.grow_user('1', group_id, 'old')
+    length = UserService.get_user_stats('1', group_id).length
+    
+    assert not UserService.grow_user('1', group_id, 'new')[0]
+    user = UserService.get_user_stats('1', group_id)
+    assert (user.username, user.length) == ('new', length)
+    assert UserService.get_user_rank('1', group_id)[1].username == 'new'
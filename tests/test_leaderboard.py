@@ -0,0 +1,118 @@
+import asyncio
+from types import SimpleNamespace
+from config import config
+from handlers import CommandHandlers
+from leaderboard import GroupRanking, LeaderboardCache
+from models import User
+from services import UserService
+
+def _add_users(db, group_id, lengths):
+    with db.get_connection(group_id) as conn:
+        conn.executemany(
+            "INSERT INTO users (user_id, group_id, username, length) VALUES (?, ?, ?, ?)",
+            [(user_id, group_id, f'user{user_id}', length) for user_id, length in lengths.items()]
+        )
+        db.commit(conn)
+
+def test_pages_split_the_ranking(db, group_id):
+    _add_users(db, group_id, {f'{i:02d}': 100 - i for i in range(25)})
+    
+    users, page, total_pages = UserService.get_leaderboard_page(group_id, 1, 10)
+    assert (page, total_pages) == (1, 3)
+    assert [user.user_id for user in users] == [f'{i:02d}' for i in range(10)]
+    
+    # The last page only holds what is left
+    users, page, _ = UserService.get_leaderboard_page(group_id, 3, 10)
+    assert page == 3
+    assert [user.user_id for user in users] == [f'{i:02d}' for i in range(20, 25)]
+
+def test_out_of_range_pages_are_clamped(db, group_id):
+    _add_users(db, group_id, {f'{i:02d}': 100 - i for i in range(25)})
+    
+    assert UserService.get_leaderboard_page(group_id, 99, 10)[1:] == (3, 3)
+    assert UserService.get_leaderboard_page(group_id, 0, 10)[1:] == (1, 3)
+    assert UserService.get_leaderboard_page(group_id, -5, 10)[1:] == (1, 3)
+
+def test_empty_group_has_one_empty_page(db, group_id):
+    assert UserService.get_leaderboard_page(group_id, 2, 10) == ([], 1, 1)
+
+def test_rank_orders_ties_by_user_id(db, group_id):
+    _add_users(db, group_id, {'c': 30, 'b': 30, 'a': 10, 'd': 50})
+    
+    position, user, above, total = UserService.get_user_rank('c', group_id)
+    assert (position, user.user_id, above.user_id, total) == (3, 'c', 'b', 4)
+    assert UserService.get_user_rank('d', group_id)[0::2] == (1, None)
+    assert UserService.get_user_rank('a', group_id)[0] == 4
+    assert UserService.get_user_rank('nobody', group_id) == (None, None, None, 4)
+
+class FakeQuery:
+    def __init__(self, data, chat_id):
+        self.data = data
+        self.message = SimpleNamespace(chat=SimpleNamespace(id=chat_id))
+        self.edits = []
+        self.answers = []
+    
+    async def edit_message_text(self, text, reply_markup=None):
+        self.edits.append((text, reply_markup))
+    
+    async def answer(self, text=None, show_alert=False):
+        self.answers.append(text)
+
+def test_out_of_range_page_callback_shows_last_page(db, group_id, monkeypatch):
+    monkeypatch.setattr(config, 'leaderboard_limit', 10)
+    _add_users(db, group_id, {f'{i:02d}': 100 - i for i in range(25)})
+    query = FakeQuery('leaderboard_99', int(group_id))
+    
+    asyncio.run(CommandHandlers.handle_leaderboard_callback(SimpleNamespace(callback_query=query), None))
+    
+    (text, markup), = query.edits
+    assert 'user24' in text and 'user19' not in text
+    assert '3 از 3' in text
+    # Only a button back, and the callback is answered exactly once
+    assert [button.callback_data for button in markup.inline_keyboard[0]] == ['leaderboard_2']
+    assert query.answers == [None]
+
+def _user(user_id, length, group_id='g'):
+    return User(user_id=user_id, group_id=group_id, username=f'user{user_id}', length=length)
+
+def test_ranking_reorders_on_upsert():
+    ranking = GroupRanking([_user('a', 10), _user('b', 20), _user('c', 30)])
+    assert [ranking.rank(user_id) for user_id in 'abc'] == [3, 2, 1]
+    
+    ranking.upsert(_user('a', 40))
+    assert [ranking.rank(user_id) for user_id in 'abc'] == [1, 3, 2]
+    # The old position is removed rather than left behind
+    assert len(ranking) == 3
+    assert [user.user_id for user in ranking.page(0, 10)] == ['a', 'c', 'b']
+    
+    ranking.upsert(_user('d', 5))
+    assert (ranking.rank('d'), len(ranking)) == (4, 4)
+    assert ranking.rank('nobody') is None
+
+def test_ranking_breaks_ties_by_user_id():
+    ranking = GroupRanking([_user('b', 20), _user('c', 20)])
+    ranking.upsert(_user('a', 20))
+    
+    assert [user.user_id for user in ranking.page(0, 10)] == ['a', 'b', 'c']
+    assert [ranking.rank(user_id) for user_id in 'abc'] == [1, 2, 3]
+    
+    ranking.upsert(_user('b', 19))
+    assert [user.user_id for user in ranking.page(0, 10)] == ['a', 'c', 'b']
+
+def test_cache_update_of_unknown_user_without_username_reloads_group():
+    cache = LeaderboardCache(max_groups=10)
+    rows = [_user('a', 10)]
+    loader = lambda group_id: list(rows)
+    cache.get_ranking('g', loader)
+    
+    rows.append(_user('b', 50))
+    cache.update_user('g', 'b', length=50)
+    
+    assert cache.rank('g', 'b', loader)[:2] == (1, rows[1])
+
+def test_invalidate_removes_group():
+    cache = LeaderboardCache(max_groups=10)
+    cache.get_ranking('g', lambda group_id: [_user('a', 10)])
+    cache.invalidate('g')
+    
+    assert len(cache.get_ranking('g', lambda group_id: [])) == 0
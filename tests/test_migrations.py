@@ -0,0 +1,85 @@
+import sqlite3
+import pytest
+import database
+from database import DatabaseManager
+from migrations import MIGRATIONS
+from services import GroupService, QuestService
+
+UNIQUE_QUESTS_VERSION = 5
+
+@pytest.fixture
+def manager(tmp_path):
+    manager = DatabaseManager(db_file=str(tmp_path / 'bot.db'), shards=1, shard_map={})
+    yield manager
+    manager.shutdown()
+
+def _insert_quest(conn, quest_id, group_id, title, target_value=3):
+    conn.execute("""
+        INSERT INTO quests (quest_id, group_id, title, description, reward, quest_type, target_value)
+        VALUES (?, ?, ?, '', 10, 'challenges_won', ?)
+    """, (quest_id, group_id, title, target_value))
+
+def test_unique_group_quests_merges_duplicates(manager, monkeypatch):
+    # A database from before the migration, where /start had inserted the default quests twice
+    monkeypatch.setattr(database, 'MIGRATIONS', [m for m in MIGRATIONS if m[0] < UNIQUE_QUESTS_VERSION])
+    manager.migrate_database()
+    with manager.connect_direct() as conn:
+        _insert_quest(conn, 1, 'g', 'A')
+        _insert_quest(conn, 2, 'g', 'B')
+        _insert_quest(conn, 3, 'g', 'A')
+        _insert_quest(conn, 4, 'h', 'A')
+        conn.executemany("""
+            INSERT INTO user_quests (user_id, group_id, quest_id, progress, completed, completed_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, [
+            ('u1', 'g', 1, 2, 0, None),
+            ('u1', 'g', 3, 3, 1, '2024-01-01 00:00:00'),
+            ('u2', 'g', 3, 1, 0, None),
+            ('u3', 'h', 4, 1, 0, None)
+        ])
+        conn.commit()
+    
+    monkeypatch.setattr(database, 'MIGRATIONS', MIGRATIONS)
+    manager.migrate_database()
+    
+    with manager.connect_direct() as conn:
+        quests = conn.execute("SELECT quest_id, group_id, title FROM quests ORDER BY quest_id").fetchall()
+        assert [tuple(row) for row in quests] == [(1, 'g', 'A'), (2, 'g', 'B'), (4, 'h', 'A')]
+        progress = conn.execute("""
+            SELECT user_id, quest_id, progress, completed, completed_at FROM user_quests ORDER BY user_id
+        """).fetchall()
+        assert [tuple(row) for row in progress] == [
+            ('u1', 1, 3, 1, '2024-01-01 00:00:00'),
+            ('u2', 1, 1, 0, None),
+            ('u3', 4, 1, 0, None)
+        ]
+        groups = conn.execute("SELECT group_id FROM group_settings ORDER BY group_id").fetchall()
+        assert [row['group_id'] for row in groups] == ['g', 'h']
+        with pytest.raises(sqlite3.IntegrityError):
+            _insert_quest(conn, 5, 'g', 'B')
+        assert conn.execute("SELECT MAX(version) FROM schema_version").fetchone()[0] == MIGRATIONS[-1][0]
+
+def test_migrations_are_idempotent(manager):
+    manager.migrate_database()
+    manager.migrate_database()
+    with manager.connect_direct() as conn:
+        versions = [row[0] for row in conn.execute("SELECT version FROM schema_version ORDER BY version")]
+    assert versions == [version for version, _, _ in MIGRATIONS]
+
+def test_bootstrap_runs_once(db, group_id):
+    assert GroupService.bootstrap_group(group_id, 'group')
+    assert not GroupService.bootstrap_group(group_id, 'group')
+    
+    quests = QuestService.get_all_quests(group_id)
+    assert len(quests) == 3
+    assert len({quest.title for quest in quests}) == 3
+    assert GroupService.get_settings(group_id).created_at is not None
+
+def test_bootstrap_skips_groups_registered_by_the_migration(db, group_id):
+    with db.get_connection(group_id) as conn:
+        _insert_quest(conn, None, group_id, 'custom')
+        conn.execute("INSERT INTO group_settings (group_id) VALUES (?)", (group_id,))
+        db.commit(conn)
+    
+    assert not GroupService.bootstrap_group(group_id)
+    assert [quest.title for quest in QuestService.get_all_quests(group_id)] == ['custom']
@@ -0,0 +1,23 @@
+import sqlite3
+import pytest
+from database import DatabaseManager
+from migrations import HOT_QUERIES, unindexed_plan_steps
+
+@pytest.fixture
+def manager(tmp_path):
+    manager = DatabaseManager(db_file=str(tmp_path / 'bot.db'), shards=1, shard_map={})
+    manager.migrate_database()
+    yield manager
+    manager.shutdown()
+
+def test_hot_queries_use_indexes(manager):
+    assert HOT_QUERIES
+    assert manager.check_query_plans() == {}
+
+def test_unindexed_query_is_reported():
+    conn = sqlite3.connect(':memory:')
+    conn.execute("CREATE TABLE users (user_id TEXT, group_id TEXT, length INTEGER)")
+    steps = unindexed_plan_steps(conn.cursor(), "SELECT * FROM users WHERE group_id = ? ORDER BY length DESC", ('g',))
+    assert any(step.startswith('SCAN') for step in steps)
+    assert any('TEMP B-TREE' in step for step in steps)
+    conn.close()
@@ -0,0 +1,30 @@
+import sqlite3
+import pytest
+from query_trace import TracingConnection, TracingCursor, query_tracer
+
+@pytest.fixture
+def conn():
+    query_tracer.reset()
+    conn = sqlite3.connect(':memory:', factory=TracingConnection)
+    yield conn
+    conn.close()
+    query_tracer.reset()
+
+def _calls(sql: str) -> int:
+    return sum(stats['calls'] for stats in query_tracer.top(100) if stats['sql'] == sql)
+
+def test_connection_execute_is_traced(conn):
+    assert isinstance(conn.execute("SELECT 1"), TracingCursor)
+    conn.execute("CREATE TABLE pending (token TEXT PRIMARY KEY)")
+    conn.executemany("INSERT INTO pending (token) VALUES (?)", [('a',), ('b',)])
+    conn.execute("DELETE FROM pending WHERE token = ?", ('a',))
+    assert _calls("SELECT ?") == 1
+    assert _calls("INSERT INTO pending (token) VALUES (?)") == 1
+    assert _calls("DELETE FROM pending WHERE token = ?") == 1
+    assert query_tracer.top(100)[0]['callers']
+
+def test_fetched_rows_are_counted(conn):
+    conn.execute("CREATE TABLE pending (token TEXT PRIMARY KEY)")
+    conn.executemany("INSERT INTO pending (token) VALUES (?)", [('a',), ('b',)])
+    conn.execute("SELECT token FROM pending").fetchall()
+    assert [stats['rows'] for stats in query_tracer.top(100) if stats['sql'] == "SELECT token FROM pending"] == [2]
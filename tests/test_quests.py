@@ -0,0 +1,69 @@
+from services import QuestService, GroupService
+
+def _add_user(db, user_id, group_id, length=0):
+    with db.get_connection(group_id) as conn:
+        conn.execute(
+            "INSERT INTO users (user_id, group_id, username, length) VALUES (?, ?, ?, ?)",
+            (user_id, group_id, f'user{user_id}', length)
+        )
+        db.commit(conn)
+
+def _apply(db, user_id, group_id, event):
+    changes = []
+    with db.get_connection(group_id) as conn:
+        reward = QuestService.apply_event(conn.cursor(), user_id, group_id, event, changes)
+        db.commit(conn)
+    return reward
+
+def _state(db, user_id, group_id, quest_type):
+    with db.get_connection(group_id) as conn:
+        length = conn.execute(
+            "SELECT length FROM users WHERE user_id = ? AND group_id = ?", (user_id, group_id)
+        ).fetchone()['length']
+        row = conn.execute("""
+            SELECT uq.progress, uq.completed FROM user_quests uq JOIN quests q USING (quest_id)
+            WHERE uq.user_id = ? AND uq.group_id = ? AND q.quest_type = ?
+        """, (user_id, group_id, quest_type)).fetchone()
+    return length, row['progress'], bool(row['completed'])
+
+def test_counter_quest_completes_once(db, group_id):
+    GroupService.bootstrap_group(group_id)
+    _add_user(db, '1', group_id, length=10)
+    
+    # 'قهرمان چالش': three challenge wins, 30 cm
+    assert [_apply(db, '1', group_id, {'challenges_won': 1}) for _ in range(3)] == [0, 0, 30]
+    assert _state(db, '1', group_id, 'challenges_won') == (40, 3, True)
+    
+    assert _apply(db, '1', group_id, {'challenges_won': 1}) == 0
+    assert _state(db, '1', group_id, 'challenges_won') == (40, 3, True)
+
+def test_level_quest_completes_once(db, group_id):
+    GroupService.bootstrap_group(group_id)
+    _add_user(db, '1', group_id, length=10)
+    
+    # 'کیر کلفت': reach 100 cm, 50 cm; progress keeps the highest level seen
+    assert _apply(db, '1', group_id, {'total_length': 60}) == 0
+    assert _apply(db, '1', group_id, {'total_length': 40}) == 0
+    assert _state(db, '1', group_id, 'total_length') == (10, 60, False)
+    assert _apply(db, '1', group_id, {'total_length': 120}) == 50
+    assert _state(db, '1', group_id, 'total_length') == (60, 120, True)
+    
+    assert _apply(db, '1', group_id, {'total_length': 150}) == 0
+    assert _state(db, '1', group_id, 'total_length') == (60, 120, True)
+
+def test_one_event_pays_every_quest_it_completes(db, group_id):
+    GroupService.bootstrap_group(group_id)
+    _add_user(db, '1', group_id)
+    for _ in range(2):
+        _apply(db, '1', group_id, {'challenges_won': 1})
+    
+    assert _apply(db, '1', group_id, {'challenges_won': 1, 'total_length': 100}) == 80
+    assert _state(db, '1', group_id, 'challenges_won') == (80, 3, True)
+    assert _state(db, '1', group_id, 'total_length') == (80, 100, True)
+
+def test_quests_disabled_for_group(db, group_id):
+    GroupService.bootstrap_group(group_id)
+    GroupService.update_settings(group_id, quests_enabled=False)
+    _add_user(db, '1', group_id)
+    
+    assert _apply(db, '1', group_id, {'total_length': 500}) == 0
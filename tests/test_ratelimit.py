@@ -0,0 +1,104 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+from telegram.ext import ApplicationHandlerStop
+from ratelimit import RateLimiter, parse_rate_limits, command_of
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+    
+    def __call__(self) -> float:
+        return self.now
+
+def _limiter(user='grow=2/60,*=3/30', chat='*=5/60', max_buckets=100):
+    clock = Clock()
+    return RateLimiter(parse_rate_limits(user), parse_rate_limits(chat), max_buckets=max_buckets, clock=clock), clock
+
+def test_parse_rate_limits_skips_malformed_items():
+    assert parse_rate_limits('Grow=3/60, *=10/30,bad,zero=0/5,x=1') == {'grow': (3.0, 60.0), '*': (10.0, 30.0)}
+
+def test_burst_then_refill():
+    limiter, clock = _limiter()
+    assert [limiter.check('grow', 'u', None) for _ in range(3)] == [None, None, 'user']
+    
+    # 2 tokens per 60 s: one comes back after 30 s, not before
+    clock.now = 29
+    assert limiter.check('grow', 'u', None) == 'user'
+    clock.now = 30
+    assert limiter.check('grow', 'u', None) is None
+    assert limiter.check('grow', 'u', None) == 'user'
+    
+    # A long pause refills only up to the burst
+    clock.now = 10000
+    assert [limiter.check('grow', 'u', None) for _ in range(3)] == [None, None, 'user']
+
+def test_buckets_are_per_user_and_command():
+    limiter, _ = _limiter()
+    for _ in range(2):
+        limiter.check('grow', 'u', None)
+    
+    assert limiter.check('grow', 'u', None) == 'user'
+    assert limiter.check('grow', 'v', None) is None
+    assert limiter.check('stats', 'u', None) is None
+
+def test_unknown_commands_share_the_wildcard_bucket():
+    limiter, _ = _limiter()
+    assert [limiter.check(command, 'u', None) for command in ('stats', 'made_up', 'quests', 'other')] == \
+        [None, None, None, 'user']
+    # No wildcard rule at all leaves other commands unlimited
+    unlimited, _ = _limiter(user='grow=1/60', chat='')
+    assert all(unlimited.check('stats', 'u', None) is None for _ in range(50))
+
+def test_chat_bucket_limits_many_users():
+    limiter, _ = _limiter(chat='*=3/60')
+    assert [limiter.check('stats', str(user), 'c') for user in range(4)] == [None, None, None, 'chat']
+    assert limiter.check('stats', '9', 'other chat') is None
+
+def test_refused_request_costs_no_tokens():
+    limiter, _ = _limiter(user='*=5/60', chat='*=1/60')
+    assert limiter.check('stats', 'u', 'c') is None
+    assert limiter.check('stats', 'u', 'c') == 'chat'
+    # The user's bucket was not charged for the refused request, so 4 remain elsewhere
+    assert [limiter.check('stats', 'u', None) for _ in range(5)] == [None] * 4 + ['user']
+
+def test_least_recently_used_bucket_is_evicted():
+    limiter, _ = _limiter(user='grow=1/60', chat='', max_buckets=2)
+    limiter.check('grow', 'a', None)
+    limiter.check('grow', 'b', None)
+    assert limiter.check('grow', 'a', None) == 'user'
+    
+    limiter.check('grow', 'c', None)
+    assert len(limiter) == 2
+    # 'a' was used more recently than 'b', so it is still empty while 'b' starts full again
+    assert limiter.check('grow', 'a', None) == 'user'
+    assert limiter.check('grow', 'b', None) is None
+
+def _callback_update(data):
+    answers = []
+    
+    async def answer(text=None, show_alert=False):
+        answers.append(text)
+    
+    query = SimpleNamespace(data=data, answer=answer)
+    update = SimpleNamespace(
+        callback_query=query, effective_message=None,
+        effective_user=SimpleNamespace(id=1), effective_chat=SimpleNamespace(id=-100)
+    )
+    return update, answers
+
+def test_command_of():
+    message = lambda text: SimpleNamespace(callback_query=None, effective_message=SimpleNamespace(text=text))
+    assert command_of(message('/Grow@kir_bot 3')) == 'grow'
+    assert command_of(message('hello')) is None
+    assert command_of(_callback_update('leaderboard_2')[0]) == 'leaderboard'
+
+def test_refused_callback_is_answered():
+    limiter, _ = _limiter(user='accept=1/60', chat='')
+    update, answers = _callback_update('accept_abc')
+    
+    asyncio.run(limiter.guard(update, None))
+    assert answers == []
+    with pytest.raises(ApplicationHandlerStop):
+        asyncio.run(limiter.guard(update, None))
+    assert len(answers) == 1 and answers[0]
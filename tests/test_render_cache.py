@@ -0,0 +1,90 @@
+import asyncio
+from types import SimpleNamespace
+from handlers import CommandHandlers, QuestHandlers
+from render_cache import RenderCache, render_cache
+from services import UserService, GroupService, QuestService
+
+class FakeMessage:
+    def __init__(self):
+        self.replies = []
+    
+    async def reply_text(self, text, reply_markup=None):
+        self.replies.append(text)
+
+def _run(handler, user_id, group_id):
+    message = FakeMessage()
+    update = SimpleNamespace(
+        effective_user=SimpleNamespace(id=int(user_id)), effective_chat=SimpleNamespace(id=int(group_id)),
+        message=message
+    )
+    asyncio.run(handler(update, None))
+    return message.replies[-1]
+
+def _set_length(db, user_id, group_id, length):
+    with db.get_connection(group_id) as conn:
+        conn.execute("UPDATE users SET length = ? WHERE user_id = ? AND group_id = ?", (length, user_id, group_id))
+        db.commit(conn)
+
+def test_stats_is_served_from_cache_until_the_group_changes(db, group_id):
+    UserService.grow_user('1', group_id, 'name')
+    _set_length(db, '1', group_id, 42)
+    render_cache.bump(group_id)
+    assert '42' in _run(CommandHandlers.stats, '1', group_id)
+    
+    # Without a bump the cached text is served, even though the row changed underneath
+    _set_length(db, '1', group_id, 77)
+    assert '42' in _run(CommandHandlers.stats, '1', group_id)
+    
+    render_cache.bump(group_id)
+    reply = _run(CommandHandlers.stats, '1', group_id)
+    assert '77' in reply and '42' not in reply
+
+def test_grow_invalidates_rendered_stats(db, group_id):
+    UserService.grow_user('1', group_id, 'name')
+    before = _run(CommandHandlers.stats, '1', group_id)
+    
+    # Let the player grow again today; the direct write itself bumps nothing
+    with db.get_connection(group_id) as conn:
+        conn.execute("UPDATE users SET last_growth = NULL WHERE user_id = '1' AND group_id = ?", (group_id,))
+        db.commit(conn)
+    new_length = UserService.grow_user('1', group_id, 'name')[3]
+    
+    after = _run(CommandHandlers.stats, '1', group_id)
+    assert f'{new_length} سانتی‌متر' in after
+    assert after != before
+
+def test_quests_reflect_progress_and_deactivation(db, group_id):
+    GroupService.bootstrap_group(group_id)
+    assert '0/5' in _run(QuestHandlers.quests, '1', group_id)
+    
+    UserService.grow_user('1', group_id, 'name')
+    reply = _run(QuestHandlers.quests, '1', group_id)
+    assert '1/5' in reply and '0/5' not in reply
+    
+    daily = next(quest for quest in QuestService.get_all_quests(group_id) if quest.quest_type == 'daily_growth')
+    QuestService.set_quest_active(daily.quest_id, group_id, False)
+    assert daily.title not in _run(QuestHandlers.quests, '1', group_id)
+
+def test_older_rendering_does_not_replace_newer():
+    cache = RenderCache(max_entries=10)
+    old = cache.version('g')
+    cache.bump('g')
+    new = cache.version('g')
+    
+    cache.put('stats', 'g', 'u', new, 'new')
+    cache.put('stats', 'g', 'u', old, 'old')
+    assert cache.get('stats', 'g', 'u') == 'new'
+    
+    # Text rendered before a bump is never served after it
+    cache.put('stats', 'g', 'v', old, 'stale')
+    assert cache.get('stats', 'g', 'v') is None
+
+def test_entries_are_evicted_least_recently_used_first():
+    cache = RenderCache(max_entries=2)
+    version = cache.version('g')
+    cache.put('stats', 'g', 'a', version, 'a')
+    cache.put('stats', 'g', 'b', version, 'b')
+    cache.get('stats', 'g', 'a')
+    cache.put('stats', 'g', 'c', version, 'c')
+    
+    assert [cache.get('stats', 'g', key) for key in 'abc'] == ['a', None, 'c']
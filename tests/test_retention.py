@@ -0,0 +1,54 @@
+import sqlite3
+import pytest
+import retention
+from config import config
+from retention import RetentionService, archive_path
+
+CUTOFF = '2024-01-01 00:00:00'
+
+@pytest.fixture
+def archive_dir(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(retention, 'db_manager', db)
+    monkeypatch.setattr(config, 'archive_dir', str(tmp_path / 'archive'))
+    return tmp_path / 'archive'
+
+def _add_challenges(db, created):
+    with db.connect_direct() as conn:
+        conn.executemany("""
+            INSERT INTO challenge_history (challenger_id, opponent_id, group_id, amount, winner_id, created_at)
+            VALUES ('1', '2', 'g', 5, '1', ?)
+        """, [(created_at,) for created_at in created])
+        conn.commit()
+
+def _hot_rows(db):
+    with db.connect_direct() as conn:
+        return [row['created_at'] for row in conn.execute("SELECT created_at FROM challenge_history ORDER BY challenge_id")]
+
+def test_old_challenges_move_to_monthly_archives(db, archive_dir):
+    _add_challenges(db, ['2023-05-02 10:00:00', '2023-06-03 10:00:00', '2024-02-01 10:00:00'])
+    
+    assert RetentionService.archive_challenge_history(0, CUTOFF, 100) == 2
+    assert _hot_rows(db) == ['2024-02-01 10:00:00']
+    for month, created_at in (('2023-05', '2023-05-02 10:00:00'), ('2023-06', '2023-06-03 10:00:00')):
+        with sqlite3.connect(archive_path(db.db_files[0], month)) as archive:
+            assert archive.execute("SELECT created_at FROM challenge_history").fetchall() == [(created_at,)]
+    
+    # Nothing left to move
+    assert RetentionService.archive_challenge_history(0, CUTOFF, 100) == 0
+
+def test_failed_copy_keeps_hot_rows_and_its_error(db, archive_dir):
+    _add_challenges(db, ['2023-05-02 10:00:00'])
+    # An archive whose table refuses the rows makes the copy fail inside its transaction
+    archive_dir.mkdir()
+    with sqlite3.connect(archive_path(db.db_files[0], '2023-05')) as archive:
+        archive.executescript("""
+            CREATE TABLE challenge_history (
+                challenge_id INTEGER PRIMARY KEY, challenger_id TEXT, opponent_id TEXT, group_id TEXT,
+                amount INTEGER, winner_id TEXT, created_at TIMESTAMP
+            );
+            CREATE TRIGGER refuse BEFORE INSERT ON challenge_history BEGIN SELECT RAISE(ABORT, 'archive refused'); END;
+        """)
+    
+    with pytest.raises(sqlite3.IntegrityError, match='archive refused'):
+        RetentionService.archive_challenge_history(0, CUTOFF, 100)
+    assert _hot_rows(db) == ['2023-05-02 10:00:00']
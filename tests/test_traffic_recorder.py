@@ -0,0 +1,43 @@
+from traffic_recorder import Anonymizer
+
+def test_new_chat_members_are_pseudonymized():
+    anonymizer = Anonymizer('salt')
+    update = {
+        'update_id': 1,
+        'message': {
+            'message_id': 7,
+            'chat': {'id': -1001234567890, 'type': 'supergroup', 'title': 'Group'},
+            'from': {'id': 111111, 'first_name': 'Alice'},
+            'new_chat_members': [
+                {'id': 222222, 'first_name': 'Bob', 'username': 'bob'},
+                {'id': 333333, 'first_name': 'Carol'}
+            ]
+        }
+    }
+    
+    message = anonymizer.scrub(update)['message']
+    members = message['new_chat_members']
+    assert [member['id'] for member in members] == [anonymizer.pseudonym_id(222222), anonymizer.pseudonym_id(333333)]
+    assert members[0]['username'] == anonymizer.pseudonym_name('bob')
+    assert message['from']['id'] == anonymizer.pseudonym_id(111111)
+    assert message['chat']['id'] < 0
+    # Message ids are not identities and must survive for replay
+    assert message['message_id'] == 7
+
+def test_ids_in_entity_lists_and_shared_users_are_pseudonymized():
+    anonymizer = Anonymizer('salt')
+    message = anonymizer.scrub({
+        'entities': [{'type': 'text_mention', 'offset': 0, 'length': 3, 'user': {'id': 444444}}],
+        'users_shared': {'request_id': 1, 'user_ids': [555555, 666666]},
+        'user_shared': {'request_id': 2, 'user_id': 777777}
+    })
+    
+    assert message['entities'][0]['user']['id'] == anonymizer.pseudonym_id(444444)
+    assert message['users_shared']['user_ids'] == [anonymizer.pseudonym_id(555555), anonymizer.pseudonym_id(666666)]
+    assert message['user_shared']['user_id'] == anonymizer.pseudonym_id(777777)
+    assert message['users_shared']['request_id'] == 1
+
+def test_challenge_tokens_are_kept():
+    anonymizer = Anonymizer('salt')
+    assert anonymizer.callback_data('accept_Ab123456Xy') == 'accept_Ab123456Xy'
+    assert anonymizer.callback_data('leaderboard_2') == 'leaderboard_2'
@@ -0,0 +1,118 @@
+import sqlite3
+import threading
+import pytest
+from config import config
+from database import DatabaseManager
+from leaderboard import leaderboard_cache
+from models import User
+
+def _load_users(manager: DatabaseManager, group_id: str):
+    with manager.get_connection(group_id) as conn:
+        rows = conn.execute("SELECT * FROM users WHERE group_id = ?", (group_id,)).fetchall()
+        return [User(**dict(row)) for row in rows]
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'db_write_mode', 'batched')
+    # Flushes only happen when the test asks for them
+    monkeypatch.setattr(config, 'db_flush_interval_ms', 3600000)
+    manager = DatabaseManager(db_file=str(tmp_path / 'bot.db'), shards=1, shard_map={})
+    manager.migrate_database()
+    yield manager
+    leaderboard_cache.invalidate('g')
+    manager.shutdown()
+
+@pytest.fixture
+def sharded(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'db_write_mode', 'batched')
+    monkeypatch.setattr(config, 'db_flush_interval_ms', 3600000)
+    manager = DatabaseManager(db_file=str(tmp_path / 'bot.db'), shards=2, shard_map={'a': 0, 'b': 1})
+    manager.migrate_database()
+    yield manager
+    manager.shutdown()
+
+def _grow(manager: DatabaseManager, length: int):
+    with manager.get_connection('g') as conn:
+        conn.execute(
+            "INSERT INTO users (user_id, group_id, username, length) VALUES ('u', 'g', 'name', ?) "
+            "ON CONFLICT (user_id, group_id) DO UPDATE SET length = excluded.length",
+            (length,)
+        )
+        manager.commit(conn)
+    leaderboard_cache.update_user('g', 'u', username='name', length=length)
+
+def test_flush_makes_writes_durable(manager):
+    leaderboard_cache.get_ranking('g', lambda group_id: _load_users(manager, group_id))
+    _grow(manager, 5)
+    manager.flush()
+    with manager.connect_direct() as conn:
+        assert conn.execute("SELECT length FROM users WHERE user_id = 'u'").fetchone()[0] == 5
+    assert leaderboard_cache.rank('g', 'u', lambda group_id: _load_users(manager, group_id))[1].length == 5
+
+def test_failed_flush_drops_unflushed_views(manager):
+    _grow(manager, 5)
+    manager.flush()
+    leaderboard_cache.get_ranking('g', lambda group_id: _load_users(manager, group_id))
+    
+    _grow(manager, 9)
+    with manager.get_connection('g') as conn:
+        # Checked only at COMMIT, so the group commit itself fails
+        conn.execute("PRAGMA defer_foreign_keys = ON")
+        conn.execute("INSERT INTO user_quests (user_id, group_id, quest_id) VALUES ('u', 'g', 999999)")
+        manager.commit(conn)
+    manager.flush()
+    
+    with manager.connect_direct() as conn:
+        assert conn.execute("SELECT length FROM users WHERE user_id = 'u'").fetchone()[0] == 5
+    assert leaderboard_cache.rank('g', 'u', lambda group_id: _load_users(manager, group_id))[1].length == 5
+
+def test_shards_are_written_concurrently(sharded):
+    inside = threading.Event()
+    release = threading.Event()
+    
+    def hold_shard_a():
+        with sharded.get_connection('a') as conn:
+            conn.execute("INSERT INTO users (user_id, group_id, username, length) VALUES ('u', 'a', 'name', 1)")
+            sharded.commit(conn)
+            inside.set()
+            release.wait(5)
+    
+    holder = threading.Thread(target=hold_shard_a)
+    holder.start()
+    try:
+        assert inside.wait(5)
+        written = threading.Event()
+        
+        def write_shard_b():
+            with sharded.get_connection('b') as conn:
+                conn.execute("INSERT INTO users (user_id, group_id, username, length) VALUES ('u', 'b', 'name', 2)")
+                sharded.commit(conn)
+            written.set()
+        
+        threading.Thread(target=write_shard_b).start()
+        # Shard b does not wait for shard a's open block
+        assert written.wait(2)
+    finally:
+        release.set()
+        holder.join()
+    
+    sharded.flush()
+    for shard, group_id in ((0, 'a'), (1, 'b')):
+        with sharded.connect_direct(shard) as conn:
+            assert conn.execute("SELECT group_id FROM users").fetchall()[0][0] == group_id
+
+def test_batch_holds_the_write_lock_from_its_first_read(manager):
+    with manager.get_connection('g') as conn:
+        conn.execute("SELECT COUNT(*) FROM users").fetchone()
+    
+    # Another writer waits for the group commit instead of invalidating the batch's snapshot
+    with manager.connect_direct() as other:
+        other.execute("PRAGMA busy_timeout = 0")
+        with pytest.raises(sqlite3.OperationalError, match='locked'):
+            other.execute("INSERT INTO users (user_id, group_id, username) VALUES ('x', 'g', 'x')")
+            other.commit()
+    
+    manager.flush()
+    with manager.connect_direct() as other:
+        other.execute("INSERT INTO users (user_id, group_id, username) VALUES ('x', 'g', 'x')")
+        other.commit()
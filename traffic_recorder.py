@@ -0,0 +1,168 @@
+import os
+import re
+import gzip
+import json
+import time
+import queue
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, Iterator, List, Optional
+from telegram import Update
+from telegram.ext import ContextTypes
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Objects whose "id" identifies a person or a chat
+_IDENTITY_KEYS = {
+    'from', 'chat', 'user', 'sender_chat', 'forward_from', 'forward_from_chat',
+    'new_chat_member', 'old_chat_member', 'new_chat_members', 'left_chat_member', 'users'
+}
+# Keys whose value is itself a user or chat id, or a list of them (user_shared, users_shared, chat_shared)
+_ID_VALUE_KEYS = {'user_id', 'user_ids', 'chat_id'}
+_NAME_KEYS = {'first_name', 'last_name', 'username', 'title'}
+_LONG_NUMBER = re.compile(r"-?\d{5,}")
+# Challenge buttons carry random server-side tokens, not ids; replay maps them to its own challenges
+_TOKEN_CALLBACKS = ('accept_', 'decline_')
+
+class Anonymizer:
+    """Replaces ids, names and free text with stable salted pseudonyms"""
+    
+    def __init__(self, salt: str):
+        self.salt = salt.encode()
+    
+    def pseudonym_id(self, value: int) -> int:
+        digest = hashlib.blake2b(str(abs(value)).encode(), key=self.salt, digest_size=6).digest()
+        # Keep the sign: negative ids are groups and the handlers care about the difference
+        pseudonym = int.from_bytes(digest, 'big') or 1
+        return -pseudonym if value < 0 else pseudonym
+    
+    def pseudonym_name(self, value: str) -> str:
+        return 'u' + hashlib.blake2b(value.encode(), key=self.salt, digest_size=4).hexdigest()
+    
+    def text(self, value: str) -> str:
+        # Commands and their arguments drive the handlers; anything else is private chatter
+        if value.startswith('/'):
+            return value
+        return 'x' * len(value)
+    
+    def callback_data(self, value: str) -> str:
+        if value.startswith(_TOKEN_CALLBACKS):
+            return value
+        return _LONG_NUMBER.sub(lambda match: str(self.pseudonym_id(int(match.group()))), value)
+    
+    def scrub(self, data: Any, identity: bool = False) -> Any:
+        if isinstance(data, list):
+            # Elements of a list of people (new_chat_members, users) are identities themselves
+            return [self.scrub(item, identity) for item in data]
+        if not isinstance(data, dict):
+            return data
+        
+        scrubbed = {}
+        for key, value in data.items():
+            if key == 'id' and identity and isinstance(value, int):
+                scrubbed[key] = self.pseudonym_id(value)
+            elif key in _ID_VALUE_KEYS and isinstance(value, int):
+                scrubbed[key] = self.pseudonym_id(value)
+            elif key in _ID_VALUE_KEYS and isinstance(value, list):
+                scrubbed[key] = [self.pseudonym_id(item) if isinstance(item, int) else item for item in value]
+            elif key in _NAME_KEYS and isinstance(value, str):
+                scrubbed[key] = self.pseudonym_name(value)
+            elif key in ('text', 'caption') and isinstance(value, str):
+                scrubbed[key] = self.text(value)
+            elif key == 'data' and isinstance(value, str):
+                scrubbed[key] = self.callback_data(value)
+            else:
+                scrubbed[key] = self.scrub(value, identity=key in _IDENTITY_KEYS)
+        return scrubbed
+
+class UpdateRecorder:
+    """Appends incoming updates to gzip-compressed JSONL files from a background thread"""
+    
+    def __init__(self, directory: str, max_bytes: int = None, rotate_seconds: int = None,
+                 anonymize: bool = None, salt: Optional[str] = None, queue_size: int = 10000):
+        self.directory = directory
+        self.max_bytes = max_bytes or config.record_max_bytes
+        self.rotate_seconds = rotate_seconds or config.record_rotate_seconds
+        anonymize = config.record_anonymize if anonymize is None else anonymize
+        salt = salt or config.record_salt
+        if anonymize and not salt:
+            # Without a configured salt pseudonyms only stay consistent within this process
+            salt = os.urandom(16).hex()
+            logger.warning("RECORD_SALT is not set; using a random salt for this run")
+        self.anonymizer = Anonymizer(salt) if anonymize else None
+        
+        self.dropped = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._file = None
+        self._file_opened = 0.0
+        self._file_bytes = 0
+        self._sequence = 0
+        os.makedirs(directory, exist_ok=True)
+        self._writer = threading.Thread(target=self._write_loop, name='update-recorder', daemon=True)
+        self._writer.start()
+    
+    async def record(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handler callback; never blocks the event loop and never stops the update"""
+        try:
+            self._queue.put_nowait((time.time(), update.to_dict()))
+        except queue.Full:
+            self.dropped += 1
+    
+    def _open_file(self):
+        if self._file is not None:
+            self._file.close()
+        # Names sort in recording order, including files rotated within the same second
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.gmtime())
+        path = os.path.join(self.directory, f"updates-{stamp}-{self._sequence:04d}.jsonl.gz")
+        while os.path.exists(path):
+            self._sequence += 1
+            path = os.path.join(self.directory, f"updates-{stamp}-{self._sequence:04d}.jsonl.gz")
+        self._sequence += 1
+        self._file = gzip.open(path, 'wt', encoding='utf-8')
+        self._file_opened = time.monotonic()
+        self._file_bytes = 0
+        logger.info(f"Recording updates to {path}")
+    
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            received_at, payload = item
+            if self.anonymizer is not None:
+                payload = self.anonymizer.scrub(payload)
+            
+            if (self._file is None or self._file_bytes >= self.max_bytes
+                    or time.monotonic() - self._file_opened >= self.rotate_seconds):
+                self._open_file()
+            line = json.dumps({'t': round(received_at, 3), 'update': payload}, ensure_ascii=False) + '\n'
+            self._file.write(line)
+            self._file_bytes += len(line)
+            if self._queue.empty():
+                self._file.flush()
+        
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+    
+    def close(self):
+        """Write out everything queued so far and close the current file"""
+        self._queue.put(None)
+        self._writer.join()
+        if self.dropped:
+            logger.warning(f"Update recorder dropped {self.dropped} updates because its queue was full")
+
+def read_recording(paths: List[str]) -> Iterator[Dict[str, Any]]:
+    """Yield recorded entries from the given files in file-name order"""
+    for path in sorted(paths):
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8') as f:
+            try:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+            except (EOFError, json.JSONDecodeError):
+                # A file cut short by a crash still replays up to its last complete line
+                logger.warning(f"{path} ends with a truncated entry")
@@ -0,0 +1,292 @@
+import zlib
+import queue
+import asyncio
+import logging
+import itertools
+import threading
+import multiprocessing
+from typing import Dict, List, Optional, Tuple
+import aiohttp
+from telegram import Update
+from telegram.error import NetworkError
+from telegram.ext import Application, ContextTypes
+from telegram.request import BaseRequest, RequestData
+from config import config
+from logging_setup import setup_worker_logging, forward_worker_logs
+from locks import KeyedLocks
+from metrics import worker_metrics, push_metrics, WORKER_RESTARTS
+
+logger = logging.getLogger(__name__)
+
+def worker_for(chat_id: str, workers: int) -> int:
+    """Worker that owns a chat; stable across processes so each group's state lives in one place"""
+    return zlib.crc32(str(chat_id).encode()) % workers
+
+def chat_key(update: Update) -> str:
+    """The chat an update belongs to, or its sender when it has no chat"""
+    if update.effective_chat is not None:
+        return str(update.effective_chat.id)
+    if update.effective_user is not None:
+        return str(update.effective_user.id)
+    return '0'
+
+class ProxyRequest(BaseRequest):
+    """Bot API transport for worker processes: every call is performed by the front process"""
+    
+    def __init__(self, worker_index: int, generation: int, calls: multiprocessing.Queue,
+                 replies: multiprocessing.Queue):
+        self.worker_index = worker_index
+        self.generation = generation
+        self._calls = calls
+        self._replies = replies
+        self._call_ids = itertools.count()
+        self._waiting: Dict[int, asyncio.Future] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._reader: Optional[threading.Thread] = None
+    
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return None
+    
+    async def initialize(self):
+        if self._reader is None:
+            self._loop = asyncio.get_running_loop()
+            self._reader = threading.Thread(target=self._read_replies, name='api-replies', daemon=True)
+            self._reader.start()
+    
+    async def shutdown(self):
+        pass
+    
+    def _read_replies(self):
+        while True:
+            reply = self._replies.get()
+            if reply is None:
+                break
+            self._loop.call_soon_threadsafe(self._resolve, *reply)
+    
+    def _resolve(self, call_id: int, status: Optional[int], payload: Optional[bytes], error: Optional[str]):
+        future = self._waiting.pop(call_id, None)
+        if future is None or future.done():
+            return
+        if error is not None:
+            future.set_exception(NetworkError(f"Front process could not reach Telegram: {error}"))
+        else:
+            future.set_result((status, payload))
+    
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None,
+                         read_timeout=None, write_timeout=None, connect_timeout=None,
+                         pool_timeout=None) -> Tuple[int, bytes]:
+        if request_data is not None and request_data.contains_files:
+            raise NetworkError("File uploads are not supported in multi-process mode")
+        
+        call_id = next(self._call_ids)
+        future = self._loop.create_future()
+        self._waiting[call_id] = future
+        params = request_data.json_parameters if request_data is not None else {}
+        self._calls.put((self.worker_index, self.generation, call_id, url, method, params))
+        return await future
+
+def worker_main(index: int, generation: int, workers: int, updates: multiprocessing.Queue,
+                calls: multiprocessing.Queue, replies: multiprocessing.Queue, logs: multiprocessing.Queue,
+                metrics: multiprocessing.Queue):
+    """Entry point of a worker process"""
+    setup_worker_logging(logs)
+    asyncio.run(_run_worker(index, generation, workers, updates, calls, replies, metrics))
+
+async def _run_worker(index: int, generation: int, workers: int, updates: multiprocessing.Queue,
+                      calls: multiprocessing.Queue, replies: multiprocessing.Queue, metrics: multiprocessing.Queue):
+    # Imported here because bot imports this module
+    from bot import error_handler, sweep_pending_challenges, reconcile_global_leaderboard
+    from database import db_manager
+    from handlers import register_handlers
+    from services import UserService, ChallengeService
+    from challenge_registry import challenge_registry
+    
+    request = ProxyRequest(index, generation, calls, replies)
+    application = Application.builder().token(config.token).request(request).get_updates_request(request).updater(None).build()
+    register_handlers(application)
+    application.add_error_handler(error_handler)
+    
+    restored, discarded = challenge_registry.restore(
+        c for c in ChallengeService.load_pending() if worker_for(c.group_id, workers) == index
+    )
+    if discarded:
+        ChallengeService.discard_pending(discarded)
+    logger.info(f"Worker {index} restored {restored} pending challenges")
+    # Every worker keeps the whole global leaderboard; other workers' changes arrive by reconciliation
+    UserService.reconcile_global_leaderboard()
+    
+    # Updates of different chats run concurrently; a chat's own updates queue on its lock in arrival order
+    chat_locks = KeyedLocks('chat')
+    slots = asyncio.Semaphore(max(1, config.concurrent_updates))
+    in_flight = set()
+    
+    async def process(update: Update):
+        try:
+            async with chat_locks.hold(chat_key(update)):
+                await application.process_update(update)
+        finally:
+            slots.release()
+    
+    loop = asyncio.get_running_loop()
+    async with application:
+        sweeper = asyncio.create_task(sweep_pending_challenges(config.challenge_sweep_seconds))
+        reconciler = asyncio.create_task(reconcile_global_leaderboard(config.global_reconcile_seconds))
+        pusher = asyncio.create_task(push_metrics(index, metrics, config.worker_metrics_seconds))
+        try:
+            while True:
+                payload = await loop.run_in_executor(None, updates.get)
+                if payload is None:
+                    break
+                await slots.acquire()
+                task = asyncio.create_task(process(Update.de_json(payload, application.bot)))
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+            await asyncio.gather(*in_flight)
+        finally:
+            sweeper.cancel()
+            reconciler.cancel()
+            pusher.cancel()
+    db_manager.shutdown()
+    logger.info(f"Worker {index} stopped")
+
+class WorkerPool:
+    """Front-process side: partitions updates by chat over worker processes and runs their API calls"""
+    
+    def __init__(self, workers: int = None):
+        self.workers = workers or config.worker_processes
+        context = multiprocessing.get_context('spawn')
+        self._context = context
+        self._updates = [context.Queue() for _ in range(self.workers)]
+        self._replies = [context.Queue() for _ in range(self.workers)]
+        self._calls = context.Queue()
+        self._logs = context.Queue(maxsize=config.log_queue_size)
+        self._metrics = context.Queue()
+        self._processes: List[multiprocessing.Process] = []
+        # Bumped on every restart so Bot API replies meant for a dead worker are dropped
+        self._generations = [0] * self.workers
+        self._restarts = [0] * self.workers
+        self._failed = set()
+        self._stopping = False
+        self._watcher: Optional[asyncio.Task] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._forwarder: Optional[asyncio.Task] = None
+        self._forwards = set()
+        self._metrics_reader: Optional[asyncio.Task] = None
+        self._log_listener = None
+    
+    async def start(self):
+        self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30))
+        self._log_listener = forward_worker_logs(self._logs)
+        self._processes = [self._spawn(index) for index in range(self.workers)]
+        self._forwarder = asyncio.create_task(self._forward_calls())
+        self._metrics_reader = asyncio.create_task(self._read_metrics())
+        self._watcher = asyncio.create_task(self._watch(config.worker_check_seconds))
+        logger.info(f"✅ Started {self.workers} worker processes")
+    
+    def _spawn(self, index: int) -> multiprocessing.Process:
+        process = self._context.Process(
+            target=worker_main, name=f'bot-worker-{index}',
+            args=(index, self._generations[index], self.workers, self._updates[index], self._calls,
+                  self._replies[index], self._logs, self._metrics)
+        )
+        process.start()
+        return process
+    
+    @property
+    def healthy(self) -> bool:
+        """False while any worker is dead, so its chats get no replies"""
+        return not self._failed and all(process.is_alive() for process in self._processes)
+    
+    async def dispatch(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handler callback: send the update to the worker that owns its chat"""
+        index = worker_for(chat_key(update), self.workers)
+        if index in self._failed:
+            # Nobody would ever read it
+            logger.warning(f"Dropping update {update.update_id}: worker {index} is down")
+            return
+        self._updates[index].put(update.to_dict())
+    
+    async def _watch(self, interval: float):
+        """Restart workers that exit on their own; give up on one that keeps dying"""
+        while not self._stopping:
+            await asyncio.sleep(interval)
+            for index, process in enumerate(self._processes):
+                if self._stopping or process.is_alive() or index in self._failed:
+                    continue
+                if self._restarts[index] >= config.worker_max_restarts:
+                    self._failed.add(index)
+                    logger.error(f"Worker {index} exited with code {process.exitcode} and was restarted "
+                                 f"{self._restarts[index]} times; its chats are no longer served")
+                    continue
+                logger.error(f"Worker {index} exited with code {process.exitcode}; restarting it")
+                self._restarts[index] += 1
+                WORKER_RESTARTS.labels(str(index)).inc()
+                self._replace_queues(index)
+                self._processes[index] = self._spawn(index)
+    
+    def _replace_queues(self, index: int):
+        # A worker killed inside Queue.get leaves the queue's read lock held, so its successor gets fresh queues
+        updates = self._context.Queue()
+        moved = 0
+        try:
+            while True:
+                updates.put(self._updates[index].get(block=False))
+                moved += 1
+        except queue.Empty:
+            pass
+        self._updates[index] = updates
+        self._replies[index] = self._context.Queue()
+        self._generations[index] += 1
+        if moved:
+            logger.info(f"Moved {moved} queued updates to the new worker {index}")
+    
+    async def _forward_calls(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            call = await loop.run_in_executor(None, self._calls.get)
+            if call is None:
+                break
+            task = asyncio.create_task(self._forward(*call))
+            self._forwards.add(task)
+            task.add_done_callback(self._forwards.discard)
+    
+    async def _read_metrics(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            pushed = await loop.run_in_executor(None, self._metrics.get)
+            if pushed is None:
+                break
+            worker_metrics.update(*pushed)
+    
+    async def _forward(self, worker_index: int, generation: int, call_id: int, url: str, method: str,
+                       params: Dict[str, str]):
+        try:
+            async with self._session.request(method, url, data=params) as response:
+                reply = (call_id, response.status, await response.read(), None)
+        except Exception as e:
+            reply = (call_id, None, None, repr(e))
+        if generation == self._generations[worker_index]:
+            self._replies[worker_index].put(reply)
+    
+    async def stop(self):
+        """Let every worker drain its queue, then stop forwarding"""
+        loop = asyncio.get_running_loop()
+        self._stopping = True
+        self._watcher.cancel()
+        for updates in self._updates:
+            updates.put(None)
+        for process in self._processes:
+            # Workers still need their API calls forwarded while they drain
+            await loop.run_in_executor(None, process.join)
+        for replies in self._replies:
+            replies.put(None)
+        self._calls.put(None)
+        self._metrics.put(None)
+        await self._forwarder
+        await self._metrics_reader
+        # Calls read before the workers exited may still be waiting on Telegram
+        await asyncio.gather(*self._forwards)
+        await self._session.close()
+        self._log_listener.stop()
+        logger.info("✅ Worker processes stopped")